@@ -1,1226 +1,1966 @@
-import tkinter as tk
-import random
-import time
-import json
-import os
-
-# 游戏设置
-COLUMNS = 5
-ROWS = 7
-SYMBOL_SET = ["A", "B", "C", "D", "E", "F", "G", "H", "I", "J", "K", "L", "M", "N", "O", "P", "Q", "R", "S", "T", "U", "V", "W", "X", "Y", "Z", "0", "1", "2", "3", "4", "5", "6", "7", "8", "9","!","@","#","$","%","^","&","*"]
-
-# 账户数据文件路径
-ACCOUNTS_FILE = "accounts.json"
-
-# 账户管理类
-class AccountManager:
-    def __init__(self):
-        self.accounts = {}
-        self.load_accounts()
-        
-    def load_accounts(self):
-        """从文件加载账户数据"""
-        if os.path.exists(ACCOUNTS_FILE):
-            try:
-                with open(ACCOUNTS_FILE, 'r') as f:
-                    self.accounts = json.load(f)
-            except:
-                self.accounts = {}
-        else:
-            # 创建默认管理员账户
-            self.accounts = {
-                "admin": {
-                    "password": "admin123",
-                    "account_type": "admin",
-                    "banned": False,
-                    "haf_coin": 999,
-                    "unlocked_features": ["scroll_speed", "auto_aim", "error_hint", "extra_life"]
-                }
-            }
-            self.save_accounts()
-    
-    def save_accounts(self):
-        """保存账户数据到文件"""
-        with open(ACCOUNTS_FILE, 'w') as f:
-            json.dump(self.accounts, f, indent=2)
-    
-    def login(self, username, password):
-        """登录验证"""
-        if username in self.accounts:
-            account = self.accounts[username]
-            if account["password"] == password:
-                if account["banned"]:
-                    return None, "账户已被封禁！"
-                return account, "登录成功！"
-            else:
-                return None, "密码错误！"
-        else:
-            return None, "用户名不存在！"
-    
-    def register(self, username, password):
-        """注册新账户"""
-        if username in self.accounts:
-            return False, "用户名已存在！"
-        
-        # 创建新账户
-        self.accounts[username] = {
-            "password": password,
-            "account_type": "user",
-            "banned": False,
-            "haf_coin": 0,
-            "unlocked_features": [],
-            "enabled_features": {}  # 初始化功能开启状态
-        }
-        self.save_accounts()
-        return True, "注册成功！"
-    
-    def ban_account(self, username):
-        """封禁账户"""
-        if username in self.accounts and self.accounts[username]["account_type"] == "user":
-            self.accounts[username]["banned"] = True
-            self.save_accounts()
-            return True
-        return False
-    
-    def unban_account(self, username):
-        """解除账户封禁"""
-        if username in self.accounts and self.accounts[username]["account_type"] == "user":
-            self.accounts[username]["banned"] = False
-            self.save_accounts()
-            return True
-        return False
-    
-    def update_account(self, username, data):
-        """更新账户信息"""
-        if username in self.accounts:
-            self.accounts[username].update(data)
-            self.save_accounts()
-            return True
-        return False
-    
-    def get_user_list(self):
-        """获取所有普通用户列表"""
-        users = []
-        for username, account in self.accounts.items():
-            if account["account_type"] == "user":
-                users.append({
-                    "username": username,
-                    "banned": account["banned"]
-                })
-        return users
-    
-    def save_player_data(self, player):
-        """保存玩家数据到账户文件"""
-        if player.username and player.username in self.accounts:
-            self.accounts[player.username] = player.to_dict()
-            self.save_accounts()
-
-# 玩家数据
-class PlayerData:
-    def __init__(self, username=None, account_type="user"):
-        self.username = username
-        self.account_type = account_type
-        self.haf_coin = 0
-        self.unlocked_features = []
-        self.enabled_features = {}
-        self.banned = False
-    
-    def load_from_account(self, account_data):
-        """从账户数据加载玩家信息"""
-        self.username = account_data.get("username", self.username)
-        self.account_type = account_data.get("account_type", "user")
-        self.haf_coin = account_data.get("haf_coin", 0)
-        self.unlocked_features = account_data.get("unlocked_features", [])
-        
-        # 修复：确保enabled_features始终是一个字典
-        self.enabled_features = account_data.get("enabled_features", {})
-        if not isinstance(self.enabled_features, dict):
-            self.enabled_features = {}
-        
-        self.banned = account_data.get("banned", False)
-        
-        # 确保所有已解锁功能都有默认开启状态
-        for feature in self.unlocked_features:
-            if feature not in self.enabled_features:
-                self.enabled_features[feature] = True
-    
-    def to_dict(self):
-        """转换为字典格式"""
-        return {
-            "username": self.username,
-            "account_type": self.account_type,
-            "haf_coin": self.haf_coin,
-            "unlocked_features": self.unlocked_features,
-            "enabled_features": self.enabled_features,
-            "banned": self.banned
-        }
-
-# 游戏主类
-class DeltaLockGame:
-    def __init__(self, root):
-        self.root = root
-        self.root.title("三角洲开锁模拟器")
-        self.root.geometry("800x600")
-        self.root.resizable(False, False)
-        
-        # 账户管理
-        self.account_manager = AccountManager()
-        self.current_account = None
-        self.player_data = PlayerData()
-        self.current_level = 1
-        
-        self.show_login_screen()
-    
-    def show_login_screen(self):
-        """显示登录界面"""
-        # 清除当前窗口
-        for widget in self.root.winfo_children(): 
-            widget.destroy()
-        
-        # 标题
-        title_label = tk.Label(self.root, text="三角洲开锁模拟器", font=("Arial", 24, "bold"), fg="#00FF00", bg="#000000")
-        title_label.pack(fill=tk.X, pady=20)
-        
-        # 登录框架
-        login_frame = tk.Frame(self.root, bg="#000000")
-        login_frame.pack(expand=True)
-        
-        # 用户名输入
-        tk.Label(login_frame, text="用户名:", font=("Arial", 16), fg="#FFFFFF", bg="#000000").grid(row=0, column=0, pady=10, padx=10)
-        self.username_entry = tk.Entry(login_frame, font=("Arial", 16), width=20)
-        self.username_entry.grid(row=0, column=1, pady=10, padx=10)
-        
-        # 密码输入
-        tk.Label(login_frame, text="密码:", font=("Arial", 16), fg="#FFFFFF", bg="#000000").grid(row=1, column=0, pady=10, padx=10)
-        self.password_entry = tk.Entry(login_frame, font=("Arial", 16), width=20, show="*")
-        self.password_entry.grid(row=1, column=1, pady=10, padx=10)
-        
-        # 消息标签
-        self.login_message = tk.Label(login_frame, text="", font=("Arial", 14), fg="#FF0000", bg="#000000")
-        self.login_message.grid(row=2, column=0, columnspan=2, pady=10)
-        
-        # 按钮框架
-        button_frame = tk.Frame(login_frame, bg="#000000")
-        button_frame.grid(row=3, column=0, columnspan=2, pady=20)
-        
-        # 登录按钮
-        login_button = tk.Button(button_frame, text="登录", font=("Arial", 16), width=10, 
-                              bg="#00FF00", fg="#000000", command=self.handle_login)
-        login_button.pack(side=tk.LEFT, padx=10)
-        
-        # 注册按钮
-        register_button = tk.Button(button_frame, text="注册", font=("Arial", 16), width=10, 
-                                 bg="#FFD700", fg="#000000", command=self.show_register_screen)
-        register_button.pack(side=tk.LEFT, padx=10)
-        
-        # 回车键登录
-        self.root.bind("<Return>", lambda event: self.handle_login())
-    
-    def handle_login(self):
-        """处理登录"""
-        username = self.username_entry.get().strip()
-        password = self.password_entry.get().strip()
-        
-        if not username or not password:
-            self.login_message.config(text="用户名和密码不能为空！")
-            return
-        
-        account, message = self.account_manager.login(username, password)
-        if account:
-            # 登录成功
-            self.current_account = account
-            self.player_data.load_from_account(account)
-            self.show_main_menu()
-        else:
-            # 登录失败
-            self.login_message.config(text=message)
-    
-    def show_register_screen(self):
-        """显示注册界面"""
-        # 清除当前窗口
-        for widget in self.root.winfo_children(): 
-            widget.destroy()
-        
-        # 标题
-        title_label = tk.Label(self.root, text="注册新账户", font=("Arial", 24, "bold"), fg="#00FF00", bg="#000000")
-        title_label.pack(fill=tk.X, pady=20)
-        
-        # 注册框架
-        register_frame = tk.Frame(self.root, bg="#000000")
-        register_frame.pack(expand=True)
-        
-        # 用户名输入
-        tk.Label(register_frame, text="用户名:", font=("Arial", 16), fg="#FFFFFF", bg="#000000").grid(row=0, column=0, pady=10, padx=10)
-        self.reg_username_entry = tk.Entry(register_frame, font=("Arial", 16), width=20)
-        self.reg_username_entry.grid(row=0, column=1, pady=10, padx=10)
-        
-        # 密码输入
-        tk.Label(register_frame, text="密码:", font=("Arial", 16), fg="#FFFFFF", bg="#000000").grid(row=1, column=0, pady=10, padx=10)
-        self.reg_password_entry = tk.Entry(register_frame, font=("Arial", 16), width=20, show="*")
-        self.reg_password_entry.grid(row=1, column=1, pady=10, padx=10)
-        
-        # 确认密码
-        tk.Label(register_frame, text="确认密码:", font=("Arial", 16), fg="#FFFFFF", bg="#000000").grid(row=2, column=0, pady=10, padx=10)
-        self.reg_confirm_entry = tk.Entry(register_frame, font=("Arial", 16), width=20, show="*")
-        self.reg_confirm_entry.grid(row=2, column=1, pady=10, padx=10)
-        
-        # 消息标签
-        self.register_message = tk.Label(register_frame, text="", font=("Arial", 14), fg="#FF0000", bg="#000000")
-        self.register_message.grid(row=3, column=0, columnspan=2, pady=10)
-        
-        # 按钮框架
-        button_frame = tk.Frame(register_frame, bg="#000000")
-        button_frame.grid(row=4, column=0, columnspan=2, pady=20)
-        
-        # 注册按钮
-        register_button = tk.Button(button_frame, text="注册", font=("Arial", 16), width=10, 
-                                 bg="#00FF00", fg="#000000", command=self.handle_register)
-        register_button.pack(side=tk.LEFT, padx=10)
-        
-        # 返回登录
-        back_button = tk.Button(button_frame, text="返回登录", font=("Arial", 16), width=10, 
-                             bg="#FFD700", fg="#000000", command=self.show_login_screen)
-        back_button.pack(side=tk.LEFT, padx=10)
-    
-    def handle_register(self):
-        """处理注册"""
-        username = self.reg_username_entry.get().strip()
-        password = self.reg_password_entry.get().strip()
-        confirm_password = self.reg_confirm_entry.get().strip()
-        
-        if not username or not password:
-            self.register_message.config(text="用户名和密码不能为空！")
-            return
-        
-        if password != confirm_password:
-            self.register_message.config(text="两次输入的密码不一致！")
-            return
-        
-        success, message = self.account_manager.register(username, password)
-        if success:
-            # 注册成功，返回登录界面
-            self.register_message.config(text=message, fg="#00FF00")
-            # 清空输入
-            self.reg_username_entry.delete(0, tk.END)
-            self.reg_password_entry.delete(0, tk.END)
-            self.reg_confirm_entry.delete(0, tk.END)
-            # 2秒后返回登录界面
-            self.root.after(2000, self.show_login_screen)
-        else:
-            # 注册失败
-            self.register_message.config(text=message)
-    
-    def show_main_menu(self):
-        # 清除当前窗口
-        for widget in self.root.winfo_children():
-            widget.destroy()
-        
-        # 标题
-        title_label = tk.Label(self.root, text="三角洲开锁模拟器", font=("Arial", 24, "bold"), fg="#00FF00", bg="#000000")
-        title_label.pack(fill=tk.X, pady=20)
-        
-        # 账户信息显示
-        account_frame = tk.Frame(self.root, bg="#000000")
-        account_frame.pack(pady=10)
-        
-        # 用户名显示
-        account_type = "管理员" if self.player_data.account_type == "admin" else "普通用户"
-        tk.Label(account_frame, text=f"当前账户: {self.player_data.username}", font=("Arial", 14), fg="#FFFFFF", bg="#000000").pack(side=tk.LEFT, padx=10)
-        tk.Label(account_frame, text=f"账户类型: {account_type}", font=("Arial", 14), fg="#FFFF00", bg="#000000").pack(side=tk.LEFT, padx=10)
-        
-        # 哈夫币显示
-        coin_label = tk.Label(self.root, text=f"哈夫币: {self.player_data.haf_coin}", font=("Arial", 16), fg="#FFD700", bg="#000000")
-        coin_label.pack(pady=10)
-        
-        # 按钮框架 - 使用side=tk.TOP确保在退出登录按钮之前
-        button_frame = tk.Frame(self.root, bg="#000000")
-        button_frame.pack(side=tk.TOP, expand=True)
-        
-        # 开始游戏按钮 - 减小高度和字体大小
-        start_button = tk.Button(button_frame, text="开始游戏", font=("Arial", 16), width=20, height=1, 
-                               bg="#00FF00", fg="#000000", command=self.start_game)
-        start_button.pack(pady=12)
-        
-        # 商店按钮
-        shop_button = tk.Button(button_frame, text="商店", font=("Arial", 16), width=20, height=1, 
-                              bg="#00FF00", fg="#000000", command=self.show_shop)
-        shop_button.pack(pady=12)
-        
-        # 功能设置按钮
-        settings_button = tk.Button(button_frame, text="功能设置", font=("Arial", 16), width=20, height=1, 
-                                 bg="#00FF00", fg="#000000", command=self.show_feature_settings)
-        settings_button.pack(pady=12)
-        
-        # 管理员功能
-        if self.player_data.account_type == "admin":
-            admin_button = tk.Button(button_frame, text="管理员控制台", font=("Arial", 16), width=20, height=1, 
-                                 bg="#FF0000", fg="#FFFFFF", command=self.show_admin_console)
-            admin_button.pack(pady=12)
-        
-        # 退出登录按钮 - 使用更醒目的位置和样式
-        logout_button = tk.Button(self.root, text="退出登录", font=("Arial", 14, "bold"), 
-                               bg="#FF0000", fg="#FFFFFF", command=self.show_login_screen)
-        logout_button.pack(side=tk.BOTTOM, pady=20, padx=20)
-        
-        # 设置背景
-        self.root.configure(bg="#000000")
-    
-    def show_admin_console(self):
-        """显示管理员控制台"""
-        # 清除当前窗口
-        for widget in self.root.winfo_children():
-            widget.destroy()
-        
-        # 标题
-        title_label = tk.Label(self.root, text="管理员控制台", font=("Arial", 24, "bold"), fg="#FF0000", bg="#000000")
-        title_label.pack(fill=tk.X, pady=20)
-        
-        # 返回按钮
-        back_button = tk.Button(self.root, text="返回主菜单", font=("Arial", 14), 
-                               bg="#00FF00", fg="#000000", command=self.show_main_menu)
-        back_button.pack(anchor=tk.NW, padx=10, pady=10)
-        
-        # 用户管理框架
-        user_frame = tk.Frame(self.root, bg="#000000")
-        user_frame.pack(expand=True, fill=tk.BOTH, padx=20, pady=20)
-        
-        tk.Label(user_frame, text="用户管理", font=("Arial", 20, "bold"), fg="#FFFFFF", bg="#000000").pack(pady=10)
-        
-        # 用户列表
-        self.user_listbox = tk.Listbox(user_frame, font=("Arial", 14), width=50, height=15, 
-                                     bg="#333333", fg="#FFFFFF", selectbackground="#00FF00")
-        self.user_listbox.pack(pady=10)
-        
-        # 创建右键菜单
-        self.context_menu = tk.Menu(self.root, tearoff=0, bg="#333333", fg="#FFFFFF")
-        self.context_menu.add_command(label="封禁账号", command=self.ban_selected_user)
-        self.context_menu.add_command(label="解封账号", command=self.unban_selected_user)
-        self.context_menu.add_separator()  # 添加分隔线
-        self.context_menu.add_command(label="设置哈夫币", command=self.show_set_coins_dialog)
-        self.context_menu.add_command(label="切换商店状态", command=self.toggle_shop_access)
-        
-        # 绑定右键菜单事件
-        def show_context_menu(event):
-            # 确保点击的是有效项目
-            index = self.user_listbox.nearest(event.y)
-            if index >= 0 and index < self.user_listbox.size():
-                self.user_listbox.selection_clear(0, tk.END)
-                self.user_listbox.selection_set(index)
-                self.user_listbox.activate(index)
-                
-                # 获取选中的用户信息
-                selected_item = self.user_listbox.get(index)
-                username = selected_item.split(" ")[-1]
-                if "[封禁]" in selected_item:
-                    # 用户已封禁，只显示解封选项
-                    self.context_menu.entryconfig(0, state=tk.DISABLED)
-                    self.context_menu.entryconfig(1, state=tk.NORMAL)
-                else:
-                    # 用户正常，只显示封禁选项
-                    self.context_menu.entryconfig(0, state=tk.NORMAL)
-                    self.context_menu.entryconfig(1, state=tk.DISABLED)
-                
-                # 显示右键菜单
-                self.context_menu.post(event.x_root, event.y_root)
-                # 保存当前选中的用户名
-                self.current_selected_user = username
-        
-        # 绑定右键点击事件
-        self.user_listbox.bind('<Button-3>', show_context_menu)
-        
-        # 刷新用户列表
-        self.refresh_user_list()
-        
-        # 刷新按钮
-        button_frame = tk.Frame(user_frame, bg="#000000")
-        button_frame.pack(pady=20)
-        
-        refresh_button = tk.Button(button_frame, text="刷新列表", font=("Arial", 16), width=15, 
-                                 bg="#FFD700", fg="#000000", command=self.refresh_user_list)
-        refresh_button.pack(pady=10)
-    
-    def refresh_user_list(self):
-        """刷新用户列表"""
-        # 清空列表
-        self.user_listbox.delete(0, tk.END)
-        
-        # 获取所有用户
-        users = self.account_manager.get_user_list()
-        
-        for user in users:
-            status = "[封禁]" if user["banned"] else "[正常]"
-            self.user_listbox.insert(tk.END, f"{status} {user['username']}")
-    
-    def ban_selected_user(self):
-        """封禁选中的用户"""
-        selected_index = self.user_listbox.curselection()
-        if not selected_index:
-            return
-        
-        # 获取选中的用户名
-        selected_item = self.user_listbox.get(selected_index)
-        username = selected_item.split(" ")[-1]
-        
-        # 封禁用户
-        if self.account_manager.ban_account(username):
-            # 刷新列表
-            self.refresh_user_list()
-    
-    def unban_selected_user(self):
-        """解封选中的用户"""
-        selected_index = self.user_listbox.curselection()
-        if not selected_index:
-            return
-        
-        # 获取选中的用户名
-        selected_item = self.user_listbox.get(selected_index)
-        username = selected_item.split(" ")[-1]
-        
-        # 解封用户
-        if self.account_manager.unban_account(username):
-            # 刷新列表
-            self.refresh_user_list()
-    
-    def set_user_coins(self):
-        """设置选中用户的金币数量"""
-        selected_index = self.user_listbox.curselection()
-        if not selected_index:
-            return
-        
-        try:
-            coins = int(self.coin_entry.get())
-            if coins < 0:
-                return
-            
-            # 获取选中的用户名
-            selected_item = self.user_listbox.get(selected_index)
-            username = selected_item.split(" ")[-1]
-            
-            # 更新金币数量
-            self.account_manager.update_account(username, {"haf_coin": coins})
-            
-            # 更新界面信息
-            self.refresh_user_list()
-            self.update_selected_user_info(username)
-            
-        except ValueError:
-            pass
-    
-    def set_user_shop_access(self):
-        """设置选中用户是否可以使用商店"""
-        selected_index = self.user_listbox.curselection()
-        if not selected_index:
-            return
-        
-        # 获取选中的用户名
-        selected_item = self.user_listbox.get(selected_index)
-        username = selected_item.split(" ")[-1]
-        
-        # 更新商店禁用状态
-        shop_disabled = self.shop_disabled_var.get()
-        self.account_manager.update_account(username, {"shop_disabled": shop_disabled})
-        
-        # 更新界面信息
-        self.refresh_user_list()
-        self.update_selected_user_info(username)
-    
-    def show_set_coins_dialog(self):
-        """显示设置哈夫币的对话框"""
-        if not hasattr(self, 'current_selected_user') or not self.current_selected_user:
-            return
-        
-        # 获取当前选中的用户
-        username = self.current_selected_user
-        account = self.account_manager.accounts.get(username)
-        if not account:
-            return
-        
-        # 创建对话框
-        dialog = tk.Toplevel(self.root)
-        dialog.title("设置哈夫币")
-        dialog.geometry("300x150")
-        dialog.configure(bg="#000000")
-        dialog.resizable(False, False)
-        
-        # 对话框居中显示
-        dialog.update_idletasks()
-        width = dialog.winfo_width()
-        height = dialog.winfo_height()
-        x = (self.root.winfo_width() // 2) - (width // 2) + self.root.winfo_x()
-        y = (self.root.winfo_height() // 2) - (height // 2) + self.root.winfo_y()
-        dialog.geometry(f"{width}x{height}+{x}+{y}")
-        
-        # 标签
-        label = tk.Label(dialog, text="设置哈夫币数量:", font=("Arial", 12), 
-                        fg="#FFFFFF", bg="#000000")
-        label.pack(pady=10)
-        
-        # 输入框
-        coin_var = tk.StringVar(value=str(account.get("haf_coin", 0)))
-        coin_entry = tk.Entry(dialog, textvariable=coin_var, font=("Arial", 12), width=15)
-        coin_entry.pack(pady=5)
-        
-        # 确认按钮
-        def confirm_set_coins():
-            try:
-                coins = int(coin_var.get())
-                if coins >= 0:
-                    # 更新金币数量
-                    self.account_manager.update_account(username, {"haf_coin": coins})
-                    # 刷新列表
-                    self.refresh_user_list()
-                    # 关闭对话框
-                    dialog.destroy()
-            except ValueError:
-                pass
-        
-        confirm_button = tk.Button(dialog, text="确认", font=("Arial", 12), 
-                                  bg="#00FF00", fg="#000000", command=confirm_set_coins)
-        confirm_button.pack(pady=10)
-        
-        # 让对话框获得焦点
-        dialog.grab_set()
-    
-    def toggle_shop_access(self):
-        """切换选中用户的商店访问状态"""
-        if not hasattr(self, 'current_selected_user') or not self.current_selected_user:
-            return
-        
-        # 获取当前选中的用户
-        username = self.current_selected_user
-        account = self.account_manager.accounts.get(username)
-        if not account:
-            return
-        
-        # 切换商店禁用状态
-        current_status = account.get("shop_disabled", False)
-        new_status = not current_status
-        
-        # 更新状态
-        self.account_manager.update_account(username, {"shop_disabled": new_status})
-        
-        # 刷新列表
-        self.refresh_user_list()
-    
-    def show_feature_settings(self):
-        """显示功能设置界面"""
-        # 清除当前窗口
-        for widget in self.root.winfo_children():
-            widget.destroy()
-        
-        # 标题
-        title_label = tk.Label(self.root, text="功能设置", font=("Arial", 24, "bold"), fg="#00FF00", bg="#000000")
-        title_label.pack(fill=tk.X, pady=20)
-        
-        # 返回按钮
-        back_button = tk.Button(self.root, text="返回主菜单", font=("Arial", 14), 
-                               bg="#00FF00", fg="#000000", command=self.show_main_menu)
-        back_button.pack(anchor=tk.NW, padx=10, pady=10)
-        
-        # 功能设置框架
-        settings_frame = tk.Frame(self.root, bg="#000000")
-        settings_frame.pack(expand=True, fill=tk.BOTH, padx=20, pady=20)
-        
-        # 功能列表标题
-        tk.Label(settings_frame, text="已购买功能", font=(
-        "Arial", 20, "bold"), fg="#FFFFFF", bg="#000000").pack(pady=10)
-        
-        # 创建带滚动条的功能区域
-        canvas = tk.Canvas(settings_frame, bg="#000000", bd=0, highlightthickness=0)
-        scrollbar = tk.Scrollbar(settings_frame, orient="vertical", command=canvas.yview)
-        scrollable_frame = tk.Frame(canvas, bg="#000000")
-        
-        # 配置滚动区域
-        scrollable_frame.bind(
-            "<Configure>",
-            lambda e: canvas.configure(
-                scrollregion=canvas.bbox("all")
-            )
-        )
-        
-        canvas.create_window((0, 0), window=scrollable_frame, anchor="nw")
-        canvas.configure(yscrollcommand=scrollbar.set)
-        
-        # 功能描述字典
-        feature_descriptions = {
-            "scroll_speed": "快速滚动：增加滚动速度",
-            "auto_aim": "自动瞄准：正确符号接近中间时提示",
-            "error_hint": "错误提示：显示错误的符号（橙色）",
-            "extra_life": "额外生命：允许一次错误"
-        }
-        
-        # 功能开关字典，用于保存开关状态
-        self.feature_toggles = {}
-        
-        # 创建功能开关
-        for feature in self.player_data.unlocked_features:
-            feature_frame = tk.Frame(scrollable_frame, bg="#333333", bd=2, relief=tk.RAISED)
-            feature_frame.pack(pady=10, fill=tk.X, padx=10)
-            
-            # 功能名称和描述
-            desc_text = feature_descriptions.get(feature, feature)
-            feature_label = tk.Label(feature_frame, text=desc_text, font=(
-            "Arial", 14), fg="#FFFFFF", bg="#333333")
-            feature_label.pack(side=tk.LEFT, padx=20, pady=10)
-            
-            # 开关按钮
-            toggle_var = tk.BooleanVar(value=self.player_data.enabled_features.get(feature, True))
-            toggle_button = tk.Checkbutton(feature_frame, text="开启", font=(
-            "Arial", 14), 
-                                          variable=toggle_var, bg="#333333", fg="#FFFFFF", 
-                                          selectcolor="#00FF00")
-            toggle_button.pack(side=tk.RIGHT, padx=20, pady=10)
-            
-            self.feature_toggles[feature] = toggle_var
-        
-        # 放置滚动区域和滚动条
-        canvas.pack(side="left", fill="both", expand=True, padx=10, pady=10)
-        scrollbar.pack(side="right", fill="y", pady=10)
-        
-        # 允许使用鼠标滚轮滚动
-        def _on_mousewheel(event):
-            canvas.yview_scroll(int(-1*(event.delta/120)), "units")
-        
-        canvas.bind_all("<MouseWheel>", _on_mousewheel)
-        
-        # 保存按钮
-        save_button = tk.Button(settings_frame, text="保存设置", font=(
-        "Arial", 18), width=20, height=2, 
-                              bg="#00FF00", fg="#000000", command=self.save_feature_settings)
-        save_button.pack(pady=20)
-        
-        # 如果没有已购买的功能
-        if not self.player_data.unlocked_features:
-            empty_label = tk.Label(settings_frame, text="您还没有购买任何功能，请先去商店购买！", 
-                                 font=("Arial", 16), fg="#FFFF00", bg="#000000")
-            empty_label.pack(pady=50)
-    
-    def save_feature_settings(self):
-        """保存功能设置"""
-        # 更新功能开启状态
-        for feature, toggle_var in self.feature_toggles.items():
-            self.player_data.enabled_features[feature] = toggle_var.get()
-        
-        # 保存到账户
-        if self.player_data.username:
-            self.account_manager.update_account(self.player_data.username, {
-                "enabled_features": self.player_data.enabled_features
-            })
-        
-        # 显示保存成功提示
-        success_label = tk.Label(self.root, text="设置保存成功！", font=("Arial", 16), fg="#00FF00", bg="#000000")
-        success_label.pack(pady=10)
-        
-        # 2秒后返回主菜单
-        self.root.after(2000, self.show_main_menu)
-    
-    def start_game(self):
-        # 清除当前窗口
-        for widget in self.root.winfo_children():
-            widget.destroy()
-        
-        # 创建游戏界面
-        self.game_frame = tk.Frame(self.root, bg="#000000")
-        self.game_frame.pack(fill=tk.BOTH, expand=True)
-        
-        # 返回按钮
-        back_button = tk.Button(self.game_frame, text="返回主菜单", font=("Arial", 12), 
-                              bg="#FF0000", fg="#FFFFFF", command=self.show_main_menu)
-        back_button.pack(anchor=tk.NW, padx=10, pady=10)
-        
-        # 哈夫币显示
-        self.coin_label = tk.Label(self.game_frame, text=f"哈夫币: {self.player_data.haf_coin}", 
-                                 font=("Arial", 14), fg="#FFD700", bg="#000000")
-        self.coin_label.pack(anchor=tk.NE, padx=10, pady=10)
-        
-        # 密码锁框架
-        self.lock_frame = tk.Frame(self.game_frame, bg="#000000")
-        self.lock_frame.pack(expand=True, fill=tk.BOTH)
-        
-        # 创建五列符号
-        self.columns = []
-        self.locked = [False] * COLUMNS
-        self.target_symbols = []
-        
-        # 生成目标密码
-        for i in range(COLUMNS):
-            target = random.choice(SYMBOL_SET)
-            self.target_symbols.append(target)
-        
-        # 为每列随机分配不同的行位置放置正确符号
-        target_rows = []
-        while len(target_rows) < COLUMNS:
-            row = random.randint(0, ROWS - 1)
-            if row not in target_rows:
-                target_rows.append(row)
-        
-        # 创建每列
-        for col in range(COLUMNS):
-            column_frame = tk.Frame(self.lock_frame, bg="#000000", bd=2, relief=tk.RAISED)
-            column_frame.grid(row=0, column=col, padx=5, pady=5, sticky="nsew")
-            
-            # 设置列权重
-            self.lock_frame.grid_columnconfigure(col, weight=1)
-            
-            column_symbols = []
-            for row in range(ROWS):
-                # 根据分配的行位置放置正确的符号
-                if row == target_rows[col]:
-                    symbol = self.target_symbols[col]
-                else:
-                    symbol = random.choice(SYMBOL_SET)
-                    
-                label = tk.Label(column_frame, text=symbol, font=("Courier", 20), 
-                               width=4, height=2, bg="#333333", fg="#FFFFFF")
-                label.grid(row=row, column=0, sticky="nsew")
-                column_frame.grid_rowconfigure(row, weight=1)
-                column_symbols.append(label)
-            
-            # 标记正确符号为绿色
-            column_symbols[target_rows[col]].config(fg="#00FF00")
-            self.columns.append(column_symbols)
-        
-        # 设置行权重
-        self.lock_frame.grid_rowconfigure(0, weight=1)
-        
-        # 状态标签
-        self.status_label = tk.Label(self.game_frame, text="使用 ← → 键选择列，按空格键锁定正确的符号", 
-                                   font=("Arial", 16), fg="#00FF00", bg="#000000")
-        self.status_label.pack(pady=20)
-        
-        # 开始滚动
-        # 根据是否购买了快速滚动且已开启来设置速度
-        if 'scroll_speed' in self.player_data.unlocked_features and self.player_data.enabled_features.get('scroll_speed', True):
-            self.scroll_speed = 800  # 快速滚动 - 0.8秒
-        else:
-            self.scroll_speed = 1000  # 正常滚动 - 1秒
-            
-        self.is_rolling = True
-        self.lock_count = 0
-        self.game_start_time = time.time()
-        self.current_column = 0  # 当前选中的列
-        self.errors_allowed = 0  # 允许的错误次数
-        
-        # 检查是否购买了额外生命且已开启
-        if 'extra_life' in self.player_data.unlocked_features and self.player_data.enabled_features.get('extra_life', True):
-            self.errors_allowed = 1
-        
-        # 加倍下注状态
-        if not hasattr(self, 'is_double_bet'):
-            self.is_double_bet = False
-            self.double_bet_amount = 0
-        
-        # 绑定键盘事件
-        self.root.bind("<space>", self.lock_symbol)
-        self.root.bind("<Left>", self.select_previous_column)
-        self.root.bind("<Right>", self.select_next_column)
-        
-        # 高亮当前选中的列
-        self.highlight_current_column()
-        
-        # 开始滚动动画
-        self.roll_symbols()
-    
-    def roll_symbols(self):
-        if not self.is_rolling:
-            return
-        
-        try:
-            for col in range(COLUMNS):
-                if not self.locked[col]:
-                    # 滚动符号
-                    column = self.columns[col]
-                    # 获取当前所有符号
-                    symbols = []
-                    for label in column:
-                        try:
-                            symbols.append(label.cget("text"))
-                        except tk.TclError:
-                            # 标签已被销毁，停止滚动
-                            self.is_rolling = False
-                            return
-                    
-                    # 将最后一个符号移到最前面
-                    symbols.insert(0, symbols.pop())
-                    # 更新标签
-                    for row in range(ROWS):
-                        label = column[row]
-                        try:
-                            label.config(text=symbols[row])
-                            
-                            # 检查是否是目标符号，如果是则变绿
-                            if symbols[row] == self.target_symbols[col]:
-                                label.config(fg="#00FF00")
-                            elif 'error_hint' in self.player_data.unlocked_features and self.player_data.enabled_features.get('error_hint', True) and symbols[row] != self.target_symbols[col]:
-                                # 错误提示：如果购买了该功能且已开启，错误符号变为橙色
-                                label.config(fg="#FFA500")
-                            else:
-                                label.config(fg="#FFFFFF")
-                        except tk.TclError:
-                            # 标签已被销毁，停止滚动
-                            self.is_rolling = False
-                            return
-                    
-                    # 自动瞄准：如果购买了该功能且已开启，当正确符号接近中间行时给出提示
-                    if 'auto_aim' in self.player_data.unlocked_features and self.player_data.enabled_features.get('auto_aim', True):
-                        middle_row = ROWS // 2
-                        # 检查正确符号是否在中间行附近（上下各一行）
-                        near_middle = False
-                        for row in [middle_row-1, middle_row, middle_row+1]:
-                            if row >= 0 and row < ROWS:
-                                if symbols[row] == self.target_symbols[col]:
-                                    near_middle = True
-                                    break
-                        
-                        # 如果接近中间行，改变列边框颜色
-                        if near_middle and not self.locked[col]:
-                            try:
-                                column[middle_row].config(bg="#FFFF00", fg="#000000")
-                            except tk.TclError:
-                                self.is_rolling = False
-                                return
-                        else:
-                            try:
-                                column[middle_row].config(bg="#333333")
-                            except tk.TclError:
-                                self.is_rolling = False
-                                return
-        except Exception:
-            # 发生任何错误，停止滚动
-            self.is_rolling = False
-            return
-        
-        # 继续滚动
-        self.root.after(self.scroll_speed, self.roll_symbols)
-    
-    def lock_symbol(self, event):
-        # 只锁定当前选中的列
-        col = self.current_column
-        if not self.locked[col]:
-            column = self.columns[col]
-            current_symbol = column[ROWS // 2].cget("text")
-            
-            if current_symbol == self.target_symbols[col]:
-                # 锁定正确
-                self.locked[col] = True
-                self.lock_count += 1
-                column[ROWS // 2].config(bg="#00FF00", fg="#000000")
-                self.status_label.config(text=f"锁定正确！已锁定 {self.lock_count}/{COLUMNS}")
-                
-                # 检查是否所有列都锁定正确
-                if self.lock_count == COLUMNS:
-                    self.win_game()
-                else:
-                    # 自动选择下一个未锁定的列
-                    self.select_next_unlocked_column()
-            else:
-                # 锁定错误
-                if self.errors_allowed > 0:
-                    # 使用额外生命
-                    self.errors_allowed -= 1
-                    self.status_label.config(text=f"锁定错误！剩余额外生命: {self.errors_allowed}")
-                    # 自动选择下一个未锁定的列
-                    self.select_next_unlocked_column()
-                else:
-                    # 没有额外生命了，游戏失败
-                    # 检查是否处于加倍下注状态
-                    if self.is_double_bet:
-                        # 加倍下注失败，显示失败信息并扣除奖金
-                        self.player_data.haf_coin -= self.double_bet_amount  # 真正扣除哈夫币
-                        
-                        # 保存哈夫币变化
-                        self.account_manager.save_player_data(self.player_data)
-                        
-                        self.status_label.config(text=f"锁定错误！游戏失败\n加倍下注失败！失去了 {self.double_bet_amount} 个哈夫币！")
-                        self.is_double_bet = False
-                        self.double_bet_amount = 0
-                    else:
-                        self.status_label.config(text="锁定错误！游戏失败")
-                        
-                    self.is_rolling = False
-                    # 显示重新开始按钮
-                    restart_button = tk.Button(self.game_frame, text="重新开始", font=(
-                        "Arial", 16), bg="#00FF00", fg="#000000", command=self.start_game)
-                    restart_button.pack(pady=20)
-    
-    def select_previous_column(self, event):
-        # 选择上一列
-        self.current_column = (self.current_column - 1) % COLUMNS
-        self.highlight_current_column()
-    
-    def select_next_column(self, event):
-        # 选择下一列
-        self.current_column = (self.current_column + 1) % COLUMNS
-        self.highlight_current_column()
-    
-    def select_next_unlocked_column(self):
-        # 选择下一个未锁定的列
-        start_col = self.current_column
-        while True:
-            self.current_column = (self.current_column + 1) % COLUMNS
-            if not self.locked[self.current_column] or self.current_column == start_col:
-                break
-        self.highlight_current_column()
-    
-    def highlight_current_column(self):
-        # 高亮当前选中的列
-        for col in range(COLUMNS):
-            column_frame = self.columns[col][0].master
-            if col == self.current_column:
-                column_frame.config(bg="#FFFF00", bd=3)  # 高亮为黄色
-            else:
-                column_frame.config(bg="#000000", bd=2)  # 恢复默认
-    
-    def win_game(self):
-        self.is_rolling = False
-        self.status_label.config(text="恭喜通关！")
-        
-        # 处理加倍下注奖励
-        if self.is_double_bet:
-            # 加倍下注成功，给予双倍奖励
-            self.player_data.haf_coin += 2  # 获得2个哈夫币（双倍奖励）
-            self.is_double_bet = False
-            self.double_bet_amount = 0
-            
-            # 保存哈夫币变化
-            self.account_manager.save_player_data(self.player_data)
-        
-        # 创建奖励界面
-        self.create_reward_screen()
-    
-    def create_reward_screen(self):
-        # 创建奖励界面窗口
-        reward_window = tk.Toplevel(self.root)
-        reward_window.title("奖励界面")
-        reward_window.geometry("400x300")
-        reward_window.configure(bg="#000000")
-        reward_window.resizable(False, False)
-        
-        # 禁止关闭主窗口
-        self.root.attributes("-disabled", True)
-        
-        # 奖励标题
-        reward_title = tk.Label(reward_window, text="🎉 恭喜通关！ 🎉", font=(
-            "Arial", 20, "bold"), fg="#FFD700", bg="#000000")
-        reward_title.pack(pady=30)
-        
-        # 获得哈夫币标签
-        coin_reward = tk.Label(reward_window, text="获得1个哈夫币！", font=(
-            "Arial", 16), fg="#FFD700", bg="#000000")
-        coin_reward.pack(pady=20)
-        
-        # 等待1秒后显示下注选项
-        reward_window.after(1000, lambda: self.show_bet_options(reward_window))
-    
-    def show_bet_options(self, reward_window):
-        # 清除当前奖励界面的内容
-        for widget in reward_window.winfo_children():
-            widget.destroy()
-        
-        # 新的标题
-        bet_title = tk.Label(reward_window, text="🎰 加倍机会！ 🎰", font=(
-            "Arial", 20, "bold"), fg="#FFD700", bg="#000000")
-        bet_title.pack(pady=30)
-        
-        # 下注说明
-        bet_desc = tk.Label(reward_window, text="是否加倍下注？", font=(
-            "Arial", 16), fg="#00FF00", bg="#000000")
-        bet_desc.pack(pady=20)
-        
-        # 按钮框架
-        button_frame = tk.Frame(reward_window, bg="#000000")
-        button_frame.pack(pady=20)
-        
-        # 加倍按钮
-        double_button = tk.Button(button_frame, text="加倍下注", font=(
-            "Arial", 14, "bold"), width=12, height=2, 
-            bg="#FF0000", fg="#FFFFFF", 
-            command=lambda: self.handle_bet(reward_window, True))
-        double_button.pack(side=tk.LEFT, padx=10)
-        
-        # 停止按钮
-        stop_button = tk.Button(button_frame, text="停止下注", font=(
-            "Arial", 14, "bold"), width=12, height=2, 
-            bg="#00FF00", fg="#000000", 
-            command=lambda: self.handle_bet(reward_window, False))
-        stop_button.pack(side=tk.RIGHT, padx=10)
-    
-    def handle_bet(self, reward_window, double_bet):
-        if double_bet:
-            # 加倍下注：立即扣除当前赢的奖金作为赌注
-            self.player_data.haf_coin += 1  # 先给玩家当前的奖金
-            self.player_data.haf_coin -= 1  # 立即扣除作为赌注
-            self.is_double_bet = True
-            self.double_bet_amount = 1  # 当前这把的奖金作为赌注
-            result = "🎯 加倍下注成功！🎯\n已扣除1个哈夫币作为赌注。\n下一把赢了获得2倍奖金（2个哈夫币），输了失去赌注！"
-            result_fg = "#FFA500"
-        else:
-            # 停止下注，获得1个哈夫币
-            self.player_data.haf_coin += 1
-            self.is_double_bet = False
-            result = "获得1个哈夫币！"
-            result_fg = "#FFD700"
-        
-        # 保存哈夫币变化
-        self.account_manager.save_player_data(self.player_data)
-        
-        # 更新奖励界面
-        for widget in reward_window.winfo_children():
-            widget.destroy()
-        
-        # 结果标题
-        result_label = tk.Label(reward_window, text=result, font=(
-            "Arial", 16), fg=result_fg, bg="#000000", justify="center")
-        result_label.pack(pady=50)
-        
-        # 最终哈夫币数量
-        final_coin_label = tk.Label(reward_window, text=f"最终哈夫币: {self.player_data.haf_coin}", 
-                                  font=("Arial", 14), fg="#FFD700", bg="#000000")
-        final_coin_label.pack(pady=10)
-        
-        # 3秒后自动关闭奖励界面并返回主页
-        def close_reward():
-            reward_window.destroy()
-            self.root.attributes("-disabled", False)  # 启用主窗口
-            self.show_main_menu()
-        
-        reward_window.after(3000, close_reward)
-    
-    def show_shop(self):
-        # 检查用户是否被禁用了商店
-        if self.player_data.username:
-            user_account = self.account_manager.accounts.get(self.player_data.username)
-            if user_account and user_account.get("shop_disabled", False):
-                # 显示商店禁用提示
-                for widget in self.root.winfo_children():
-                    widget.destroy()
-                
-                disabled_frame = tk.Frame(self.root, bg="#000000")
-                disabled_frame.pack(fill=tk.BOTH, expand=True)
-                
-                # 返回按钮
-                back_button = tk.Button(disabled_frame, text="返回主菜单", font=("Arial", 12), 
-                                      bg="#FF0000", fg="#FFFFFF", command=self.show_main_menu)
-                back_button.pack(anchor=tk.NW, padx=10, pady=10)
-                
-                # 禁用提示
-                disabled_label = tk.Label(disabled_frame, text="商店功能已被禁用", font=("Arial", 24, "bold"), 
-                                        fg="#FF0000", bg="#000000")
-                disabled_label.pack(expand=True)
-                
-                return
-        
-        # 清除当前窗口
-        for widget in self.root.winfo_children():
-            widget.destroy()
-        
-        # 创建商店界面
-        shop_frame = tk.Frame(self.root, bg="#000000")
-        shop_frame.pack(fill=tk.BOTH, expand=True)
-        
-        # 返回按钮
-        back_button = tk.Button(shop_frame, text="返回主菜单", font=("Arial", 12), 
-                              bg="#FF0000", fg="#FFFFFF", command=self.show_main_menu)
-        back_button.pack(anchor=tk.NW, padx=10, pady=10)
-        
-        # 哈夫币显示
-        coin_label = tk.Label(shop_frame, text=f"哈夫币: {self.player_data.haf_coin}", 
-                            font=("Arial", 16), fg="#FFD700", bg="#000000")
-        coin_label.pack(pady=20)
-        
-        # 商店标题
-        shop_title = tk.Label(shop_frame, text="商店", font=("Arial", 20, "bold"), fg="#00FF00", bg="#000000")
-        shop_title.pack(pady=10)
-        
-        # 创建带滚动条的商品区域
-        canvas = tk.Canvas(shop_frame, bg="#000000", bd=0, highlightthickness=0)
-        scrollbar = tk.Scrollbar(shop_frame, orient="vertical", command=canvas.yview)
-        scrollable_frame = tk.Frame(canvas, bg="#000000")
-        
-        # 配置滚动区域
-        scrollable_frame.bind(
-            "<Configure>",
-            lambda e: canvas.configure(
-                scrollregion=canvas.bbox("all")
-            )
-        )
-        
-        canvas.create_window((0, 0), window=scrollable_frame, anchor="nw")
-        canvas.configure(yscrollcommand=scrollbar.set)
-        
-        # 商品列表
-        shop_items = [
-            {"name": "快速滚动", "description": "增加滚动速度", "price": 3, "effect": "scroll_speed"},
-            {"name": "自动瞄准", "description": "正确符号接近中间时提示", "price": 5, "effect": "auto_aim"},
-            {"name": "错误提示", "description": "显示错误的符号", "price": 4, "effect": "error_hint"},
-            {"name": "额外生命", "description": "允许一次错误", "price": 6, "effect": "extra_life"},
-        ]
-        
-        for i, item in enumerate(shop_items):
-            item_frame = tk.Frame(scrollable_frame, bg="#333333", bd=2, relief=tk.RAISED)
-            item_frame.grid(row=i, column=0, padx=20, pady=10, sticky="ew")
-            
-            # 设置商品框架的列权重
-            item_frame.grid_columnconfigure(0, weight=1)
-            item_frame.grid_columnconfigure(1, weight=0)
-            
-            # 商品名称
-            name_label = tk.Label(item_frame, text=item["name"], font=("Arial", 14, "bold"), 
-                                fg="#00FF00", bg="#333333")
-            name_label.grid(row=0, column=0, padx=10, pady=5, sticky="w")
-            
-            # 商品描述
-            desc_label = tk.Label(item_frame, text=item["description"], font=("Arial", 12), 
-                                fg="#FFFFFF", bg="#333333")
-            desc_label.grid(row=1, column=0, padx=10, pady=5, sticky="w")
-            
-            # 价格
-            price_label = tk.Label(item_frame, text=f"价格: {item['price']} 哈夫币", font=("Arial", 12), 
-                                 fg="#FFD700", bg="#333333")
-            price_label.grid(row=0, column=1, padx=10, pady=5, sticky="e")
-            
-            # 购买按钮
-            buy_button = tk.Button(item_frame, text="购买", font=("Arial", 12), 
-                                 bg="#00FF00", fg="#000000", 
-                                 command=lambda item=item: self.buy_item(item))
-            buy_button.grid(row=1, column=1, padx=10, pady=5, sticky="e")
-            
-            # 设置已购买的商品状态
-            if item["effect"] in self.player_data.unlocked_features:
-                buy_button.config(text="已购买", state=tk.DISABLED, bg="#666666")
-        
-        # 设置可滚动区域的列权重
-        scrollable_frame.grid_columnconfigure(0, weight=1)
-        
-        # 放置滚动区域和滚动条
-        canvas.pack(side="left", fill="both", expand=True, padx=10, pady=10)
-        scrollbar.pack(side="right", fill="y", pady=10)
-        
-        # 允许使用鼠标滚轮滚动
-        def _on_mousewheel(event):
-            canvas.yview_scroll(int(-1*(event.delta/120)), "units")
-        
-        canvas.bind_all("<MouseWheel>", _on_mousewheel)
-        
-    def buy_item(self, item):
-        if self.player_data.haf_coin >= item["price"]:
-            if item["effect"] not in self.player_data.unlocked_features:
-                self.player_data.haf_coin -= item["price"]
-                self.player_data.unlocked_features.append(item["effect"])
-                # 新购买的功能默认开启
-                self.player_data.enabled_features[item["effect"]] = True
-                # 保存账户数据
-                if self.player_data.username:
-                    self.account_manager.update_account(self.player_data.username, {
-                        "haf_coin": self.player_data.haf_coin,
-                        "unlocked_features": self.player_data.unlocked_features,
-                        "enabled_features": self.player_data.enabled_features
-                    })
-                self.show_main_menu()  # 返回主菜单刷新
-        
-
-# 运行游戏
-if __name__ == "__main__":
-    root = tk.Tk()
-    game = DeltaLockGame(root)
-    root.mainloop()
\ No newline at end of file
+import tkinter as tk
+import time
+import json
+import sys
+import heapq
+import itertools
+import math
+import argparse
+import threading
+import bisect
+import gc
+import tracemalloc
+import uuid
+import asyncio
+from collections import deque
+from lock_engine import (
+    AccountManager, FEATURES, GameHistory, LEVEL_MAX, LevelPack, LockBoard, LockEnv, METRICS, MetricsServer,
+    PasswordHasher, PlayerData, RACE_STAKE, ROWS, RaceClient, RaceHost, SessionServer, ShopCatalog,
+    account_filter, board_settings, level_spec
+)
+
+
+# 锦标赛模式默认的棋盘数量
+TOURNAMENT_BOARDS = 4
+
+# 保留的输入延迟样本数
+INPUT_LATENCY_HISTORY = 1000
+
+# 帧预算（秒）：每帧滚动加渲染的目标耗时；连续多少帧超出预算才降低画面效果，
+# 连续多少帧低于预算的一半才恢复一级
+FRAME_BUDGET = 0.010
+FRAME_BUDGET_PATIENCE = 5
+FRAME_BUDGET_RECOVERY = 60
+
+# 诊断模式：连续多少次切换到同一界面都在增长才算泄漏、堆增长阈值、
+# 分配位置的调用栈深度和报告的位置数量
+LEAK_WINDOW = 5
+LEAK_HEAP_BYTES = 64 * 1024
+LEAK_TRACE_FRAMES = 10
+LEAK_TOP_SITES = 5
+
+# 账户变更分发到界面的最长间隔（毫秒），用于后台线程产生的变更
+CHANGE_FLUSH_INTERVAL = 50
+
+# 联机竞速界面处理主机消息的间隔（毫秒）
+RACE_POLL_INTERVAL = 15
+
+# 商店和设置界面每次渲染的条目数
+LAZY_PAGE_SIZE = 20
+
+# 棋盘界面：把LockBoard的状态画到Tk标签上，只更新发生变化的格子
+class BoardView:
+    def __init__(self, parent, board, hint_color=None, aim_window=None, aim_color=None,
+                 font_size=20, cell_width=4, cell_height=2, padding=5):
+        self.board = board
+        self.hint_color = hint_color
+        self.aim_window = aim_window
+        self.aim_color = aim_color
+        self.frame = tk.Frame(parent, bg="#000000")
+        self.column_frames = []
+        self.cells = []
+        
+        # 创建每列
+        for col in range(board.columns):
+            column_frame = tk.Frame(self.frame, bg="#000000", bd=2, relief=tk.RAISED)
+            column_frame.grid(row=0, column=col, padx=padding, pady=padding, sticky="nsew")
+            # 设置列权重
+            self.frame.grid_columnconfigure(col, weight=1)
+            
+            column_labels = []
+            for row in range(board.rows):
+                label = tk.Label(column_frame, text="", font=("Courier", font_size),
+                               width=cell_width, height=cell_height, bg="#333333", fg="#FFFFFF")
+                label.grid(row=row, column=0, sticky="nsew")
+                column_frame.grid_rowconfigure(row, weight=1)
+                column_labels.append(label)
+            self.column_frames.append(column_frame)
+            self.cells.append(column_labels)
+        
+        # 设置行权重
+        self.frame.grid_rowconfigure(0, weight=1)
+        
+        # 已显示的内容，用于跳过没有变化的格子
+        self._shown = [[None] * board.rows for _ in range(board.columns)]
+        self._column_state = [None] * board.columns
+        self._highlighted = None
+    
+    def render(self, refresh_aim=True):
+        """把棋盘当前状态画到界面上；refresh_aim为False时沿用上次的自动瞄准高亮"""
+        board = self.board
+        middle_row = board.rows // 2
+        
+        # 高亮当前选中的列
+        if self._highlighted != board.current_column:
+            if self._highlighted is not None:
+                self.column_frames[self._highlighted].config(bg="#000000", bd=2)  # 恢复默认
+            self.column_frames[board.current_column].config(bg="#FFFF00", bd=3)  # 高亮为黄色
+            self._highlighted = board.current_column
+        
+        for col in range(board.columns):
+            locked = board.locked[col]
+            # 自动瞄准：正确符号接近中间行时高亮中间格
+            if locked or self.aim_window is None:
+                near_middle = False
+            elif refresh_aim or self._column_state[col] is None:
+                near_middle = board.target_near_middle(col, self.aim_window)
+            else:
+                near_middle = self._column_state[col][2]
+            state = (board.offsets[col], locked, near_middle)
+            if state == self._column_state[col]:
+                continue
+            self._column_state[col] = state
+            
+            target = board.targets[col]
+            labels = self.cells[col]
+            shown = self._shown[col]
+            for row in range(board.rows):
+                symbol = board.symbol_at(col, row)
+                # 正确符号为绿色；错误提示开启时错误符号为提示色
+                if symbol == target:
+                    fg = "#00FF00"
+                else:
+                    fg = self.hint_color or "#FFFFFF"
+                bg = "#333333"
+                if row == middle_row:
+                    if locked:
+                        bg, fg = "#00FF00", "#000000"
+                    elif near_middle:
+                        bg, fg = self.aim_color, "#000000"
+                cell = (symbol, fg, bg)
+                if shown[row] != cell:
+                    labels[row].config(text=symbol, fg=fg, bg=bg)
+                    shown[row] = cell
+
+# 帧预算：测量每帧（滚动加渲染）的耗时，超出预算时逐级降低画面效果，恢复后逐级还原。
+# 只影响画面：滚动节奏和锁定判定不变，没画出来的帧不记为已显示，锁定按玩家实际看到的帧判定
+class FrameBudget:
+    # 各级别的 (自动瞄准高亮的刷新间隔, 渲染间隔)，单位为帧：
+    # 0 完整效果；1 高亮隔帧刷新；2 再合并为每2帧渲染一次；3 每3帧渲染一次
+    LEVELS = ((1, 1), (2, 1), (2, 2), (3, 3))
+    
+    def __init__(self, budget=FRAME_BUDGET, out=sys.stderr):
+        self.budget = budget
+        self.out = out
+        self.level = 0
+        self.cost = None    # 每帧耗时的指数移动平均
+        self.frames = 0
+        self.over = 0       # 连续超出预算的帧数
+        self.under = 0      # 连续低于预算一半的帧数
+        self.events = deque(maxlen=100)
+        METRICS.gauge("render_quality_level", lambda: self.level, "画面降级级别（0为完整效果）")
+    
+    def should_render(self):
+        """这一帧是否渲染（降级时合并帧）"""
+        self.frames += 1
+        return self.frames % self.LEVELS[self.level][1] == 0
+    
+    def refresh_aim(self):
+        return self.frames % self.LEVELS[self.level][0] == 0
+    
+    def measure(self, seconds):
+        """记录一帧的耗时，持续超出预算时降一级，持续宽裕时升一级"""
+        self.cost = seconds if self.cost is None else self.cost * 0.8 + seconds * 0.2
+        if self.cost > self.budget:
+            self.over += 1
+            self.under = 0
+            if self.over >= FRAME_BUDGET_PATIENCE and self.level < len(self.LEVELS) - 1:
+                self._set_level(self.level + 1)
+        elif self.cost < self.budget / 2:
+            self.under += 1
+            self.over = 0
+            if self.under >= FRAME_BUDGET_RECOVERY and self.level > 0:
+                self._set_level(self.level - 1)
+        else:
+            self.over = self.under = 0
+    
+    def _set_level(self, level):
+        event = {"ts": time.time(), "from": self.level, "to": level, "cost_ms": round(self.cost * 1000, 2)}
+        self.events.append(event)
+        METRICS.inc("render_level_changes_total", (("direction", "down" if level > self.level else "up"),))
+        print(f"[渲染] 每帧 {event['cost_ms']}ms，预算 {self.budget * 1000:g}ms，"
+              f"画面级别 {self.level} -> {level}", file=self.out)
+        self.level = level
+        self.over = self.under = 0
+    
+    def stats(self):
+        return {
+            "level": self.level,
+            "cost_ms": round(self.cost * 1000, 3) if self.cost is not None else None,
+            "budget_ms": self.budget * 1000,
+            "events": list(self.events),
+        }
+
+# 共享调度器：所有棋盘由同一条 root.after 链驱动，用小顶堆按到期时间推进，然后统一渲染
+class BoardScheduler:
+    def __init__(self, root, budget=None):
+        self.root = root
+        self.heap = []   # (到期时间, 序号, 棋盘)
+        self.views = {}  # 棋盘 -> 界面
+        self.ticks = 0
+        self.budget = budget or FrameBudget()
+        self._stale = set()  # 合并帧时已滚动但还没画出的棋盘
+        self._seq = itertools.count()
+        self._after_id = None
+    
+    def add(self, board, view):
+        """加入一个棋盘，并立即画出初始状态"""
+        self.views[board] = view
+        heapq.heappush(self.heap, (time.monotonic() + board.interval / 1000, next(self._seq), board))
+        self.render([board])
+        self._schedule()
+    
+    def remove(self, board):
+        # 堆中的条目在到期时丢弃
+        self.views.pop(board, None)
+    
+    def clear(self):
+        """移除所有棋盘并取消定时器"""
+        self.heap = []
+        self.views = {}
+        self._stale = set()
+        if self._after_id is not None:
+            self.root.after_cancel(self._after_id)
+            self._after_id = None
+    
+    def render(self, boards, refresh_aim=True):
+        """批量渲染；界面已被销毁的棋盘自动移除"""
+        start = time.perf_counter()
+        for board in boards:
+            self._stale.discard(board)
+            view = self.views.get(board)
+            if view is None:
+                continue
+            try:
+                view.render(refresh_aim)
+            except tk.TclError:
+                self.remove(board)
+                continue
+            board.mark_shown(time.monotonic())
+        if boards:
+            METRICS.observe("render_seconds", time.perf_counter() - start)
+    
+    def _schedule(self):
+        if self._after_id is not None:
+            self.root.after_cancel(self._after_id)
+            self._after_id = None
+        if self.heap:
+            delay = max(0, int((self.heap[0][0] - time.monotonic()) * 1000))
+            self._after_id = self.root.after(delay, self._tick)
+    
+    def _tick(self):
+        self._after_id = None
+        self.ticks += 1
+        now = time.monotonic()
+        start = time.perf_counter()
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            deadline, _, board = heapq.heappop(self.heap)
+            if board not in self.views or board.state != "playing":
+                continue
+            board.tick()
+            due.append(board)
+            # 保持固定节奏；落后太多时从现在重新计时
+            deadline += board.interval / 1000
+            if deadline <= now:
+                deadline = now + board.interval / 1000
+            heapq.heappush(self.heap, (deadline, next(self._seq), board))
+        METRICS.inc("board_ticks_total", value=len(due))
+        METRICS.observe("tick_seconds", time.perf_counter() - start)
+        if due:
+            if self.budget.should_render():
+                self.render(list(self._stale.union(due)) if self._stale else due, self.budget.refresh_aim())
+            else:
+                # 超出预算：这一帧只推进逻辑，下一次渲染时一起画出
+                self._stale.update(due)
+            self.budget.measure(time.perf_counter() - start)
+        self._schedule()
+
+# 输入管线：按键连同按下的时间进入队列，按顺序处理，并记录从按键到判定的延迟
+class InputPipeline:
+    def __init__(self, handle, history=INPUT_LATENCY_HISTORY):
+        self.handle = handle      # handle(action, at)
+        self.queue = deque()      # (按键时间, 动作)
+        self.latencies = deque(maxlen=history)
+        self._offset = None       # 事件时间（毫秒）到 time.monotonic() 的换算
+        self._last_event_time = None
+    
+    def timestamp(self, event):
+        """把Tk事件时间换算成time.monotonic()；事件没有时间时使用当前时间"""
+        now = time.monotonic()
+        event_time = getattr(event, "time", None)
+        if not isinstance(event_time, int) or event_time <= 0:
+            return now
+        if self._last_event_time is not None and event_time < self._last_event_time:
+            # 事件时钟回绕，重新校准
+            self._offset = None
+        self._last_event_time = event_time
+        # 事件处理总是晚于按键，差值最小的一次最接近真实的换算
+        offset = now - event_time / 1000
+        if self._offset is None or offset < self._offset:
+            self._offset = offset
+        return min(now, event_time / 1000 + self._offset)
+    
+    def push(self, action, event=None):
+        self.queue.append((self.timestamp(event), action))
+    
+    def drain(self):
+        """按顺序处理队列中的全部输入"""
+        while self.queue:
+            at, action = self.queue.popleft()
+            self.handle(action, at)
+            self.latencies.append(time.monotonic() - at)
+    
+    def clear(self):
+        self.queue.clear()
+    
+    def stats(self):
+        """输入到判定的延迟（毫秒）"""
+        samples = sorted(self.latencies)
+        if not samples:
+            return {"count": 0}
+        def percentile(p):
+            return round(samples[min(len(samples) - 1, int(len(samples) * p))] * 1000, 2)
+        return {
+            "count": len(samples),
+            "p50_ms": percentile(0.5),
+            "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99),
+            "max_ms": round(samples[-1] * 1000, 2),
+        }
+
+# 泄漏检测（诊断模式）：每次切换界面时记录残留的控件、定时器、绑定和Python堆，
+# 同一界面连续多次只增不减的指标视为泄漏
+class LeakDetector:
+    def __init__(self, root, window=LEAK_WINDOW, frames=LEAK_TRACE_FRAMES, out=sys.stderr):
+        self.root = root
+        self.window = window
+        self.out = out
+        self.history = {}   # 界面 -> deque((指标, 堆快照))
+        self.leaks = []     # 最近一次发现的泄漏
+        self.checkpoints = 0
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+    
+    def sample(self):
+        """当前残留资源的数量"""
+        widgets = 0
+        stack = [self.root]
+        while stack:
+            widget = stack.pop()
+            children = widget.winfo_children()
+            widgets += len(children)
+            stack.extend(children)
+        call = self.root.tk.call
+        split = self.root.tk.splitlist
+        return {
+            "widgets": widgets,
+            "after": len(split(call("after", "info"))),
+            "bindings": len(split(call("bind", "all"))) + len(split(call("bind", str(self.root)))),
+            "commands": len(split(call("info", "commands"))),
+        }
+    
+    def snapshot(self):
+        """不含tracemalloc自身和导入机制分配的堆快照"""
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        ))
+    
+    def checkpoint(self, screen):
+        """切换到screen界面之前调用（旧界面已销毁）"""
+        gc.collect()
+        sample = self.sample()
+        snapshot = self.snapshot()
+        sample["heap"] = sum(stat.size for stat in snapshot.statistics("filename"))
+        history = self.history.setdefault(screen, deque(maxlen=self.window))
+        history.append((sample, snapshot))
+        self.checkpoints += 1
+        self.leaks = self.find_leaks(screen)
+        for leak in self.leaks:
+            print(f"[泄漏] {leak['screen']} {leak['metric']}: {leak['values']}", file=self.out)
+            for site in leak.get("sites", []):
+                print(f"    {site}", file=self.out)
+        return self.leaks
+    
+    def find_leaks(self, screen):
+        history = self.history[screen]
+        if len(history) < self.window:
+            return []
+        leaks = []
+        for metric in history[-1][0]:
+            values = [sample[metric] for sample, _ in history]
+            increasing = all(b >= a for a, b in zip(values, values[1:]))
+            threshold = LEAK_HEAP_BYTES if metric == "heap" else 1
+            if not increasing or values[-1] - values[0] < threshold:
+                continue
+            leak = {"screen": screen, "metric": metric, "values": values}
+            if metric == "heap":
+                # 增长最多的分配位置
+                diff = history[-1][1].compare_to(history[0][1], "traceback")
+                leak["sites"] = [f"+{stat.size_diff} B {stat.traceback[-1].filename}:{stat.traceback[-1].lineno}"
+                                 for stat in diff[:LEAK_TOP_SITES] if stat.size_diff > 0]
+            leaks.append(leak)
+        return leaks
+    
+    def stats(self):
+        return {
+            "checkpoints": self.checkpoints,
+            "screens": {screen: history[-1][0] for screen, history in self.history.items()},
+            "leaks": [{key: leak[key] for key in ("screen", "metric", "values")} for leak in self.leaks],
+        }
+
+# 账户变更分发：订阅者回调可能来自后台线程，先按账户合并，再分批在Tk线程中交给各界面
+class ChangeDispatcher:
+    def __init__(self, root, interval=CHANGE_FLUSH_INTERVAL):
+        self.root = root
+        self.interval = interval
+        self.views = {}     # 名称 -> callback(变更)，变更为 {用户名: 字段集合}
+        self.batches = 0
+        self.events = 0
+        self._pending = {}
+        self._scheduled = False
+        self._lock = threading.Lock()
+        self._poll()
+    
+    def publish(self, username, fields):
+        """记录一次变更（任意线程）"""
+        with self._lock:
+            self._pending.setdefault(username, set()).update(fields)
+            self.events += 1
+            if self._scheduled:
+                return
+            self._scheduled = True
+        # 只有Tk线程可以调用Tk；其他线程的变更由定时检查处理
+        if threading.current_thread() is threading.main_thread():
+            self.root.after_idle(self.flush)
+    
+    def watch(self, name, callback):
+        """注册（或替换）一个界面的更新回调"""
+        self.views[name] = callback
+    
+    def clear(self):
+        """切换界面时移除所有界面回调，未处理的变更随之丢弃"""
+        self.views = {}
+        with self._lock:
+            self._pending = {}
+    
+    def flush(self):
+        with self._lock:
+            changes = self._pending
+            self._pending = {}
+            self._scheduled = False
+        if not changes or not self.views:
+            return
+        self.batches += 1
+        for callback in list(self.views.values()):
+            callback(changes)
+    
+    def _poll(self):
+        self.flush()
+        self.root.after(self.interval, self._poll)
+
+# 游戏主类
+class DeltaLockGame:
+    def __init__(self, root, diagnostics=False, race_address=None, frame_budget=FRAME_BUDGET):
+        self.root = root
+        self.root.title("三角洲开锁模拟器")
+        self.root.geometry("800x600")
+        self.root.resizable(False, False)
+        
+        # 账户管理：保存不阻塞界面，需要确认落盘的地方用poll_future等待
+        self.account_manager = AccountManager(wait_writes=False)
+        self.current_account = None
+        self.player_data = PlayerData()
+        self.current_level = 1
+        self.session_id = None
+        self.catalog = ShopCatalog()
+        # 所有棋盘共用一个调度器
+        self.scheduler = BoardScheduler(self.root, FrameBudget(frame_budget))
+        # 后台预先生成各关卡的布局
+        self.level_pack = LevelPack()
+        self.pending_layout = None
+        self.boards = []
+        self.board_views = []
+        self.board_seats = []
+        self.tournament = False
+        # 输入队列
+        self.input = InputPipeline(self.handle_input)
+        self.input_scheduled = False
+        self.game_bindings = []
+        # 诊断模式下检测控件、回调和内存泄漏
+        self.leak_detector = LeakDetector(self.root) if diagnostics else None
+        # 账户变更只更新受影响的行和标签，不重建整个界面
+        self.changes = ChangeDispatcher(self.root)
+        self.account_manager.subscribe(self.changes.publish)
+        # 界面编号：每次切换界面加一，后台任务完成时据此判断原来的界面是否还在
+        self.screen_serial = 0
+        # 已结束的每局游戏记入列式历史
+        self.history = GameHistory()
+        self.game_coins = 0
+        # 联机竞速的主机地址（host:port）和当前连接
+        self.race_address = race_address
+        self.race = None
+        # 主机要重新验证密码，联机竞速时保留登录时输入的密码
+        self.race_password = None
+        METRICS.gauge("boards_playing", lambda: sum(board.state == "playing" for board in list(self.boards)),
+                      "正在进行的棋盘数")
+        
+        self.show_login_screen()
+    
+    def show_login_screen(self):
+        """显示登录界面"""
+        self.leave_game()
+        
+        # 退出当前登录的账户
+        if self.player_data.username:
+            self.account_manager.logout(self.player_data.username)
+            self.player_data = PlayerData()
+            self.current_level = 1
+            self.race_password = None
+        
+        # 清除当前窗口
+        self.clear_window("login")
+        
+        # 标题
+        title_label = tk.Label(self.root, text="三角洲开锁模拟器", font=("Arial", 24, "bold"), fg="#00FF00", bg="#000000")
+        title_label.pack(fill=tk.X, pady=20)
+        
+        # 登录框架
+        login_frame = tk.Frame(self.root, bg="#000000")
+        login_frame.pack(expand=True)
+        
+        # 用户名输入
+        tk.Label(login_frame, text="用户名:", font=("Arial", 16), fg="#FFFFFF", bg="#000000").grid(row=0, column=0, pady=10, padx=10)
+        self.username_entry = tk.Entry(login_frame, font=("Arial", 16), width=20)
+        self.username_entry.grid(row=0, column=1, pady=10, padx=10)
+        
+        # 密码输入
+        tk.Label(login_frame, text="密码:", font=("Arial", 16), fg="#FFFFFF", bg="#000000").grid(row=1, column=0, pady=10, padx=10)
+        self.password_entry = tk.Entry(login_frame, font=("Arial", 16), width=20, show="*")
+        self.password_entry.grid(row=1, column=1, pady=10, padx=10)
+        
+        # 消息标签
+        self.login_message = tk.Label(login_frame, text="", font=("Arial", 14), fg="#FF0000", bg="#000000")
+        self.login_message.grid(row=2, column=0, columnspan=2, pady=10)
+        
+        # 按钮框架
+        button_frame = tk.Frame(login_frame, bg="#000000")
+        button_frame.grid(row=3, column=0, columnspan=2, pady=20)
+        
+        # 登录按钮
+        self.login_button = tk.Button(button_frame, text="登录", font=("Arial", 16), width=10, 
+                                      bg="#00FF00", fg="#000000", command=self.handle_login)
+        self.login_button.pack(side=tk.LEFT, padx=10)
+        
+        # 注册按钮
+        register_button = tk.Button(button_frame, text="注册", font=("Arial", 16), width=10, 
+                                 bg="#FFD700", fg="#000000", command=self.show_register_screen)
+        register_button.pack(side=tk.LEFT, padx=10)
+        
+        # 回车键登录
+        self.root.bind("<Return>", lambda event: self.handle_login())
+    
+    def handle_login(self):
+        """处理登录"""
+        username = self.username_entry.get().strip()
+        password = self.password_entry.get().strip()
+        
+        if not username or not password:
+            self.login_message.config(text="用户名和密码不能为空！")
+            return
+        # 验证进行中（双击或连按回车）不再提交
+        if str(self.login_button["state"]) == tk.DISABLED:
+            return
+        
+        # 密码验证在后台线程池中进行，完成后回到界面线程处理
+        self.login_message.config(text="正在验证...")
+        self.login_button.config(state=tk.DISABLED)
+        future = self.account_manager.begin_login(username, password)
+        self.poll_future(future, lambda result: self.finish_handle_login(username, result, password))
+    
+    def finish_handle_login(self, username, result, password):
+        """处理后台登录验证的结果"""
+        account, message = self.account_manager.finish_login(username, result)
+        if account:
+            # 登录成功
+            self.current_account = account
+            if self.race_address:
+                self.race_password = password
+            self.player_data.load_from_account(account)
+            self.session_id = uuid.uuid4().hex[:12]
+            self.show_main_menu()
+        else:
+            # 登录失败
+            self.login_message.config(text=message)
+            self.login_button.config(state=tk.NORMAL)
+    
+    def clear_window(self, screen):
+        """切换界面：销毁旧界面的控件和全局滚轮绑定，诊断模式下记录残留资源"""
+        self.root.unbind_all("<MouseWheel>")
+        self.changes.clear()
+        self.screen_serial += 1
+        for widget in self.root.winfo_children():
+            widget.destroy()
+        if self.leak_detector is not None:
+            self.leak_detector.checkpoint(screen)
+    
+    def poll_future(self, future, callback, serial=None):
+        """在Tk线程中等待后台任务完成，然后调用回调；期间已切换到其他界面（控件已销毁）时丢弃结果"""
+        if serial is None:
+            serial = self.screen_serial
+        if serial != self.screen_serial:
+            return
+        if future.done():
+            callback(future.result())
+        else:
+            self.root.after(10, lambda: self.poll_future(future, callback, serial))
+    
+    def show_register_screen(self):
+        """显示注册界面"""
+        # 清除当前窗口
+        self.clear_window("register")
+        
+        # 标题
+        title_label = tk.Label(self.root, text="注册新账户", font=("Arial", 24, "bold"), fg="#00FF00", bg="#000000")
+        title_label.pack(fill=tk.X, pady=20)
+        
+        # 注册框架
+        register_frame = tk.Frame(self.root, bg="#000000")
+        register_frame.pack(expand=True)
+        
+        # 用户名输入
+        tk.Label(register_frame, text="用户名:", font=("Arial", 16), fg="#FFFFFF", bg="#000000").grid(row=0, column=0, pady=10, padx=10)
+        self.reg_username_entry = tk.Entry(register_frame, font=("Arial", 16), width=20)
+        self.reg_username_entry.grid(row=0, column=1, pady=10, padx=10)
+        
+        # 密码输入
+        tk.Label(register_frame, text="密码:", font=("Arial", 16), fg="#FFFFFF", bg="#000000").grid(row=1, column=0, pady=10, padx=10)
+        self.reg_password_entry = tk.Entry(register_frame, font=("Arial", 16), width=20, show="*")
+        self.reg_password_entry.grid(row=1, column=1, pady=10, padx=10)
+        
+        # 确认密码
+        tk.Label(register_frame, text="确认密码:", font=("Arial", 16), fg="#FFFFFF", bg="#000000").grid(row=2, column=0, pady=10, padx=10)
+        self.reg_confirm_entry = tk.Entry(register_frame, font=("Arial", 16), width=20, show="*")
+        self.reg_confirm_entry.grid(row=2, column=1, pady=10, padx=10)
+        
+        # 消息标签
+        self.register_message = tk.Label(register_frame, text="", font=("Arial", 14), fg="#FF0000", bg="#000000")
+        self.register_message.grid(row=3, column=0, columnspan=2, pady=10)
+        
+        # 按钮框架
+        button_frame = tk.Frame(register_frame, bg="#000000")
+        button_frame.grid(row=4, column=0, columnspan=2, pady=20)
+        
+        # 注册按钮
+        register_button = tk.Button(button_frame, text="注册", font=("Arial", 16), width=10, 
+                                 bg="#00FF00", fg="#000000", command=self.handle_register)
+        register_button.pack(side=tk.LEFT, padx=10)
+        
+        # 返回登录
+        back_button = tk.Button(button_frame, text="返回登录", font=("Arial", 16), width=10, 
+                             bg="#FFD700", fg="#000000", command=self.show_login_screen)
+        back_button.pack(side=tk.LEFT, padx=10)
+    
+    def handle_register(self):
+        """处理注册"""
+        username = self.reg_username_entry.get().strip()
+        password = self.reg_password_entry.get().strip()
+        confirm_password = self.reg_confirm_entry.get().strip()
+        
+        if not username or not password:
+            self.register_message.config(text="用户名和密码不能为空！")
+            return
+        
+        if password != confirm_password:
+            self.register_message.config(text="两次输入的密码不一致！")
+            return
+        
+        # 密码哈希在后台线程池中计算
+        future = self.account_manager.begin_register(username, password)
+        self.poll_future(future, lambda result: self.finish_handle_register(username, result))
+    
+    def finish_handle_register(self, username, password_hash):
+        """处理后台注册哈希的结果"""
+        success, message = self.account_manager.finish_register(username, password_hash)
+        if success:
+            # 注册成功，返回登录界面
+            self.register_message.config(text=message, fg="#00FF00")
+            # 清空输入
+            self.reg_username_entry.delete(0, tk.END)
+            self.reg_password_entry.delete(0, tk.END)
+            self.reg_confirm_entry.delete(0, tk.END)
+            # 2秒后返回登录界面
+            self.root.after(2000, self.show_login_screen)
+        else:
+            # 注册失败
+            self.register_message.config(text=message)
+    
+    def show_main_menu(self):
+        self.leave_game()
+        
+        # 清除当前窗口
+        self.clear_window("main_menu")
+        
+        # 标题
+        title_label = tk.Label(self.root, text="三角洲开锁模拟器", font=("Arial", 24, "bold"), fg="#00FF00", bg="#000000")
+        title_label.pack(fill=tk.X, pady=20)
+        
+        # 账户信息显示
+        account_frame = tk.Frame(self.root, bg="#000000")
+        account_frame.pack(pady=10)
+        
+        # 用户名显示
+        account_type = "管理员" if self.player_data.account_type == "admin" else "普通用户"
+        tk.Label(account_frame, text=f"当前账户: {self.player_data.username}", font=("Arial", 14), fg="#FFFFFF", bg="#000000").pack(side=tk.LEFT, padx=10)
+        tk.Label(account_frame, text=f"账户类型: {account_type}", font=("Arial", 14), fg="#FFFF00", bg="#000000").pack(side=tk.LEFT, padx=10)
+        
+        # 哈夫币显示
+        coin_label = tk.Label(self.root, text=f"哈夫币: {self.player_data.haf_coin}", font=("Arial", 16), fg="#FFD700", bg="#000000")
+        coin_label.pack(pady=10)
+        self.watch_coins(coin_label)
+        
+        # 按钮框架 - 使用side=tk.TOP确保在退出登录按钮之前
+        button_frame = tk.Frame(self.root, bg="#000000")
+        button_frame.pack(side=tk.TOP, expand=True)
+        
+        # 开始游戏按钮 - 减小高度和字体大小
+        start_button = tk.Button(button_frame, text="开始游戏", font=("Arial", 16), width=20, height=1, 
+                               bg="#00FF00", fg="#000000", command=self.start_game)
+        start_button.pack(pady=12)
+        
+        # 锦标赛模式按钮
+        tournament_button = tk.Button(button_frame, text="锦标赛模式", font=("Arial", 16), width=20, height=1, 
+                                    bg="#00FF00", fg="#000000", command=self.start_tournament)
+        tournament_button.pack(pady=12)
+        
+        # 联机竞速按钮（指定了主机地址时）
+        if self.race_address:
+            race_button = tk.Button(button_frame, text="联机竞速", font=("Arial", 16), width=20, height=1,
+                                    bg="#00FF00", fg="#000000", command=self.start_race)
+            race_button.pack(pady=12)
+        
+        # 商店按钮
+        shop_button = tk.Button(button_frame, text="商店", font=("Arial", 16), width=20, height=1, 
+                              bg="#00FF00", fg="#000000", command=self.show_shop)
+        shop_button.pack(pady=12)
+        
+        # 功能设置按钮
+        settings_button = tk.Button(button_frame, text="功能设置", font=("Arial", 16), width=20, height=1, 
+                                 bg="#00FF00", fg="#000000", command=self.show_feature_settings)
+        settings_button.pack(pady=12)
+        
+        # 管理员功能
+        if self.player_data.account_type == "admin":
+            admin_button = tk.Button(button_frame, text="管理员控制台", font=("Arial", 16), width=20, height=1, 
+                                 bg="#FF0000", fg="#FFFFFF", command=self.show_admin_console)
+            admin_button.pack(pady=12)
+        
+        # 退出登录按钮 - 使用更醒目的位置和样式
+        logout_button = tk.Button(self.root, text="退出登录", font=("Arial", 14, "bold"), 
+                               bg="#FF0000", fg="#FFFFFF", command=self.show_login_screen)
+        logout_button.pack(side=tk.BOTTOM, pady=20, padx=20)
+        
+        # 设置背景
+        self.root.configure(bg="#000000")
+    
+    def show_admin_console(self):
+        """显示管理员控制台"""
+        # 清除当前窗口
+        self.clear_window("admin_console")
+        
+        # 标题
+        title_label = tk.Label(self.root, text="管理员控制台", font=("Arial", 24, "bold"), fg="#FF0000", bg="#000000")
+        title_label.pack(fill=tk.X, pady=20)
+        
+        # 返回按钮
+        back_button = tk.Button(self.root, text="返回主菜单", font=("Arial", 14), 
+                               bg="#00FF00", fg="#000000", command=self.show_main_menu)
+        back_button.pack(anchor=tk.NW, padx=10, pady=10)
+        
+        # 用户管理框架
+        user_frame = tk.Frame(self.root, bg="#000000")
+        user_frame.pack(expand=True, fill=tk.BOTH, padx=20, pady=20)
+        
+        tk.Label(user_frame, text="用户管理", font=("Arial", 20, "bold"), fg="#FFFFFF", bg="#000000").pack(pady=10)
+        
+        # 用户列表
+        self.user_listbox = tk.Listbox(user_frame, font=("Arial", 14), width=50, height=15, 
+                                     bg="#333333", fg="#FFFFFF", selectbackground="#00FF00")
+        self.user_listbox.pack(pady=10)
+        
+        # 创建右键菜单
+        self.context_menu = tk.Menu(self.root, tearoff=0, bg="#333333", fg="#FFFFFF")
+        self.context_menu.add_command(label="封禁账号", command=self.ban_selected_user)
+        self.context_menu.add_command(label="解封账号", command=self.unban_selected_user)
+        self.context_menu.add_separator()  # 添加分隔线
+        self.context_menu.add_command(label="设置哈夫币", command=self.show_set_coins_dialog)
+        self.context_menu.add_command(label="切换商店状态", command=self.toggle_shop_access)
+        self.context_menu.add_command(label="查看操作记录", command=self.show_user_audit)
+        
+        # 绑定右键菜单事件
+        def show_context_menu(event):
+            # 确保点击的是有效项目
+            index = self.user_listbox.nearest(event.y)
+            if index >= 0 and index < self.user_listbox.size():
+                self.user_listbox.selection_clear(0, tk.END)
+                self.user_listbox.selection_set(index)
+                self.user_listbox.activate(index)
+                
+                # 获取选中的用户信息
+                selected_item = self.user_listbox.get(index)
+                username = selected_item.split(" ")[-1]
+                if "[封禁]" in selected_item:
+                    # 用户已封禁，只显示解封选项
+                    self.context_menu.entryconfig(0, state=tk.DISABLED)
+                    self.context_menu.entryconfig(1, state=tk.NORMAL)
+                else:
+                    # 用户正常，只显示封禁选项
+                    self.context_menu.entryconfig(0, state=tk.NORMAL)
+                    self.context_menu.entryconfig(1, state=tk.DISABLED)
+                
+                # 显示右键菜单
+                self.context_menu.post(event.x_root, event.y_root)
+                # 保存当前选中的用户名
+                self.current_selected_user = username
+        
+        # 绑定右键点击事件
+        self.user_listbox.bind('<Button-3>', show_context_menu)
+        
+        # 刷新用户列表
+        self.refresh_user_list()
+        
+        # 刷新按钮
+        button_frame = tk.Frame(user_frame, bg="#000000")
+        button_frame.pack(pady=20)
+        
+        refresh_button = tk.Button(button_frame, text="刷新列表", font=("Arial", 16), width=15, 
+                                 bg="#FFD700", fg="#000000", command=self.refresh_user_list)
+        refresh_button.pack(pady=10)
+        
+        # 审计日志查询
+        audit_button = tk.Button(button_frame, text="最近一周哈夫币修改", font=("Arial", 14), width=18, 
+                               bg="#333333", fg="#FFFFFF", command=self.show_recent_coin_edits)
+        audit_button.pack(pady=5)
+    
+    def show_user_audit(self):
+        """显示针对选中用户的全部管理员操作"""
+        if not getattr(self, 'current_selected_user', None):
+            return
+        username = self.current_selected_user
+        self.show_audit_entries(f"{username} 的操作记录", self.account_manager.audit.query(target=username))
+    
+    def show_recent_coin_edits(self):
+        """显示最近一周管理员修改哈夫币的记录"""
+        entries = self.account_manager.audit.query(action="set_coins", start=time.time() - 7 * 24 * 3600)
+        self.show_audit_entries("最近一周哈夫币修改", entries)
+    
+    def show_audit_entries(self, title, entries):
+        """在对话框中列出审计记录（最新的在前）"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title(title)
+        dialog.geometry("600x400")
+        dialog.configure(bg="#000000")
+        
+        listbox = tk.Listbox(dialog, font=("Arial", 12), bg="#333333", fg="#FFFFFF")
+        listbox.pack(expand=True, fill=tk.BOTH, padx=10, pady=10)
+        for entry in reversed(entries):
+            when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry["ts"]))
+            listbox.insert(tk.END, f"{when} {entry['who']} {entry['act']} {entry['tgt']}: "
+                                   f"{entry['old']} -> {entry['new']}")
+        if not entries:
+            listbox.insert(tk.END, "没有记录")
+    
+    def refresh_user_list(self):
+        """刷新用户列表：在后台线程中读取账户快照，完成后再更新列表"""
+        listbox = self.user_listbox
+        # 读取期间的变更先攒下来，列表显示后再补上；快照之前的变更重放一次也不影响结果，
+        # 所以要在取快照之前开始记录
+        buffered = {}
+        
+        def buffer(changes):
+            for username, fields in changes.items():
+                buffered.setdefault(username, set()).update(fields)
+        
+        self.changes.watch("users", buffer)
+        future = self.account_manager.begin_user_list()
+        self.poll_future(future, lambda users: self.show_user_list(listbox, users, buffered))
+    
+    def show_user_list(self, listbox, users, buffered=None):
+        # 读取期间已离开管理员控制台
+        if listbox is not self.user_listbox or not listbox.winfo_exists():
+            return
+        
+        # 清空列表
+        listbox.delete(0, tk.END)
+        
+        for user in users:
+            status = "[封禁]" if user["banned"] else "[正常]"
+            listbox.insert(tk.END, f"{status} {user['username']}")
+        # 与列表行一一对应的用户名（已排序），之后的变更按行更新
+        self.user_rows = [user["username"] for user in users]
+        self.changes.watch("users", self.apply_user_changes)
+        if buffered:
+            self.apply_user_changes(buffered)
+    
+    def apply_user_changes(self, changes):
+        """只更新发生变化的用户行：新账户插入到排序位置，状态变化替换该行"""
+        listbox = self.user_listbox
+        for username, fields in changes.items():
+            # 哈夫币等不在列表中显示的字段变化不必读取账户
+            if not fields & {"banned", "account_type", "*"}:
+                continue
+            index = bisect.bisect_left(self.user_rows, username)
+            exists = index < len(self.user_rows) and self.user_rows[index] == username
+            account = self.account_manager.get_account(username)
+            if account is None or account.account_type != "user":
+                if exists:
+                    del self.user_rows[index]
+                    listbox.delete(index)
+                continue
+            status = "[封禁]" if account.banned else "[正常]"
+            selected = index in listbox.curselection()
+            if exists:
+                listbox.delete(index)
+            else:
+                self.user_rows.insert(index, username)
+            listbox.insert(index, f"{status} {username}")
+            if selected:
+                listbox.selection_set(index)
+    
+    def ban_selected_user(self):
+        """封禁选中的用户"""
+        selected_index = self.user_listbox.curselection()
+        if not selected_index:
+            return
+        
+        # 获取选中的用户名
+        selected_item = self.user_listbox.get(selected_index)
+        username = selected_item.split(" ")[-1]
+        
+        # 封禁用户（列表由变更通知按行更新）
+        self.account_manager.ban_account(username, self.player_data.username)
+    
+    def unban_selected_user(self):
+        """解封选中的用户"""
+        selected_index = self.user_listbox.curselection()
+        if not selected_index:
+            return
+        
+        # 获取选中的用户名
+        selected_item = self.user_listbox.get(selected_index)
+        username = selected_item.split(" ")[-1]
+        
+        # 解封用户（列表由变更通知按行更新）
+        self.account_manager.unban_account(username, self.player_data.username)
+    
+    def set_user_coins(self):
+        """设置选中用户的金币数量"""
+        selected_index = self.user_listbox.curselection()
+        if not selected_index:
+            return
+        
+        try:
+            coins = int(self.coin_entry.get())
+            if coins < 0:
+                return
+            
+            # 获取选中的用户名
+            selected_item = self.user_listbox.get(selected_index)
+            username = selected_item.split(" ")[-1]
+            
+            # 更新金币数量
+            self.account_manager.set_coins(username, coins, "admin_set", self.session_id,
+                                           self.player_data.username)
+            
+            # 更新界面信息
+            self.update_selected_user_info(username)
+            
+        except ValueError:
+            pass
+    
+    def set_user_shop_access(self):
+        """设置选中用户是否可以使用商店"""
+        selected_index = self.user_listbox.curselection()
+        if not selected_index:
+            return
+        
+        # 获取选中的用户名
+        selected_item = self.user_listbox.get(selected_index)
+        username = selected_item.split(" ")[-1]
+        
+        # 更新商店禁用状态
+        shop_disabled = self.shop_disabled_var.get()
+        self.account_manager.set_shop_disabled(username, shop_disabled, self.player_data.username)
+        
+        # 更新界面信息
+        self.update_selected_user_info(username)
+    
+    def show_set_coins_dialog(self):
+        """显示设置哈夫币的对话框"""
+        if not hasattr(self, 'current_selected_user') or not self.current_selected_user:
+            return
+        
+        # 获取当前选中的用户
+        username = self.current_selected_user
+        account = self.account_manager.get_account(username)
+        if not account:
+            return
+        
+        # 创建对话框
+        dialog = tk.Toplevel(self.root)
+        dialog.title("设置哈夫币")
+        dialog.geometry("300x150")
+        dialog.configure(bg="#000000")
+        dialog.resizable(False, False)
+        
+        # 对话框居中显示
+        dialog.update_idletasks()
+        width = dialog.winfo_width()
+        height = dialog.winfo_height()
+        x = (self.root.winfo_width() // 2) - (width // 2) + self.root.winfo_x()
+        y = (self.root.winfo_height() // 2) - (height // 2) + self.root.winfo_y()
+        dialog.geometry(f"{width}x{height}+{x}+{y}")
+        
+        # 标签
+        label = tk.Label(dialog, text="设置哈夫币数量:", font=("Arial", 12), 
+                        fg="#FFFFFF", bg="#000000")
+        label.pack(pady=10)
+        
+        # 输入框
+        coin_var = tk.StringVar(value=str(account.haf_coin))
+        coin_entry = tk.Entry(dialog, textvariable=coin_var, font=("Arial", 12), width=15)
+        coin_entry.pack(pady=5)
+        
+        # 确认按钮
+        def confirm_set_coins():
+            try:
+                coins = int(coin_var.get())
+                if coins >= 0:
+                    # 更新金币数量
+                    self.account_manager.set_coins(username, coins, "admin_set", self.session_id,
+                                                   self.player_data.username)
+                    # 关闭对话框
+                    dialog.destroy()
+            except ValueError:
+                pass
+        
+        confirm_button = tk.Button(dialog, text="确认", font=("Arial", 12), 
+                                  bg="#00FF00", fg="#000000", command=confirm_set_coins)
+        confirm_button.pack(pady=10)
+        
+        # 让对话框获得焦点
+        dialog.grab_set()
+    
+    def toggle_shop_access(self):
+        """切换选中用户的商店访问状态"""
+        if not hasattr(self, 'current_selected_user') or not self.current_selected_user:
+            return
+        
+        # 获取当前选中的用户
+        username = self.current_selected_user
+        account = self.account_manager.get_account(username)
+        if not account:
+            return
+        
+        # 切换商店禁用状态
+        current_status = account.shop_disabled
+        new_status = not current_status
+        
+        # 更新状态
+        self.account_manager.set_shop_disabled(username, new_status, self.player_data.username)
+    
+    def show_feature_settings(self):
+        """显示功能设置界面"""
+        # 清除当前窗口
+        self.clear_window("feature_settings")
+        
+        # 标题
+        title_label = tk.Label(self.root, text="功能设置", font=("Arial", 24, "bold"), fg="#00FF00", bg="#000000")
+        title_label.pack(fill=tk.X, pady=20)
+        
+        # 返回按钮
+        back_button = tk.Button(self.root, text="返回主菜单", font=("Arial", 14), 
+                               bg="#00FF00", fg="#000000", command=self.show_main_menu)
+        back_button.pack(anchor=tk.NW, padx=10, pady=10)
+        
+        # 功能设置框架
+        settings_frame = tk.Frame(self.root, bg="#000000")
+        settings_frame.pack(expand=True, fill=tk.BOTH, padx=20, pady=20)
+        
+        # 功能列表标题
+        tk.Label(settings_frame, text="已购买功能", font=(
+        "Arial", 20, "bold"), fg="#FFFFFF", bg="#000000").pack(pady=10)
+        
+        # 创建带滚动条的功能区域
+        canvas = tk.Canvas(settings_frame, bg="#000000", bd=0, highlightthickness=0)
+        scrollbar = tk.Scrollbar(settings_frame, orient="vertical", command=canvas.yview)
+        scrollable_frame = tk.Frame(canvas, bg="#000000")
+        
+        # 配置滚动区域
+        scrollable_frame.bind(
+            "<Configure>",
+            lambda e: canvas.configure(
+                scrollregion=canvas.bbox("all")
+            )
+        )
+        
+        canvas.create_window((0, 0), window=scrollable_frame, anchor="nw")
+        
+        # 功能开关字典，用于保存开关状态
+        self.feature_toggles = {}
+        
+        # 创建功能开关
+        def render_feature(index, feature):
+            feature_frame = tk.Frame(scrollable_frame, bg="#333333", bd=2, relief=tk.RAISED)
+            feature_frame.pack(pady=10, fill=tk.X, padx=10)
+            
+            # 功能名称和描述（来自商店目录）
+            item = self.catalog.get(feature)
+            desc_text = item["setting_text"] if item else feature
+            feature_label = tk.Label(feature_frame, text=desc_text, font=(
+            "Arial", 14), fg="#FFFFFF", bg="#333333")
+            feature_label.pack(side=tk.LEFT, padx=20, pady=10)
+            
+            # 开关按钮
+            toggle_var = tk.BooleanVar(value=self.player_data.enabled_features.get(feature, True))
+            toggle_button = tk.Checkbutton(feature_frame, text="开启", font=(
+            "Arial", 14), 
+                                          variable=toggle_var, bg="#333333", fg="#FFFFFF", 
+                                          selectcolor="#00FF00")
+            toggle_button.pack(side=tk.RIGHT, padx=20, pady=10)
+            
+            self.feature_toggles[feature] = toggle_var
+        
+        # 按需分批渲染，功能很多时界面也能立即打开
+        self.render_lazily(canvas, scrollbar, self.player_data.unlocked_features, render_feature)
+        
+        # 放置滚动区域和滚动条
+        canvas.pack(side="left", fill="both", expand=True, padx=10, pady=10)
+        scrollbar.pack(side="right", fill="y", pady=10)
+        
+        # 允许使用鼠标滚轮滚动
+        def _on_mousewheel(event):
+            canvas.yview_scroll(int(-1*(event.delta/120)), "units")
+        
+        canvas.bind_all("<MouseWheel>", _on_mousewheel)
+        
+        # 保存按钮
+        save_button = tk.Button(settings_frame, text="保存设置", font=(
+        "Arial", 18), width=20, height=2, 
+                              bg="#00FF00", fg="#000000", command=self.save_feature_settings)
+        save_button.pack(pady=20)
+        
+        # 如果没有已购买的功能
+        if not self.player_data.unlocked_features:
+            empty_label = tk.Label(settings_frame, text="您还没有购买任何功能，请先去商店购买！", 
+                                 font=("Arial", 16), fg="#FFFF00", bg="#000000")
+            empty_label.pack(pady=50)
+    
+    def render_lazily(self, canvas, scrollbar, items, render_item, page_size=LAZY_PAGE_SIZE):
+        """先渲染一页条目，滚动接近底部时再渲染下一页"""
+        state = {"next": 0, "scheduled": False}
+        
+        def render_page():
+            state["scheduled"] = False
+            end = min(state["next"] + page_size, len(items))
+            for index in range(state["next"], end):
+                render_item(index, items[index])
+            state["next"] = end
+        
+        def on_scroll(first, last):
+            scrollbar.set(first, last)
+            if float(last) > 0.9 and state["next"] < len(items) and not state["scheduled"]:
+                state["scheduled"] = True
+                canvas.after_idle(render_page)
+        
+        canvas.configure(yscrollcommand=on_scroll)
+        render_page()
+    
+    def active_features(self):
+        """当前玩家已购买且已开启的功能"""
+        return [feature for feature in self.player_data.unlocked_features
+                if self.player_data.enabled_features.get(feature, True)]
+    
+    def save_feature_settings(self):
+        """保存功能设置"""
+        # 更新功能开启状态
+        for feature, toggle_var in self.feature_toggles.items():
+            self.player_data.enabled_features[feature] = toggle_var.get()
+        
+        # 保存到账户（只写入改动过的开关）
+        self.account_manager.save_player_data(self.player_data)
+        
+        # 显示保存成功提示
+        success_label = tk.Label(self.root, text="设置保存成功！", font=("Arial", 16), fg="#00FF00", bg="#000000")
+        success_label.pack(pady=10)
+        
+        # 2秒后返回主菜单
+        self.root.after(2000, self.show_main_menu)
+    
+    def watch_coins(self, label):
+        """当前玩家的哈夫币变化时只更新这个标签"""
+        def update(changes):
+            fields = changes.get(self.player_data.username)
+            if fields and ("haf_coin" in fields or "*" in fields):
+                account = self.account_manager.get_account(self.player_data.username)
+                if account is not None:
+                    label.config(text=f"哈夫币: {account.haf_coin}")
+        self.changes.watch("coins", update)
+    
+    def change_coins(self, delta, reason):
+        """修改当前玩家的哈夫币并记入流水"""
+        balance = self.account_manager.change_coins(self.player_data.username, delta, reason, self.session_id)
+        self.game_coins += delta
+        if balance is None:
+            # 未登录账户只修改内存中的数据
+            self.player_data.haf_coin += delta
+            return
+        self.player_data.haf_coin = balance
+        self.player_data.mark_clean(["haf_coin"])
+    
+    def game_settings(self, spec=None):
+        """根据关卡参数和已购买且已开启的功能生成本局设置"""
+        if spec is None:
+            spec = level_spec(1)
+        return board_settings(spec, self.active_features(), self.catalog)
+    
+    def bind_game_keys(self):
+        """绑定游戏按键"""
+        # 所有按键先带着时间进入输入队列，保证按顺序、按按键时看到的画面判定
+        keys = [("<space>", "lock"), ("<Left>", "left"), ("<Right>", "right")]
+        if self.tournament:
+            keys.append(("<Tab>", "next_board"))
+            keys.extend((f"<Key-{index + 1}>", index) for index in range(min(9, len(self.boards))))
+        for sequence, action in keys:
+            # 记下回调的id，解绑时一并删除对应的Tcl命令
+            funcid = self.root.bind(sequence, lambda event, action=action: self.queue_input(action, event))
+            self.game_bindings.append((sequence, funcid))
+    
+    def queue_input(self, action, event):
+        self.input.push(action, event)
+        if not self.input_scheduled:
+            # 同一批事件合并到一次空闲回调中处理
+            self.input_scheduled = True
+            self.root.after_idle(self.process_input)
+        return "break"
+    
+    def process_input(self):
+        self.input_scheduled = False
+        self.input.drain()
+    
+    def handle_input(self, action, at):
+        """处理一条输入；at为按键时间"""
+        if self.race is not None:
+            # 竞速中锁定交给主机按顺序判定，选择列只在本地
+            if action == "lock":
+                self.race.lock()
+            elif action in ("left", "right") and self.boards:
+                self.boards[0].select(-1 if action == "left" else 1)
+                self.board_view.render()
+            return
+        if action == "lock":
+            self.lock_symbol(at=at)
+        elif action == "left":
+            self.select_previous_column()
+        elif action == "right":
+            self.select_next_column()
+        elif action == "next_board":
+            self.select_next_board()
+        else:
+            self.select_board(action)
+    
+    def leave_game(self):
+        """停止所有棋盘并解除游戏按键"""
+        self.scheduler.clear()
+        self.boards = []
+        self.board_views = []
+        self.board_seats = []
+        self.pending_layout = None
+        self.input.clear()
+        for sequence, funcid in self.game_bindings:
+            self.root.unbind(sequence, funcid)
+        self.game_bindings = []
+        if self.race is not None:
+            self.race.close()
+            self.race = None
+    
+    def start_game(self):
+        self.leave_game()
+        
+        # 清除当前窗口
+        self.clear_window("game")
+        
+        # 创建游戏界面
+        self.game_frame = tk.Frame(self.root, bg="#000000")
+        self.game_frame.pack(fill=tk.BOTH, expand=True)
+        
+        # 返回按钮
+        back_button = tk.Button(self.game_frame, text="返回主菜单", font=("Arial", 12), 
+                              bg="#FF0000", fg="#FFFFFF", command=self.show_main_menu)
+        back_button.pack(anchor=tk.NW, padx=10, pady=10)
+        
+        # 哈夫币显示
+        self.coin_label = tk.Label(self.game_frame, text=f"哈夫币: {self.player_data.haf_coin}", 
+                                 font=("Arial", 14), fg="#FFD700", bg="#000000")
+        self.coin_label.pack(anchor=tk.NE, padx=10, pady=10)
+        self.watch_coins(self.coin_label)
+        
+        # 关卡标题
+        tk.Label(self.game_frame, text=f"第 {self.current_level} 关", font=("Arial", 14, "bold"),
+                 fg="#FFFFFF", bg="#000000").pack()
+        
+        # 密码锁棋盘（布局由关卡包在后台准备好）
+        self.board_holder = tk.Frame(self.game_frame, bg="#000000")
+        self.board_holder.pack(expand=True, fill=tk.BOTH)
+        
+        # 状态标签
+        self.status_label = tk.Label(self.game_frame, text="正在准备关卡...", 
+                                   font=("Arial", 16), fg="#00FF00", bg="#000000")
+        self.status_label.pack(pady=20)
+        
+        self.tournament = False
+        self.focused_board = 0
+        
+        # 加倍下注状态
+        if not hasattr(self, 'is_double_bet'):
+            self.is_double_bet = False
+            self.double_bet_amount = 0
+        
+        self.level_pack.want(self.current_level)
+        future = self.level_pack.take(self.current_level)
+        self.pending_layout = future
+        self.poll_future(future, lambda layout: self.begin_level(future, layout))
+    
+    def begin_level(self, future, layout):
+        """布局准备好后开始本关；期间玩家离开了游戏界面则忽略"""
+        if future is not self.pending_layout:
+            return
+        self.pending_layout = None
+        spec = level_spec(layout["level"])
+        settings = self.game_settings(spec)
+        self.scroll_speed = settings["interval"]
+        self.board = LockBoard(interval=settings["interval"], lives=settings["lives"], layout=layout)
+        # 棋盘越大，格子越小
+        font_size = max(8, min(20, 100 // self.board.columns, 140 // self.board.rows))
+        self.board_view = BoardView(self.board_holder, self.board, settings["hint_color"],
+                                    settings["aim_window"], settings["aim_color"], font_size=font_size,
+                                    cell_width=4 if self.board.columns <= 6 else 2,
+                                    cell_height=2 if self.board.rows <= ROWS else 1,
+                                    padding=5 if self.board.columns <= 6 else 2)
+        self.board_view.frame.pack(expand=True, fill=tk.BOTH)
+        self.status_label.config(text="使用 ← → 键选择列，按空格键锁定正确的符号")
+        
+        self.game_start_time = time.time()
+        # 游戏历史：关卡、初始生命、是否在加倍下注中、本局的哈夫币变化
+        self.game_level = layout["level"]
+        self.game_lives = settings["lives"]
+        self.game_bet = self.is_double_bet
+        self.game_coins = 0
+        self.boards = [self.board]
+        self.board_views = [self.board_view]
+        
+        # 绑定键盘事件
+        self.bind_game_keys()
+        
+        # 开始滚动（由共享调度器驱动）
+        self.scheduler.add(self.board, self.board_view)
+    
+    def start_race(self):
+        """联机竞速：连接主机，等待所有玩家加入后开始"""
+        self.leave_game()
+        self.clear_window("race")
+        
+        self.game_frame = tk.Frame(self.root, bg="#000000")
+        self.game_frame.pack(fill=tk.BOTH, expand=True)
+        back_button = tk.Button(self.game_frame, text="返回主菜单", font=("Arial", 12),
+                              bg="#FF0000", fg="#FFFFFF", command=self.show_main_menu)
+        back_button.pack(anchor=tk.NW, padx=10, pady=10)
+        self.race_captions = tk.Label(self.game_frame, text="", font=("Arial", 12), fg="#FFFFFF",
+                                      bg="#000000", justify="left")
+        self.race_captions.pack()
+        self.board_holder = tk.Frame(self.game_frame, bg="#000000")
+        self.board_holder.pack(expand=True, fill=tk.BOTH)
+        self.status_label = tk.Label(self.game_frame, text="正在连接主机...", font=("Arial", 16),
+                                     fg="#00FF00", bg="#000000")
+        self.status_label.pack(pady=20)
+        self.tournament = False
+        self.focused_board = 0
+        
+        try:
+            self.race = RaceClient(self.race_address, self.player_data.username, self.race_password)
+        except OSError as error:
+            self.status_label.config(text=f"无法连接主机：{error}")
+            return
+        self.status_label.config(text="等待其他玩家加入...")
+        self.root.after(RACE_POLL_INTERVAL, self.poll_race)
+    
+    def poll_race(self):
+        """处理主机发来的消息：帧时钟推进所有棋盘，锁定输入按转发顺序判定"""
+        race = self.race
+        if race is None:
+            return
+        for event in race.poll():
+            kind = event[0]
+            if kind == "start":
+                board = race.own_board()
+                font_size = max(8, min(20, 100 // board.columns, 140 // board.rows))
+                self.board_view = BoardView(self.board_holder, board, font_size=font_size)
+                self.board_view.frame.pack(expand=True, fill=tk.BOTH)
+                self.boards = [board]
+                self.board_views = [self.board_view]
+                self.bind_game_keys()
+                self.board_view.render()
+                self.status_label.config(text=f"比赛开始！赌注 {race.stake} 个哈夫币，先打开密码锁的玩家获胜")
+            elif kind == "tick":
+                self.board_view.render()
+            elif kind == "input":
+                _, player, result = event
+                if player == race.player and result is not None:
+                    self.board_view.render()
+                    self.status_label.config(text={"hit": "锁定正确！", "won": "密码锁已打开！",
+                                                   "life": "锁定错误！用掉一条额外生命",
+                                                   "lost": "锁定错误！等待比赛结束"}[result])
+            elif kind == "end":
+                _, order, winners, consistent = event
+                names = race.sim.players
+                if race.player in winners:
+                    text = "你赢得了比赛！" if len(winners) == 1 else "并列第一，平分奖池！"
+                else:
+                    text = f"比赛结束，获胜者：{'、'.join(names[player] for player in winners)}"
+                if not consistent:
+                    text += "\n（本地模拟与主机不一致）"
+                self.status_label.config(text=text)
+                self.leave_game()
+            elif kind == "rejected":
+                self.status_label.config(text=f"无法加入：{event[1]}")
+            elif kind == "closed":
+                # 被拒绝后主机会断开连接，保留拒绝原因
+                if race.rejected is None and (race.sim is None or not race.sim.over()):
+                    self.status_label.config(text="与主机的连接已断开")
+                self.leave_game()
+                return
+        if race.sim is not None:
+            self.race_captions.config(text="\n".join(
+                f"{name}：{board.lock_count}/{board.columns}" + ("  通关" if board.state == "won" else
+                                                                  "  失败" if board.state == "lost" else "")
+                for name, board in zip(race.sim.players, race.sim.boards)))
+        self.root.after(RACE_POLL_INTERVAL, self.poll_race)
+    
+    def start_tournament(self, board_count=TOURNAMENT_BOARDS):
+        """锦标赛模式：同一窗口中同时进行多个独立棋盘，由同一个调度器驱动"""
+        self.leave_game()
+        
+        # 清除当前窗口
+        self.clear_window("tournament")
+        
+        self.game_frame = tk.Frame(self.root, bg="#000000")
+        self.game_frame.pack(fill=tk.BOTH, expand=True)
+        
+        # 返回按钮
+        back_button = tk.Button(self.game_frame, text="返回主菜单", font=("Arial", 12), 
+                              bg="#FF0000", fg="#FFFFFF", command=self.show_main_menu)
+        back_button.pack(anchor=tk.NW, padx=10, pady=5)
+        
+        # 棋盘越多，格子越小
+        grid_columns = math.ceil(math.sqrt(board_count))
+        grid_rows = math.ceil(board_count / grid_columns)
+        font_size = max(6, 20 // grid_columns)
+        boards_frame = tk.Frame(self.game_frame, bg="#000000")
+        boards_frame.pack(expand=True, fill=tk.BOTH)
+        
+        settings = self.game_settings()
+        self.tournament = True
+        self.boards = []
+        self.board_views = []
+        self.board_seats = []
+        self.board_captions = []
+        for index in range(board_count):
+            seat = tk.Frame(boards_frame, bg="#000000", bd=2, relief=tk.GROOVE)
+            seat.grid(row=index // grid_columns, column=index % grid_columns, padx=2, pady=2, sticky="nsew")
+            caption = tk.Label(seat, text=f"棋盘 {index + 1}", font=("Arial", max(8, font_size // 2 + 4)),
+                               fg="#FFFFFF", bg="#000000")
+            caption.pack()
+            board = LockBoard(interval=settings["interval"], lives=settings["lives"])
+            view = BoardView(seat, board, settings["hint_color"], settings["aim_window"], settings["aim_color"],
+                             font_size=font_size, cell_width=2, cell_height=1, padding=1)
+            view.frame.pack(expand=True, fill=tk.BOTH)
+            self.boards.append(board)
+            self.board_views.append(view)
+            self.board_seats.append(seat)
+            self.board_captions.append(caption)
+        for col in range(grid_columns):
+            boards_frame.grid_columnconfigure(col, weight=1)
+        for row in range(grid_rows):
+            boards_frame.grid_rowconfigure(row, weight=1)
+        
+        # 状态标签
+        self.status_label = tk.Label(self.game_frame, text="← → 选择列，空格锁定，Tab 或数字键切换棋盘",
+                                   font=("Arial", 14), fg="#00FF00", bg="#000000")
+        self.status_label.pack(pady=5)
+        
+        self.game_start_time = time.time()
+        # 每个棋盘结束时记入历史：锦标赛按第1关的参数开局，不涉及下注和哈夫币
+        self.game_level = 1
+        self.game_lives = settings["lives"]
+        self.game_bet = False
+        self.game_coins = 0
+        self.focused_board = 0
+        self.highlight_focused_board()
+        self.bind_game_keys()
+        for board, view in zip(self.boards, self.board_views):
+            self.scheduler.add(board, view)
+    
+    def current_board(self):
+        if not self.boards:
+            return None
+        return self.boards[self.focused_board]
+    
+    def lock_symbol(self, event=None, at=None):
+        # 只锁定当前棋盘中选中的列，按按键那一刻显示的画面判定
+        board = self.current_board()
+        if board is None:
+            return
+        result = board.lock(at)
+        if result is None:
+            return
+        METRICS.inc("locks_total", (("result", "hit" if result in ("hit", "won") else "miss"),))
+        self.scheduler.render([board])
+        
+        if result in ("won", "lost"):
+            self.game_end_time = time.time()
+        if self.tournament:
+            self.update_tournament_board(board, result)
+        elif result == "hit":
+            self.status_label.config(text=f"锁定正确！已锁定 {board.lock_count}/{board.columns}")
+        elif result == "won":
+            self.win_game()
+        elif result == "life":
+            self.status_label.config(text=f"锁定错误！剩余额外生命: {board.lives}")
+        else:
+            # 没有额外生命了，游戏失败
+            # 检查是否处于加倍下注状态
+            if self.is_double_bet:
+                # 加倍下注失败，显示失败信息并扣除奖金
+                self.change_coins(-self.double_bet_amount, "double_bet_loss")  # 真正扣除哈夫币
+                
+                self.status_label.config(text=f"锁定错误！游戏失败\n加倍下注失败！失去了 {self.double_bet_amount} 个哈夫币！")
+                self.is_double_bet = False
+                self.double_bet_amount = 0
+            else:
+                self.status_label.config(text="锁定错误！游戏失败")
+            self.record_game(board)
+            
+            # 显示重新开始按钮
+            restart_button = tk.Button(self.game_frame, text="重新开始", font=(
+                "Arial", 16), bg="#00FF00", fg="#000000", command=self.start_game)
+            restart_button.pack(pady=20)
+    
+    def update_tournament_board(self, board, result):
+        """更新锦标赛中某个棋盘的状态，全部结束后显示结果"""
+        index = self.boards.index(board)
+        caption = self.board_captions[index]
+        if result == "hit":
+            caption.config(text=f"棋盘 {index + 1}：{board.lock_count}/{board.columns}")
+        elif result == "won":
+            caption.config(text=f"棋盘 {index + 1}：通关！", fg="#00FF00")
+        elif result == "life":
+            caption.config(text=f"棋盘 {index + 1}：剩余生命 {board.lives}", fg="#FFA500")
+        else:
+            caption.config(text=f"棋盘 {index + 1}：失败", fg="#FF0000")
+        
+        if board.state != "playing":
+            # 锦标赛中每个棋盘都是一局
+            self.record_game(board)
+            playing = [i for i, other in enumerate(self.boards) if other.state == "playing"]
+            if playing:
+                # 自动切换到下一个还在进行的棋盘
+                later = [i for i in playing if i > index]
+                self.select_board(later[0] if later else playing[0])
+            else:
+                won = sum(1 for other in self.boards if other.state == "won")
+                self.status_label.config(text=f"锦标赛结束：通关 {won}/{len(self.boards)}")
+                restart_button = tk.Button(self.game_frame, text="重新开始", font=("Arial", 14),
+                                           bg="#00FF00", fg="#000000",
+                                           command=lambda count=len(self.boards): self.start_tournament(count))
+                restart_button.pack(pady=5)
+    
+    def select_board(self, index):
+        """切换当前操作的棋盘"""
+        if index < len(self.boards):
+            self.focused_board = index
+            self.highlight_focused_board()
+    
+    def select_next_board(self, event=None):
+        if self.boards:
+            self.select_board((self.focused_board + 1) % len(self.boards))
+    
+    def highlight_focused_board(self):
+        for index, seat in enumerate(self.board_seats):
+            seat.config(bg="#FFFF00" if index == self.focused_board else "#000000")
+    
+    def select_previous_column(self, event=None):
+        # 选择上一列
+        board = self.current_board()
+        if board is not None:
+            board.select(-1)
+            self.scheduler.render([board])
+    
+    def select_next_column(self, event=None):
+        # 选择下一列
+        board = self.current_board()
+        if board is not None:
+            board.select(1)
+            self.scheduler.render([board])
+    
+    def record_game(self, board):
+        """把刚结束的一局（board）写入游戏历史"""
+        self.history.record_board(self.player_data.username, board, self.game_start_time, self.game_level,
+                                  self.game_lives, FEATURES.to_mask(self.active_features()),
+                                  self.game_bet, self.game_coins, self.game_end_time)
+    
+    def win_game(self):
+        self.status_label.config(text="恭喜通关！")
+        # 进入下一关，并让关卡包开始准备
+        self.current_level = min(self.current_level + 1, LEVEL_MAX)
+        self.level_pack.want(self.current_level)
+        
+        # 处理加倍下注奖励
+        if self.is_double_bet:
+            # 加倍下注成功，给予双倍奖励
+            self.change_coins(2, "double_bet_win")  # 获得2个哈夫币（双倍奖励）
+            self.is_double_bet = False
+            self.double_bet_amount = 0
+        
+        # 创建奖励界面
+        self.create_reward_screen()
+    
+    def create_reward_screen(self):
+        # 创建奖励界面窗口
+        reward_window = tk.Toplevel(self.root)
+        reward_window.title("奖励界面")
+        reward_window.geometry("400x300")
+        reward_window.configure(bg="#000000")
+        reward_window.resizable(False, False)
+        
+        # 禁止关闭主窗口
+        self.root.attributes("-disabled", True)
+        
+        # 奖励标题
+        reward_title = tk.Label(reward_window, text="🎉 恭喜通关！ 🎉", font=(
+            "Arial", 20, "bold"), fg="#FFD700", bg="#000000")
+        reward_title.pack(pady=30)
+        
+        # 获得哈夫币标签
+        coin_reward = tk.Label(reward_window, text="获得1个哈夫币！", font=(
+            "Arial", 16), fg="#FFD700", bg="#000000")
+        coin_reward.pack(pady=20)
+        
+        # 等待1秒后显示下注选项
+        reward_window.after(1000, lambda: self.show_bet_options(reward_window))
+    
+    def show_bet_options(self, reward_window):
+        # 清除当前奖励界面的内容
+        for widget in reward_window.winfo_children():
+            widget.destroy()
+        
+        # 新的标题
+        bet_title = tk.Label(reward_window, text="🎰 加倍机会！ 🎰", font=(
+            "Arial", 20, "bold"), fg="#FFD700", bg="#000000")
+        bet_title.pack(pady=30)
+        
+        # 下注说明
+        bet_desc = tk.Label(reward_window, text="是否加倍下注？", font=(
+            "Arial", 16), fg="#00FF00", bg="#000000")
+        bet_desc.pack(pady=20)
+        
+        # 按钮框架
+        button_frame = tk.Frame(reward_window, bg="#000000")
+        button_frame.pack(pady=20)
+        
+        # 加倍按钮
+        double_button = tk.Button(button_frame, text="加倍下注", font=(
+            "Arial", 14, "bold"), width=12, height=2, 
+            bg="#FF0000", fg="#FFFFFF", 
+            command=lambda: self.handle_bet(reward_window, True))
+        double_button.pack(side=tk.LEFT, padx=10)
+        
+        # 停止按钮
+        stop_button = tk.Button(button_frame, text="停止下注", font=(
+            "Arial", 14, "bold"), width=12, height=2, 
+            bg="#00FF00", fg="#000000", 
+            command=lambda: self.handle_bet(reward_window, False))
+        stop_button.pack(side=tk.RIGHT, padx=10)
+    
+    def handle_bet(self, reward_window, double_bet):
+        METRICS.inc("bets_total", (("choice", "double" if double_bet else "stop"),))
+        if double_bet:
+            # 加倍下注：立即扣除当前赢的奖金作为赌注
+            self.change_coins(1, "win_reward")  # 先给玩家当前的奖金
+            self.change_coins(-1, "double_bet_stake")  # 立即扣除作为赌注
+            self.is_double_bet = True
+            self.double_bet_amount = 1  # 当前这把的奖金作为赌注
+            result = "🎯 加倍下注成功！🎯\n已扣除1个哈夫币作为赌注。\n下一把赢了获得2倍奖金（2个哈夫币），输了失去赌注！"
+            result_fg = "#FFA500"
+        else:
+            # 停止下注，获得1个哈夫币
+            self.change_coins(1, "win_reward")
+            self.is_double_bet = False
+            result = "获得1个哈夫币！"
+            result_fg = "#FFD700"
+        # 通关的一局连同下注选择一起记入历史
+        self.record_game(self.board)
+        
+        # 更新奖励界面
+        for widget in reward_window.winfo_children():
+            widget.destroy()
+        
+        # 结果标题
+        result_label = tk.Label(reward_window, text=result, font=(
+            "Arial", 16), fg=result_fg, bg="#000000", justify="center")
+        result_label.pack(pady=50)
+        
+        # 最终哈夫币数量
+        final_coin_label = tk.Label(reward_window, text=f"最终哈夫币: {self.player_data.haf_coin}", 
+                                  font=("Arial", 14), fg="#FFD700", bg="#000000")
+        final_coin_label.pack(pady=10)
+        
+        # 3秒后自动关闭奖励界面并返回主页
+        def close_reward():
+            reward_window.destroy()
+            self.root.attributes("-disabled", False)  # 启用主窗口
+            self.show_main_menu()
+        
+        reward_window.after(3000, close_reward)
+    
+    def show_shop(self):
+        # 检查用户是否被禁用了商店
+        if self.player_data.username:
+            user_account = self.account_manager.get_account(self.player_data.username)
+            if user_account and user_account.shop_disabled:
+                # 显示商店禁用提示
+                self.clear_window("shop")
+                
+                disabled_frame = tk.Frame(self.root, bg="#000000")
+                disabled_frame.pack(fill=tk.BOTH, expand=True)
+                
+                # 返回按钮
+                back_button = tk.Button(disabled_frame, text="返回主菜单", font=("Arial", 12), 
+                                      bg="#FF0000", fg="#FFFFFF", command=self.show_main_menu)
+                back_button.pack(anchor=tk.NW, padx=10, pady=10)
+                
+                # 禁用提示
+                disabled_label = tk.Label(disabled_frame, text="商店功能已被禁用", font=("Arial", 24, "bold"), 
+                                        fg="#FF0000", bg="#000000")
+                disabled_label.pack(expand=True)
+                
+                return
+        
+        # 清除当前窗口
+        self.clear_window("shop")
+        
+        # 创建商店界面
+        shop_frame = tk.Frame(self.root, bg="#000000")
+        shop_frame.pack(fill=tk.BOTH, expand=True)
+        
+        # 返回按钮
+        back_button = tk.Button(shop_frame, text="返回主菜单", font=("Arial", 12), 
+                              bg="#FF0000", fg="#FFFFFF", command=self.show_main_menu)
+        back_button.pack(anchor=tk.NW, padx=10, pady=10)
+        
+        # 哈夫币显示
+        coin_label = tk.Label(shop_frame, text=f"哈夫币: {self.player_data.haf_coin}", 
+                            font=("Arial", 16), fg="#FFD700", bg="#000000")
+        coin_label.pack(pady=20)
+        self.watch_coins(coin_label)
+        
+        # 商店标题
+        shop_title = tk.Label(shop_frame, text="商店", font=("Arial", 20, "bold"), fg="#00FF00", bg="#000000")
+        shop_title.pack(pady=10)
+        
+        # 创建带滚动条的商品区域
+        canvas = tk.Canvas(shop_frame, bg="#000000", bd=0, highlightthickness=0)
+        scrollbar = tk.Scrollbar(shop_frame, orient="vertical", command=canvas.yview)
+        scrollable_frame = tk.Frame(canvas, bg="#000000")
+        
+        # 配置滚动区域
+        scrollable_frame.bind(
+            "<Configure>",
+            lambda e: canvas.configure(
+                scrollregion=canvas.bbox("all")
+            )
+        )
+        
+        canvas.create_window((0, 0), window=scrollable_frame, anchor="nw")
+        
+        # 商品列表来自商店目录
+        def render_item(i, item):
+            item_frame = tk.Frame(scrollable_frame, bg="#333333", bd=2, relief=tk.RAISED)
+            item_frame.grid(row=i, column=0, padx=20, pady=10, sticky="ew")
+            
+            # 设置商品框架的列权重
+            item_frame.grid_columnconfigure(0, weight=1)
+            item_frame.grid_columnconfigure(1, weight=0)
+            
+            # 商品名称
+            name_label = tk.Label(item_frame, text=item["name"], font=("Arial", 14, "bold"), 
+                                fg="#00FF00", bg="#333333")
+            name_label.grid(row=0, column=0, padx=10, pady=5, sticky="w")
+            
+            # 商品描述
+            desc_label = tk.Label(item_frame, text=item["description"], font=("Arial", 12), 
+                                fg="#FFFFFF", bg="#333333")
+            desc_label.grid(row=1, column=0, padx=10, pady=5, sticky="w")
+            
+            # 价格
+            price_label = tk.Label(item_frame, text=f"价格: {item['price']} 哈夫币", font=("Arial", 12), 
+                                 fg="#FFD700", bg="#333333")
+            price_label.grid(row=0, column=1, padx=10, pady=5, sticky="e")
+            
+            # 购买按钮
+            buy_button = tk.Button(item_frame, text="购买", font=("Arial", 12), 
+                                 bg="#00FF00", fg="#000000", 
+                                 command=lambda item=item: self.buy_item(item))
+            buy_button.grid(row=1, column=1, padx=10, pady=5, sticky="e")
+            
+            # 设置已购买的商品状态
+            if item["effect"] in self.player_data.unlocked_features:
+                buy_button.config(text="已购买", state=tk.DISABLED, bg="#666666")
+        
+        # 按需分批渲染，商品很多时商店也能立即打开
+        self.render_lazily(canvas, scrollbar, self.catalog.all_items(), render_item)
+        
+        # 设置可滚动区域的列权重
+        scrollable_frame.grid_columnconfigure(0, weight=1)
+        
+        # 放置滚动区域和滚动条
+        canvas.pack(side="left", fill="both", expand=True, padx=10, pady=10)
+        scrollbar.pack(side="right", fill="y", pady=10)
+        
+        # 允许使用鼠标滚轮滚动
+        def _on_mousewheel(event):
+            canvas.yview_scroll(int(-1*(event.delta/120)), "units")
+        
+        canvas.bind_all("<MouseWheel>", _on_mousewheel)
+        
+    def buy_item(self, item):
+        if self.player_data.haf_coin >= item["price"]:
+            if item["effect"] not in self.player_data.unlocked_features:
+                self.change_coins(-item["price"], "shop_purchase")
+                self.player_data.unlocked_features.append(item["effect"])
+                # 按功能注册表顺序保存，便于账户记录压缩为位掩码
+                self.player_data.unlocked_features = FEATURES.from_mask(
+                    FEATURES.to_mask(self.player_data.unlocked_features))
+                # 新购买的功能默认开启
+                self.player_data.enabled_features[item["effect"]] = True
+                # 保存账户数据（只写入改动过的字段），扣款和解锁落盘后再返回主菜单刷新
+                self.account_manager.save_player_data(self.player_data)
+                self.poll_future(self.account_manager.saved(), lambda _: self.show_main_menu())
+
+# 运行游戏
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="三角洲开锁模拟器")
+    parser.add_argument("--bench-login", type=int, metavar="N",
+                        help="并发验证N次密码，输出登录延迟和吞吐量")
+    parser.add_argument("--export", metavar="PATH",
+                        help="把账户导出为NDJSON文件（.gz/.bz2/.xz 扩展名自动压缩）")
+    parser.add_argument("--import", dest="import_path", metavar="PATH",
+                        help="从NDJSON文件批量导入账户，已有账户整条替换")
+    parser.add_argument("--banned", action="store_true", default=None, help="只处理已封禁的账户")
+    parser.add_argument("--not-banned", dest="banned", action="store_false", help="只处理未封禁的账户")
+    parser.add_argument("--min-coins", type=int, help="哈夫币下限")
+    parser.add_argument("--max-coins", type=int, help="哈夫币上限")
+    parser.add_argument("--feature", action="append", help="必须已解锁的功能，可重复指定")
+    parser.add_argument("--diagnostics", action="store_true",
+                        help="诊断模式：每次切换界面检查控件、定时器、绑定和内存是否泄漏")
+    parser.add_argument("--bench-env", type=int, metavar="N",
+                        help="在N个批量棋盘上评估示例策略（需要NumPy），比较停止和加倍下注的收益")
+    parser.add_argument("--level", type=int, default=1, help="--bench-env 和 --race-host 使用的关卡")
+    parser.add_argument("--serve", metavar="ADDRESS",
+                        help="无界面会话服务器：ADDRESS为本机TCP端口或Unix套接字路径")
+    parser.add_argument("--race-host", type=int, metavar="PORT",
+                        help="作为竞速主机在PORT上等待玩家，进行一场比赛后退出")
+    parser.add_argument("--players", type=int, default=2, help="竞速的玩家数（2-8）")
+    parser.add_argument("--stake", type=int, default=RACE_STAKE, help="竞速每人的赌注")
+    parser.add_argument("--race", metavar="HOST:PORT", help="主菜单中显示联机竞速，连接到该主机")
+    parser.add_argument("--find-users", metavar="PREFIX", help="按前缀列出用户名（走用户名索引）")
+    parser.add_argument("--history-report", metavar="FIELDS",
+                        help="按逗号分隔的字段（如 interval,level）分组统计游戏历史")
+    parser.add_argument("--since-days", type=float, help="只统计最近若干天的游戏")
+    parser.add_argument("--player", help="只统计某个玩家的游戏")
+    parser.add_argument("--frame-budget", type=float, default=FRAME_BUDGET * 1000, metavar="MS",
+                        help="每帧的目标耗时（毫秒），超出时自动降低画面效果")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="在 127.0.0.1:PORT 提供性能指标（/metrics 和 /metrics.json）")
+    args = parser.parse_args()
+    
+    if args.metrics_port is not None:
+        metrics_server = MetricsServer(args.metrics_port)
+    
+    if args.serve:
+        server = SessionServer()
+        try:
+            asyncio.run(server.serve(args.serve))
+        except KeyboardInterrupt:
+            pass
+        server.history.close()
+        server.manager.close()
+    elif args.race_host:
+        host = RaceHost(args.players, args.stake, args.level)
+        result = asyncio.run(host.serve(args.race_host))
+        host.history.close()
+        host.manager.close()
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+    elif args.find_users is not None:
+        manager = AccountManager()
+        print("\n".join(manager.find_users(args.find_users)))
+        manager.close()
+    elif args.history_report is not None:
+        history = GameHistory()
+        where = {}
+        if args.since_days is not None:
+            where["start"] = (time.time() - args.since_days * 86400, None)
+        if args.player is not None:
+            where["player"] = args.player
+        group_by = tuple(field for field in args.history_report.split(",") if field)
+        start = time.perf_counter()
+        groups = history.aggregate(group_by, ("misses", "won", "coins", "lives_used"), where)
+        report = [dict(zip(group_by, key), games=result["games"],
+                       misses_per_game=round(result["misses"] / result["games"], 4),
+                       win_rate=round(result["won"] / result["games"], 4),
+                       coins_per_game=round(result["coins"] / result["games"], 4),
+                       lives_used=result["lives_used"])
+                  for key, result in sorted(groups.items())]
+        history.close()
+        print(json.dumps({"groups": report, "seconds": round(time.perf_counter() - start, 3)},
+                         indent=2, ensure_ascii=False))
+    elif args.bench_env:
+        env = LockEnv(args.level, args.feature or ())
+        print(json.dumps({
+            "aimed_stop": env.evaluate(env.aimed_policy, args.bench_env, 1000, seed=0),
+            "aimed_double": env.evaluate(env.aimed_policy, args.bench_env, 1000, seed=0, double_bet=True),
+            "random": env.evaluate(env.random_policy, args.bench_env, 1000, seed=0),
+        }, indent=2))
+    elif args.bench_login:
+        print(json.dumps(PasswordHasher().benchmark(args.bench_login), indent=2))
+    elif args.export or args.import_path:
+        manager = AccountManager()
+        accept = account_filter(args.banned, args.min_coins, args.max_coins, args.feature)
+        start = time.perf_counter()
+        if args.import_path:
+            result = manager.import_accounts(args.import_path, accept)
+        else:
+            result = {"exported": manager.export_accounts(args.export, accept)}
+        result["seconds"] = round(time.perf_counter() - start, 3)
+        manager.close()
+        print(json.dumps(result, indent=2))
+    else:
+        root = tk.Tk()
+        game = DeltaLockGame(root, diagnostics=args.diagnostics, race_address=args.race,
+                             frame_budget=args.frame_budget / 1000)
+        root.mainloop()
+        game.history.close()
+        if game.leak_detector is not None:
+            print(json.dumps(game.leak_detector.stats(), indent=2, ensure_ascii=False))
+            print(json.dumps(game.scheduler.budget.stats(), indent=2, ensure_ascii=False))
\ No newline at end of file
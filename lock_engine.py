@@ -0,0 +1,4267 @@
+import random
+import time
+import json
+import os
+import sys
+import heapq
+import itertools
+import math
+import hashlib
+import hmac
+import threading
+import zlib
+import bisect
+import bz2
+import gzip
+import lzma
+import mmap
+import struct
+import uuid
+import shutil
+import socket
+import asyncio
+import http.server
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+# 游戏设置
+COLUMNS = 5
+ROWS = 7
+SYMBOL_SET = ["A", "B", "C", "D", "E", "F", "G", "H", "I", "J", "K", "L", "M", "N", "O", "P", "Q", "R", "S", "T", "U", "V", "W", "X", "Y", "Z", "0", "1", "2", "3", "4", "5", "6", "7", "8", "9","!","@","#","$","%","^","&","*"]
+
+# 关卡：最高关卡、每关预先生成的布局数量、提前准备的关卡数
+LEVEL_MAX = 20
+LEVEL_PACK_SIZE = 3
+LEVEL_PREFETCH = 2
+
+# 输入：每个棋盘保留的已显示帧数
+BOARD_FRAME_HISTORY = 64
+
+# 性能指标：每个线程保留的延迟样本数、指标服务监听的地址（只允许本机访问）
+METRICS_SAMPLES = 2048
+METRICS_HOST = "127.0.0.1"
+
+# 会话服务器：监听地址、计时轮的刻度（秒）和槽数、哈夫币批量写入间隔（秒）、
+# 客户端发送缓冲超过多少字节时跳过帧差异
+SERVER_HOST = "127.0.0.1"
+SERVER_RESOLUTION = 0.01
+SERVER_WHEEL_SLOTS = 512
+SERVER_COIN_FLUSH_INTERVAL = 0.5
+SERVER_WRITE_LIMIT = 64 * 1024
+# 等待接受的连接数（大量客户端同时连接时）
+SERVER_BACKLOG = 1024
+# 竞速模式：协议版本、主机监听的地址（空为所有网卡）、最多玩家数、默认赌注、
+# 锁定输入最多可以比主机最近发出的帧早几帧（只用于抵消网络延迟）、最长帧数和客户端连接超时（秒）
+RACE_PROTOCOL = 1
+RACE_BIND = ""
+RACE_MAX_PLAYERS = 8
+RACE_STAKE = 5
+RACE_INPUT_WINDOW = 2
+RACE_MAX_TICKS = 600
+RACE_CONNECT_TIMEOUT = 5
+# 客户端按键：左、右、锁定（空格）、加倍下注、停止下注、重新开始
+KEY_LEFT = ord("L")
+KEY_RIGHT = ord("R")
+KEY_LOCK = ord(" ")
+KEY_DOUBLE = ord("D")
+KEY_STOP = ord("S")
+KEY_NEXT = ord("N")
+
+# 商店目录文件、修改检查间隔（秒）和价格段宽度
+CATALOG_FILE = "shop_catalog.json"
+CATALOG_CHECK_INTERVAL = 1.0
+CATALOG_PRICE_BAND = 5
+
+# 账户数据文件路径
+ACCOUNTS_FILE = "accounts.json"
+# 账户修改日志：每行一个合并补丁，累计到一定条数后合并回账户文件
+ACCOUNTS_JOURNAL = ACCOUNTS_FILE + ".journal"
+JOURNAL_COMPACT_LIMIT = 1000
+# 批量导入：每批的账户数量（每批一次fsync）
+IMPORT_BATCH_SIZE = 10000
+# 账户记录的当前版本，旧版本的记录在第一次读取时迁移
+ACCOUNT_SCHEMA_VERSION = 2
+# 账户文件最后一行的校验信息，用于发现写了一半的文件
+SNAPSHOT_META_KEY = "__checksum__"
+# 组提交窗口（秒）：窗口内的保存请求共用一次fsync
+GROUP_COMMIT_WINDOW = 0.005
+# 账户缓存：内存预算（字节）和过期时间（秒）
+CACHE_MAX_BYTES = 4 * 1024 * 1024
+CACHE_TTL = 600
+# 哈夫币流水和余额快照
+LEDGER_FILE = "coin_ledger.log"
+LEDGER_SNAPSHOT_FILE = "coin_ledger.snapshot"
+LEDGER_SNAPSHOT_INTERVAL = 1000
+# 热字段表（内存映射）和用户名到槽位的对应文件；表文件初始容量（槽位数）
+TABLE_FILE = "account_table.bin"
+TABLE_SLOTS_FILE = "account_table.slots"
+TABLE_INITIAL_SLOTS = 1024
+# 热字段表中保存的账户字段
+TABLE_FIELDS = frozenset(("haf_coin", "banned", "shop_disabled", "unlocked_features", "enabled_features"))
+# 管理员审计日志：分段文件前缀、单段大小上限、保留段数、时间索引的桶宽（秒）
+AUDIT_PREFIX = "admin_audit"
+AUDIT_SEGMENT_BYTES = 1024 * 1024
+AUDIT_KEEP_SEGMENTS = 8
+AUDIT_BUCKET_SECONDS = 3600
+# 用户名索引文件（同名加 .bloom/.log 为布隆过滤器和新用户名日志）、稀疏索引的间隔、
+# 新用户名攒够多少个归并进索引文件、重建时每段排序的用户名数、布隆过滤器的误判率
+USERNAME_INDEX_FILE = "usernames.idx"
+USERNAME_INDEX_STRIDE = 64
+USERNAME_MERGE_LIMIT = 1000
+USERNAME_SORT_RUN = 100000
+USERNAME_BLOOM_ERROR_RATE = 0.01
+# 游戏历史（列式存储）目录、每块的行数、攒够多少局写入一次
+HISTORY_DIR = "game_history"
+HISTORY_CHUNK_ROWS = 65536
+HISTORY_FLUSH_ROWS = 64
+# 游戏历史的字段和数组类型码：玩家编号、开始时间、用时（秒）、关卡、滚动间隔（毫秒）、
+# 开启的功能（位掩码）、错误次数、用掉的额外生命、是否通关、是否在加倍下注中、哈夫币变化
+HISTORY_COLUMNS = (("player", "I"), ("start", "d"), ("duration", "d"), ("level", "B"), ("interval", "I"),
+                   ("features", "I"), ("misses", "I"), ("lives_used", "I"), ("won", "b"), ("bet", "b"),
+                   ("coins", "i"))
+# 密码哈希：线程池大小和各账户类型的代价参数（scrypt的n/r/p，PBKDF2的迭代次数）
+PASSWORD_WORKERS = min(4, os.cpu_count() or 1)
+PASSWORD_COSTS = {
+    "user": {"n": 2 ** 14, "r": 8, "p": 1, "iterations": 200000},
+    "admin": {"n": 2 ** 15, "r": 8, "p": 1, "iterations": 400000},
+}
+
+# 功能注册表：功能名 <-> 位编号，用于把功能列表压缩成整数位掩码
+class FeatureRegistry:
+    def __init__(self, names=()):
+        self.names = []
+        self.bits = {}
+        for name in names:
+            self.register(name)
+    
+    def register(self, name):
+        """注册功能名并返回其位编号（未知功能自动追加，保证无损）"""
+        bit = self.bits.get(name)
+        if bit is None:
+            name = sys.intern(name)
+            bit = len(self.names)
+            self.names.append(name)
+            self.bits[name] = bit
+        return bit
+    
+    def to_mask(self, features):
+        """功能名列表 -> 位掩码"""
+        mask = 0
+        for name in features:
+            mask |= 1 << self.register(name)
+        return mask
+    
+    def from_mask(self, mask):
+        """位掩码 -> 按注册顺序排列的功能名列表"""
+        names = []
+        bit = 0
+        while mask:
+            if mask & 1:
+                names.append(self.names[bit])
+            mask >>= 1
+            bit += 1
+        return names
+
+FEATURES = FeatureRegistry(["scroll_speed", "auto_aim", "error_hint", "extra_life"])
+
+# 账户JSON字段（按accounts.json中的书写顺序）
+ACCOUNT_FIELDS = ("password", "account_type", "banned", "haf_coin",
+                  "unlocked_features", "enabled_features", "shop_disabled", "schema_version")
+_FIELD_BITS = {key: 1 << i for i, key in enumerate(ACCOUNT_FIELDS)}
+# 没有schema_version字段的旧记录视为第1版
+_EMPTY_FIELDS = {"password": "", "account_type": "user", "banned": False, "haf_coin": 0,
+                 "unlocked_features": [], "enabled_features": {}, "shop_disabled": False,
+                 "schema_version": 1}
+
+# 布尔标志位
+FLAG_BANNED = 1
+FLAG_SHOP_DISABLED = 2
+
+# 紧凑账户记录：常驻内存的账户使用 __slots__ 和位掩码代替字典
+class AccountRecord:
+    __slots__ = ("username", "password", "account_type", "haf_coin", "schema_version", "flags",
+                 "unlocked_mask", "enabled_known", "enabled_mask", "present", "extra")
+    
+    def __init__(self, username):
+        self.username = sys.intern(username)
+        self.password = ""
+        self.account_type = "user"
+        self.haf_coin = 0
+        self.schema_version = 1
+        self.flags = 0
+        self.unlocked_mask = 0
+        self.enabled_known = 0  # enabled_features 中出现过的功能
+        self.enabled_mask = 0   # 其中值为 True 的功能
+        self.present = 0        # 原JSON中存在的字段
+        self.extra = None       # 无法压缩表示的字段原样保存
+    
+    @classmethod
+    def from_json(cls, username, data):
+        """从accounts.json中的账户字典创建记录"""
+        record = cls(username)
+        record.update(data)
+        return record
+    
+    def to_json(self):
+        """转换回accounts.json中的账户字典"""
+        data = {}
+        for key in ACCOUNT_FIELDS:
+            if self.present & _FIELD_BITS[key]:
+                data[key] = self.get(key)
+        if self.extra:
+            for key, value in self.extra.items():
+                if key not in _FIELD_BITS:
+                    data[key] = value
+        return data
+    
+    def get(self, key, default=None):
+        """按JSON字段名读取值（兼容原来的字典访问方式）"""
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        bit = _FIELD_BITS.get(key)
+        if bit is None or not self.present & bit:
+            return default
+        if key == "unlocked_features":
+            return self.unlocked_features
+        if key == "enabled_features":
+            return self.enabled_features
+        return getattr(self, key)
+    
+    def update(self, data):
+        """按JSON字段合并更新记录"""
+        for key, value in data.items():
+            self._set_field(key, value)
+    
+    def apply_patch(self, patch):
+        """应用JSON合并补丁：None删除字段，字典字段按键合并"""
+        for key, value in patch.items():
+            if value is None:
+                self._del_field(key)
+            elif isinstance(value, dict) and isinstance(self.get(key), dict):
+                merged = self.get(key)
+                for name, item in value.items():
+                    if item is None:
+                        merged.pop(name, None)
+                    else:
+                        merged[name] = item
+                self._set_field(key, merged)
+            else:
+                self._set_field(key, value)
+    
+    def _del_field(self, key):
+        if self.extra:
+            self.extra.pop(key, None)
+        bit = _FIELD_BITS.get(key)
+        if bit is not None and self.present & bit:
+            self._encode(key, _EMPTY_FIELDS[key])
+            self.present &= ~bit
+    
+    def _set_field(self, key, value):
+        if self.extra:
+            self.extra.pop(key, None)
+        bit = _FIELD_BITS.get(key)
+        if bit is None or not self._encode(key, value):
+            # 未知字段或非常规取值：原样保存，保证无损
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+        if bit is not None:
+            self.present |= bit
+    
+    def _encode(self, key, value):
+        """尝试把字段编码为紧凑表示，无法表示时返回False"""
+        if key == "password":
+            if not isinstance(value, str):
+                return False
+            self.password = value
+        elif key == "account_type":
+            if not isinstance(value, str):
+                return False
+            self.account_type = sys.intern(value)
+        elif key in ("haf_coin", "schema_version"):
+            if type(value) is not int:
+                return False
+            setattr(self, key, value)
+        elif key in ("banned", "shop_disabled"):
+            if not isinstance(value, bool):
+                return False
+            flag = FLAG_BANNED if key == "banned" else FLAG_SHOP_DISABLED
+            self.flags = self.flags | flag if value else self.flags & ~flag
+        elif key == "unlocked_features":
+            if not isinstance(value, list) or not all(isinstance(f, str) for f in value):
+                return False
+            mask = FEATURES.to_mask(value)
+            # 只有按注册顺序且无重复的列表才能无损地还原
+            if FEATURES.from_mask(mask) != value:
+                return False
+            self.unlocked_mask = mask
+        elif key == "enabled_features":
+            if not isinstance(value, dict) or not all(
+                    isinstance(f, str) and isinstance(v, bool) for f, v in value.items()):
+                return False
+            self.enabled_known = FEATURES.to_mask(value)
+            self.enabled_mask = FEATURES.to_mask(f for f, v in value.items() if v)
+        return True
+    
+    @property
+    def banned(self):
+        if self.extra and "banned" in self.extra:
+            return bool(self.extra["banned"])
+        return bool(self.flags & FLAG_BANNED)
+    
+    @banned.setter
+    def banned(self, value):
+        self._set_field("banned", value)
+    
+    @property
+    def shop_disabled(self):
+        if self.extra and "shop_disabled" in self.extra:
+            return bool(self.extra["shop_disabled"])
+        return bool(self.flags & FLAG_SHOP_DISABLED)
+    
+    @shop_disabled.setter
+    def shop_disabled(self, value):
+        self._set_field("shop_disabled", value)
+    
+    @property
+    def unlocked_features(self):
+        if self.extra and "unlocked_features" in self.extra:
+            return list(self.extra["unlocked_features"])
+        return FEATURES.from_mask(self.unlocked_mask)
+    
+    @property
+    def enabled_features(self):
+        if self.extra and "enabled_features" in self.extra:
+            value = self.extra["enabled_features"]
+            return dict(value) if isinstance(value, dict) else value
+        return {name: bool(self.enabled_mask & (1 << FEATURES.bits[name]))
+                for name in FEATURES.from_mask(self.enabled_known)}
+
+# 账户文件损坏且无法从备份恢复时抛出，避免用空数据覆盖玩家账户
+class AccountFileError(Exception):
+    pass
+
+def encode_line(obj):
+    """编码一行日志：CRC32校验码 + 空格 + JSON"""
+    data = json.dumps(obj, separators=(",", ":")).encode("ascii")
+    return b"%08x %s\n" % (zlib.crc32(data), data)
+
+def decode_line(line):
+    """解码一行日志，校验失败（写了一半或损坏）时返回None"""
+    line = line.rstrip(b"\r\n")
+    try:
+        if line.startswith(b"{"):
+            # 旧格式：没有校验码
+            return json.loads(line)
+        checksum, data = line.split(b" ", 1)
+        if int(checksum, 16) != zlib.crc32(data):
+            return None
+        return json.loads(data)
+    except ValueError:
+        return None
+
+def fsync_dir(path):
+    """同步目录项，保证重命名本身落盘（Windows不支持，忽略）"""
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def write_file_atomic(path, data):
+    """写临时文件并fsync，再重命名替换，崩溃时要么是旧文件要么是新文件"""
+    temp_path = path + ".tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    fsync_dir(path)
+
+# 性能指标：计数器和延迟样本按线程分片，记录时不加锁，只有读取时才汇总各线程的分片
+class Metrics:
+    def __init__(self, samples=METRICS_SAMPLES):
+        self.samples = samples
+        self.started = time.monotonic()
+        self.gauges = {}     # 名称 -> 读取函数（在指标线程中调用，不能访问Tk）
+        self.help = {}
+        self._shards = []    # 每个线程一个 (计数器字典, 样本字典, 累计字典)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+    
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = ({}, {}, {})
+            with self._lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+        return shard
+    
+    def inc(self, name, labels=(), value=1):
+        """计数器加value；labels为 ((标签名, 值), ...)"""
+        counters = self._shard()[0]
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+    
+    def observe(self, name, seconds):
+        """记录一个延迟样本（每个线程只保留最近的samples个用于分位数，次数和总和一直累计）"""
+        _, samples, totals = self._shard()
+        recent = samples.get(name)
+        if recent is None:
+            recent = samples[name] = deque(maxlen=self.samples)
+        recent.append(seconds)
+        count, total = totals.get(name, (0, 0.0))
+        # 整个元组一次替换，读取线程不会看到只更新了一半的值
+        totals[name] = (count + 1, total + seconds)
+    
+    def gauge(self, name, read, help=""):
+        """注册一个在读取指标时计算的值"""
+        self.gauges[name] = read
+        if help:
+            self.help[name] = help
+    
+    def collect(self):
+        """汇总所有线程的分片：计数器、启动以来的平均每秒速率、延迟分位数和当前值。
+        
+        不保存上一次读取的状态，多个抓取方同时读取互不影响；
+        区间速率由抓取方根据单调递增的计数器自己计算。
+        """
+        with self._lock:
+            shards = list(self._shards)
+        counters = {}
+        samples = {}
+        totals = {}
+        for shard_counters, shard_samples, shard_totals in shards:
+            # dict()/list() 在持有GIL时一次复制完成，不会与记录线程冲突
+            for key, value in dict(shard_counters).items():
+                counters[key] = counters.get(key, 0) + value
+            for name, recent in dict(shard_samples).items():
+                samples.setdefault(name, []).extend(list(recent))
+            for name, (count, total) in dict(shard_totals).items():
+                before = totals.get(name, (0, 0.0))
+                totals[name] = (before[0] + count, before[1] + total)
+        now = time.monotonic()
+        uptime = max(now - self.started, 1e-9)
+        rates = {key: value / uptime for key, value in counters.items()}
+        summaries = {}
+        for name, values in samples.items():
+            values.sort()
+            summaries[name] = {q: values[min(len(values) - 1, int(len(values) * q))] for q in (0.5, 0.95, 0.99)}
+            # 分位数只看最近的样本；次数和总和从启动开始累计，单调递增
+            summaries[name]["count"], summaries[name]["sum"] = totals.get(name, (len(values), sum(values)))
+        gauges = {}
+        for name, read in list(self.gauges.items()):
+            try:
+                gauges[name] = read()
+            except Exception:
+                # 读取失败的值本次不报告
+                continue
+        # 锁定命中率和加倍下注选择率
+        ratios = {"lock_hit_ratio": self._ratio(counters, "locks_total", "result", "hit"),
+                  "double_bet_ratio": self._ratio(counters, "bets_total", "choice", "double")}
+        return {"uptime_seconds": now - self.started, "counters": counters, "rates": rates,
+                "summaries": summaries, "gauges": gauges, "ratios": ratios}
+    
+    @staticmethod
+    def _ratio(counters, name, label, value):
+        total = part = 0
+        for (key, labels), count in counters.items():
+            if key == name:
+                total += count
+                if (label, value) in labels:
+                    part += count
+        return part / total if total else 0.0
+    
+    def to_json(self):
+        data = self.collect()
+        def flat(key):
+            name, labels = key
+            return name + "".join(f"{{{label}={value}}}" for label, value in labels)
+        return {
+            "uptime_seconds": round(data["uptime_seconds"], 3),
+            "counters": {flat(key): value for key, value in data["counters"].items()},
+            "per_second": {flat(key): round(value, 3) for key, value in data["rates"].items()},
+            "latency_ms": {name.replace("_seconds", ""): {
+                               **{"p" + str(int(q * 100)): round(summary[q] * 1000, 3) for q in (0.5, 0.95, 0.99)},
+                               "count": summary["count"], "sum": round(summary["sum"] * 1000, 3)}
+                           for name, summary in data["summaries"].items()},
+            "gauges": data["gauges"],
+            "ratios": {name: round(value, 4) for name, value in data["ratios"].items()},
+        }
+    
+    def to_prometheus(self):
+        """Prometheus文本格式"""
+        data = self.collect()
+        lines = []
+        def labels_text(labels):
+            if not labels:
+                return ""
+            return "{" + ",".join(f'{label}="{value}"' for label, value in labels) + "}"
+        typed = set()
+        for (name, labels), value in sorted(data["counters"].items()):
+            metric = "deltalock_" + name
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{labels_text(labels)} {value}")
+        for name, summary in sorted(data["summaries"].items()):
+            metric = "deltalock_" + name
+            lines.append(f"# TYPE {metric} summary")
+            for q in (0.5, 0.95, 0.99):
+                lines.append(f'{metric}{{quantile="{q}"}} {summary[q]:.6f}')
+            lines.append(f"{metric}_sum {summary['sum']:.6f}")
+            lines.append(f"{metric}_count {summary['count']}")
+        for name, value in sorted(data["gauges"].items()):
+            metric = "deltalock_" + name
+            if name in self.help:
+                lines.append(f"# HELP {metric} {self.help[name]}")
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value}")
+        for name, value in sorted(data["ratios"].items()):
+            lines.append(f"# TYPE deltalock_{name} gauge")
+            lines.append(f"deltalock_{name} {value:.4f}")
+        lines.append(f"deltalock_uptime_seconds {data['uptime_seconds']:.3f}")
+        return "\n".join(lines) + "\n"
+
+# 全局指标（与功能注册表一样在模块级共享）
+METRICS = Metrics()
+
+# 指标服务：只监听本机，在后台线程中提供 /metrics（Prometheus）和 /metrics.json
+class MetricsServer:
+    def __init__(self, port, metrics=METRICS, host=METRICS_HOST):
+        self.metrics = metrics
+        server = self
+        
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body = server.metrics.to_prometheus().encode("utf-8")
+                    content_type = "text/plain; version=0.0.4; charset=utf-8"
+                elif self.path == "/metrics.json":
+                    body = json.dumps(server.metrics.to_json(), ensure_ascii=False).encode("utf-8")
+                    content_type = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                # 不在控制台输出每次抓取
+                pass
+        
+        self.httpd = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.port = self.httpd.server_address[1]
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="metrics", daemon=True)
+        self._thread.start()
+    
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+# 组提交：短时间内到达的多个保存请求合并成一次fsync
+class GroupCommitter:
+    def __init__(self, window=GROUP_COMMIT_WINDOW):
+        self.window = window
+        self.syncs = 0
+        self.requests = 0
+        self._files = {}
+        self._requested = 0
+        self._synced = 0
+        self._waiters = []  # (票号, Future)
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+        self._thread.start()
+    
+    def request(self, f, wait=True):
+        """登记需要fsync的文件并返回票号；wait为True时等到数据真正落盘"""
+        with self._condition:
+            self._files[id(f)] = f
+            self._requested += 1
+            self.requests += 1
+            ticket = self._requested
+            self._condition.notify_all()
+        if wait:
+            self.wait(ticket)
+        return ticket
+    
+    def wait(self, ticket):
+        """等待票号之前的请求全部落盘"""
+        with self._condition:
+            while self._synced < ticket:
+                self._condition.wait()
+    
+    def future(self, ticket=None):
+        """返回票号之前的请求（默认为目前为止的所有请求）全部落盘时完成的Future，不阻塞调用线程"""
+        with self._condition:
+            if ticket is None:
+                ticket = self._requested
+            if self._synced >= ticket:
+                return _done_future(ticket)
+            future = Future()
+            self._waiters.append((ticket, future))
+            return future
+    
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._synced == self._requested:
+                    self._condition.wait()
+            # 等待一个窗口，让同一时间段的请求合并
+            time.sleep(self.window)
+            with self._condition:
+                files = list(self._files.values())
+                self._files.clear()
+                target = self._requested
+            for f in files:
+                try:
+                    os.fsync(f.fileno())
+                except (OSError, ValueError):
+                    # 文件已关闭（关闭前已经同步过）
+                    pass
+            with self._condition:
+                self._synced = target
+                self.syncs += 1
+                self._condition.notify_all()
+                done = [future for ticket, future in self._waiters if ticket <= target]
+                self._waiters = [(ticket, future) for ticket, future in self._waiters if ticket > target]
+            for future in done:
+                future.set_result(target)
+
+def merge_patch(target, patch, keep_nulls=False):
+    """把合并补丁应用到字典上；keep_nulls为True时保留None（用于合并两个补丁）"""
+    for key, value in patch.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            target[key] = merge_patch(dict(target[key]), value, keep_nulls)
+        elif value is None and not keep_nulls:
+            target.pop(key, None)
+        elif isinstance(value, dict):
+            target[key] = merge_patch({}, value, keep_nulls)
+        else:
+            target[key] = value
+    return target
+
+def make_patch(old, new):
+    """生成把old变成new的合并补丁"""
+    patch = {}
+    for key, value in new.items():
+        if isinstance(value, dict) and isinstance(old.get(key), dict):
+            sub = make_patch(old[key], value)
+            if sub:
+                patch[key] = sub
+        elif key not in old or old[key] != value:
+            patch[key] = value
+    for key in old:
+        if key not in new:
+            patch[key] = None
+    return patch
+
+# 账户迁移步骤：版本号 -> 把该版本的账户字典升级到下一版本的函数
+ACCOUNT_MIGRATIONS = {}
+
+def account_migration(version):
+    """注册从version升级到version+1的迁移步骤"""
+    def register(step):
+        ACCOUNT_MIGRATIONS[version] = step
+        return step
+    return register
+
+@account_migration(1)
+def _migrate_v1(data):
+    # 第1版：字段可能缺失，enabled_features可能不是字典；补齐字段，已解锁功能默认开启
+    for key in ("banned", "haf_coin", "unlocked_features", "shop_disabled"):
+        data.setdefault(key, _copy_field(_EMPTY_FIELDS[key]))
+    enabled = data.get("enabled_features")
+    if not isinstance(enabled, dict):
+        enabled = {}
+    for feature in data["unlocked_features"]:
+        enabled.setdefault(feature, True)
+    data["enabled_features"] = enabled
+    return data
+
+def migrate_account(data, copy=True):
+    """把账户字典逐步迁移到当前版本并返回；copy为False时直接修改参数"""
+    version = data.get("schema_version", 1)
+    if version >= ACCOUNT_SCHEMA_VERSION:
+        return data
+    if copy:
+        data = json.loads(json.dumps(data))
+    while version < ACCOUNT_SCHEMA_VERSION:
+        data = ACCOUNT_MIGRATIONS[version](data)
+        version += 1
+        data["schema_version"] = version
+    return data
+
+# 磁盘账户存储：账户文件每行一个账户（仍是合法JSON），内存中只保留每个账户的偏移，
+# 尚未合并进账户文件的修改记录在修改日志中
+class AccountStore:
+    def __init__(self, path=ACCOUNTS_FILE, journal_path=ACCOUNTS_JOURNAL, committer=None):
+        self.path = path
+        self.journal_path = journal_path
+        self.compacting_path = journal_path + ".compacting"  # 正在合并进账户文件的旧日志
+        self.backup_path = path + ".bak"
+        self.committer = committer or GroupCommitter()
+        self.offsets = {}   # 用户名 -> (值偏移, 值长度)
+        self.pending = {}   # 用户名 -> 未合并的补丁（新账户为完整记录）
+        self.journal_entries = 0
+        self.disk_reads = 0
+        self._file = None
+        self._journal = None
+        self._decoder = json.JSONDecoder()
+        self._lock = threading.RLock()
+        # 快照：写入时复制。pending被快照引用后，下一次修改先复制一份；
+        # 有快照打开时推迟替换账户文件，账户文件不会在读取途中被替换
+        self.version = 0
+        self._pending_shared = False
+        self._readers = 0
+        self._no_readers = threading.Condition(self._lock)
+        # 合并：在后台线程中重写账户文件，同一时间只有一个合并（或批量导入）
+        self._compact_lock = threading.Lock()
+        self._compactor = None
+        self._frozen = None   # 合并开始时冻结的待合并补丁
+        self._newer = None    # 合并开始之后的补丁，合并完成后只保留这些
+    
+    def open(self, default_accounts):
+        """打开账户文件；旧格式文件会一次性转换，损坏的文件从备份恢复"""
+        journals = [self.compacting_path, self.journal_path]
+        if not os.path.exists(self.path) and not os.path.exists(self.backup_path):
+            self.write_snapshot(iter(default_accounts.items()))
+        elif not os.path.exists(self.path) or not self._scan():
+            data = self._load_legacy(self.path)
+            if data is None:
+                # 文件写了一半或校验失败：移到一边，从上一次的快照和两份修改日志恢复
+                if os.path.exists(self.path):
+                    os.replace(self.path, self.path + ".corrupt")
+                data = self._load_legacy(self.backup_path)
+                if data is None:
+                    raise AccountFileError("账户文件已损坏且没有可用的备份：" + self.path)
+                journals = [self.journal_path + ".bak", self.compacting_path, self.journal_path]
+            self.write_snapshot(iter(data.items()), backup=False)
+        for path in journals:
+            self._replay_journal(path)
+        if os.path.exists(self.compacting_path):
+            # 上次合并没有完成就退出了：补丁已经重放，把旧日志接回当前日志
+            self._rejoin_journal()
+        self._journal = open(self.journal_path, 'ab')
+    
+    def close(self):
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._journal is not None:
+            self.committer.request(self._journal)
+            self._journal.close()
+            self._journal = None
+    
+    def _scan(self, path=None):
+        """建立用户名到偏移的索引并核对校验码，不解析账户内容；格式不符或损坏时返回False"""
+        offsets = {}
+        checksum = 0
+        with open(path or self.path, 'rb') as f:
+            first = f.readline()
+            if first.strip() != b"{":
+                return False
+            checksum = zlib.crc32(first, checksum)
+            pos = f.tell()
+            for raw in f:
+                line = raw.rstrip(b"\r\n")
+                try:
+                    text = line.decode("ascii")
+                    username, end = self._decoder.raw_decode(text)
+                except ValueError:
+                    return False
+                value = line[end + 2:]
+                if value.endswith(b","):
+                    value = value[:-1]
+                if line[end:end + 2] != b": " or not value.endswith(b"}"):
+                    return False
+                if username == SNAPSHOT_META_KEY:
+                    # 最后一行是校验信息，写了一半的文件没有这一行
+                    meta = json.loads(value)
+                    if meta["crc32"] != checksum or meta["count"] != len(offsets):
+                        return False
+                    break
+                checksum = zlib.crc32(raw, checksum)
+                offsets[sys.intern(username)] = (pos + end + 2, len(value))
+                pos += len(raw)
+            else:
+                return False
+        if path is None:
+            self.offsets = offsets
+            if self._file is not None:
+                self._file.close()
+            self._file = open(self.path, 'rb')
+        return True
+    
+    def _load_legacy(self, path):
+        """完整解析一个账户文件，失败时返回None"""
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except ValueError:
+            return None
+        meta = data.pop(SNAPSHOT_META_KEY, None)
+        if meta is not None and not self._scan(path):
+            return None
+        return data
+    
+    def write_snapshot(self, items, backup=True):
+        """把(用户名, 账户字典)流式写成新的账户文件并fsync，然后原子地替换旧文件"""
+        self._install(*self._write_temp(items), backup)
+    
+    def _write_temp(self, items):
+        """写出新账户文件的临时文件并fsync，返回(临时文件路径, 偏移索引)"""
+        temp_path = self.path + ".tmp"
+        offsets = {}
+        checksum = 0
+        with open(temp_path, 'wb') as f:
+            f.write(b"{\n")
+            checksum = zlib.crc32(b"{\n", checksum)
+            for username, account in items:
+                key = json.dumps(username).encode("ascii") + b": "
+                # 未改动的账户直接复制原始字节，不必解析再编码
+                value = account if isinstance(account, bytes) else json.dumps(account).encode("ascii")
+                offsets[sys.intern(username)] = (f.tell() + len(key), len(value))
+                line = key + value + b",\n"
+                f.write(line)
+                checksum = zlib.crc32(line, checksum)
+            meta = json.dumps({"count": len(offsets), "crc32": checksum}).encode("ascii")
+            f.write(json.dumps(SNAPSHOT_META_KEY).encode("ascii") + b": " + meta + b"\n}\n")
+            f.flush()
+            os.fsync(f.fileno())
+        return temp_path, offsets
+    
+    def _install(self, temp_path, offsets, backup=True):
+        """用写好的临时文件原子地替换账户文件"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        # 上一份快照保留为备份，新快照损坏时可以恢复
+        if backup and os.path.exists(self.path):
+            os.replace(self.path, self.backup_path)
+        os.replace(temp_path, self.path)
+        fsync_dir(self.path)
+        self.offsets = offsets
+        self._file = open(self.path, 'rb')
+    
+    def _replay_journal(self, path):
+        """重放修改日志中尚未合并的补丁，截掉末尾写了一半的行"""
+        if not os.path.exists(path):
+            return
+        good = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                entry = decode_line(line)
+                if entry is None:
+                    break
+                self._add_pending(entry["user"], entry["patch"])
+                good += len(line)
+        if good < os.path.getsize(path):
+            with open(path, 'r+b') as f:
+                f.truncate(good)
+    
+    def _add_pending(self, username, patch):
+        if self._pending_shared:
+            self.pending = dict(self.pending)
+            self._pending_shared = False
+        # 合并到补丁的浅拷贝上（嵌套字典由merge_patch复制），快照持有的旧补丁保持不变；
+        # 新账户的完整记录直接合并，已有账户的补丁需要保留None删除标记
+        existing = dict(self.pending.get(username, ()))
+        self.pending[sys.intern(username)] = merge_patch(existing, patch, keep_nulls=username in self.offsets)
+        if self._newer is not None:
+            # 合并进行中：另外记下冻结之后的补丁，合并完成后待合并补丁只剩这些
+            newer = dict(self._newer.get(username, ()))
+            self._newer[sys.intern(username)] = merge_patch(
+                newer, patch, keep_nulls=username in self.offsets or username in self._frozen)
+        self.journal_entries += 1
+        self.version += 1
+    
+    def __contains__(self, username):
+        return username in self.offsets or username in self.pending
+    
+    def __len__(self):
+        return len(self.offsets) + sum(1 for username in self.pending if username not in self.offsets)
+    
+    def names(self):
+        """逐个生成所有用户名（不读取账户内容）"""
+        with self._lock:
+            offsets, pending = self.offsets, self.pending
+        yield from offsets
+        for username in pending:
+            if username not in offsets:
+                yield username
+    
+    def get(self, username):
+        """读取单个账户的字典，不存在时返回None"""
+        with self._lock:
+            location = self.offsets.get(username)
+            if location is None:
+                account = self.pending.get(username)
+                return merge_patch({}, account) if account is not None else None
+            self._file.seek(location[0])
+            data = self._file.read(location[1])
+            # 与文件内容在同一把锁下取补丁，合并完成时两者一起替换
+            patch = self.pending.get(username)
+            self.disk_reads += 1
+        account = json.loads(data)
+        if patch:
+            merge_patch(account, patch)
+        return account
+    
+    def items(self, raw=False):
+        """按文件顺序流式遍历所有账户，内存占用与账户数量无关
+        
+        raw为True时，没有待合并补丁的账户以原始JSON字节返回。
+        """
+        return self._items(self.offsets, self.pending, raw)
+    
+    def _items(self, offsets, pending, raw):
+        with open(self.path, 'rb') as f:
+            for username, (offset, length) in offsets.items():
+                f.seek(offset)
+                data = f.read(length)
+                patch = pending.get(username)
+                if raw and not patch:
+                    yield username, data
+                    continue
+                account = json.loads(data)
+                if patch:
+                    merge_patch(account, patch)
+                yield username, account
+        for username, account in list(pending.items()):
+            if username not in offsets:
+                yield username, merge_patch({}, account)
+    
+    def put(self, username, patch, wait=True):
+        """把补丁追加到修改日志，只写入变化的字段，返回组提交的票号；wait为True时等待落盘"""
+        start = time.perf_counter()
+        line = encode_line({"user": username, "patch": patch})
+        with self._lock:
+            self._journal.write(line)
+            self._journal.flush()
+            self._add_pending(username, patch)
+            ticket = self.committer.request(self._journal, wait=False)
+            if self.journal_entries >= JOURNAL_COMPACT_LIMIT and self._compactor is None:
+                # 在后台线程中合并，保存不必等待重写整个账户文件
+                self._compactor = threading.Thread(target=self._compact_in_background, name="account-compact",
+                                                   daemon=True)
+                self._compactor.start()
+        # 在锁外等待，其他线程的保存可以并入同一次fsync
+        if wait:
+            self.committer.wait(ticket)
+        METRICS.inc("store_write_bytes_total", value=len(line))
+        METRICS.observe("store_write_seconds", time.perf_counter() - start)
+        return ticket
+    
+    def snapshot(self):
+        """取得当前时刻的只读快照（不复制数据），用完需要close"""
+        with self._lock:
+            self._pending_shared = True
+            self._readers += 1
+            return AccountSnapshot(self, self.offsets, self.pending, self.version)
+    
+    def release_snapshot(self):
+        with self._lock:
+            self._readers -= 1
+            if self._readers == 0:
+                self._no_readers.notify_all()
+    
+    def compact(self):
+        """把修改日志合并进账户文件，旧日志保留一份用于从备份恢复
+        
+        只在开始和结束时短暂持有锁：开始时把当前日志改名为合并中日志并冻结待合并补丁，
+        之后的保存写入新日志；重写账户文件在锁外进行；结束时等打开的快照关闭后替换文件。
+        """
+        with self._compact_lock:
+            with self._lock:
+                if not self.pending:
+                    return
+                self._journal.close()
+                os.replace(self.journal_path, self.compacting_path)
+                self._journal = open(self.journal_path, 'ab')
+                fsync_dir(self.journal_path)
+                offsets, self._frozen = self.offsets, self.pending
+                self._pending_shared = True
+                self._newer = {}
+                frozen_entries, self.journal_entries = self.journal_entries, 0
+            try:
+                temp = self._write_temp(self._items(offsets, self._frozen, raw=True))
+            except BaseException:
+                # 重写失败：旧日志接回当前日志，待合并补丁保持不变
+                with self._lock:
+                    self._journal.close()
+                    self._rejoin_journal()
+                    self._journal = open(self.journal_path, 'ab')
+                    self._frozen = self._newer = None
+                    self.journal_entries += frozen_entries
+                raise
+            with self._lock:
+                while self._readers:
+                    self._no_readers.wait()
+                self._install(*temp)
+                os.replace(self.compacting_path, self.journal_path + ".bak")
+                fsync_dir(self.journal_path)
+                self.pending = self._newer
+                self._pending_shared = False
+                self._frozen = self._newer = None
+    
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        finally:
+            with self._lock:
+                self._compactor = None
+    
+    def _rejoin_journal(self):
+        """把合并中日志接回当前日志前面（当前日志需已关闭）"""
+        with open(self.compacting_path, 'ab') as f:
+            if os.path.exists(self.journal_path):
+                with open(self.journal_path, 'rb') as current:
+                    shutil.copyfileobj(current, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.compacting_path, self.journal_path)
+        fsync_dir(self.journal_path)
+    
+    def _reset_journal(self):
+        self._journal.close()
+        os.replace(self.journal_path, self.journal_path + ".bak")
+        self._journal = open(self.journal_path, 'ab')
+        fsync_dir(self.journal_path)
+        self.pending = {}
+        self._pending_shared = False
+        self.journal_entries = 0
+    
+    def bulk_upsert(self, records, batch_size=IMPORT_BATCH_SIZE):
+        """批量写入账户（整条替换已有账户），返回写入的用户名集合
+        
+        记录按批写入暂存文件，每批一次fsync；全部写完后与现有账户一起流式重写一次账户文件，
+        而不是每个账户追加一条修改日志。
+        """
+        staging_path = self.path + ".import"
+        staged = {}  # 用户名 -> (偏移, 长度)
+        with open(staging_path, 'wb') as staging:
+            batch = []
+            for username, account in records:
+                batch.append((username, json.dumps(account).encode("ascii")))
+                if len(batch) >= batch_size:
+                    self._stage(staging, batch, staged)
+                    batch = []
+            if batch:
+                self._stage(staging, batch, staged)
+        with self._compact_lock, self._lock, open(staging_path, 'rb') as staging:
+            # 等待打开的快照全部关闭
+            while self._readers:
+                self._no_readers.wait()
+            
+            def read_staged(location):
+                staging.seek(location[0])
+                return staging.read(location[1])
+            
+            def merged():
+                for username, account in self.items(raw=True):
+                    location = staged.get(username)
+                    yield username, account if location is None else read_staged(location)
+                for username, location in staged.items():
+                    if username not in self:
+                        yield username, read_staged(location)
+            
+            self.write_snapshot(merged())
+            self._reset_journal()
+            self.version += 1
+        os.remove(staging_path)
+        return staged.keys()
+    
+    def _stage(self, staging, batch, staged):
+        for username, value in batch:
+            staged[sys.intern(username)] = (staging.tell(), len(value))
+            staging.write(value + b"\n")
+        staging.flush()
+        self.committer.request(staging)
+
+# 账户只读快照：固定某一时刻的账户文件、偏移索引和待合并补丁，
+# 之后的写入不会影响快照，可以在后台线程中慢慢读取
+class AccountSnapshot:
+    def __init__(self, store, offsets, pending, version):
+        self.store = store
+        self.offsets = offsets
+        self.pending = pending
+        self.version = version
+        self._file = open(store.path, 'rb')
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+    
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self.store.release_snapshot()
+    
+    def __contains__(self, username):
+        return username in self.offsets or username in self.pending
+    
+    def __len__(self):
+        return len(self.offsets) + sum(1 for username in self.pending if username not in self.offsets)
+    
+    def get(self, username):
+        location = self.offsets.get(username)
+        patch = self.pending.get(username)
+        if location is None:
+            return merge_patch({}, patch) if patch is not None else None
+        self._file.seek(location[0])
+        account = json.loads(self._file.read(location[1]))
+        return merge_patch(account, patch) if patch else account
+    
+    def items(self):
+        """按文件顺序流式遍历快照中的账户"""
+        for username, (offset, length) in self.offsets.items():
+            self._file.seek(offset)
+            account = json.loads(self._file.read(length))
+            patch = self.pending.get(username)
+            if patch:
+                merge_patch(account, patch)
+            yield username, account
+        for username, account in self.pending.items():
+            if username not in self.offsets:
+                yield username, merge_patch({}, account)
+
+# 账户LRU缓存：读穿透到磁盘存储，按内存预算和过期时间淘汰，登录中的账户常驻内存
+class AccountCache:
+    # 每个缓存条目除记录本身外的大致开销（有序字典节点和条目列表）
+    ENTRY_OVERHEAD = 200
+    
+    def __init__(self, store, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # 用户名 -> [记录, 估算字节数, 最近访问时间]
+        self.pinned = {}              # 用户名 -> 固定次数
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, username):
+        """读取账户记录，未命中时从磁盘加载"""
+        now = time.monotonic()
+        entry = self.entries.get(username)
+        if entry is not None:
+            if username in self.pinned or now - entry[2] <= self.ttl:
+                self.hits += 1
+                entry[2] = now
+                self.entries.move_to_end(username)
+                return entry[0]
+            # 已过期
+            self._remove(username)
+        self.misses += 1
+        account = self.store.get(username)
+        if account is None:
+            return None
+        record = AccountRecord.from_json(username, account)
+        self.put(record)
+        return record
+    
+    def put(self, record):
+        """放入（或替换）一条记录"""
+        username = record.username
+        if username in self.entries:
+            self._remove(username)
+        size = self._record_size(record)
+        self.entries[username] = [record, size, time.monotonic()]
+        self.size += size
+        self._evict()
+    
+    def pin(self, username):
+        """固定账户（如已登录的玩家），不会被淘汰或过期"""
+        self.pinned[username] = self.pinned.get(username, 0) + 1
+    
+    def unpin(self, username):
+        count = self.pinned.get(username, 0) - 1
+        if count > 0:
+            self.pinned[username] = count
+        else:
+            self.pinned.pop(username, None)
+            self._evict()
+    
+    def stats(self):
+        """缓存统计信息"""
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "disk_reads": self.store.disk_reads,
+        }
+    
+    def invalidate(self, username):
+        """丢弃缓存中的记录（磁盘上的账户被整条替换后），固定状态保留"""
+        if username in self.entries:
+            self._remove(username)
+    
+    def _remove(self, username):
+        entry = self.entries.pop(username)
+        self.size -= entry[1]
+    
+    def _evict(self):
+        """从最久未使用的一端淘汰，直到回到内存预算以内"""
+        if self.size <= self.max_bytes:
+            return
+        for username in list(self.entries):
+            if self.size <= self.max_bytes:
+                break
+            if username in self.pinned:
+                continue
+            self._remove(username)
+            self.evictions += 1
+    
+    def _record_size(self, record):
+        size = (self.ENTRY_OVERHEAD + sys.getsizeof(record) + sys.getsizeof(record.username)
+                + sys.getsizeof(record.password))
+        if record.extra:
+            size += sys.getsizeof(record.extra) + sum(sys.getsizeof(value) for value in record.extra.values())
+        return size
+
+# 哈夫币流水账：只追加的交易记录，余额由流水推导，定期写快照以缩短恢复时间
+class CoinLedger:
+    def __init__(self, path=LEDGER_FILE, snapshot_path=LEDGER_SNAPSHOT_FILE,
+                 snapshot_interval=LEDGER_SNAPSHOT_INTERVAL, committer=None):
+        self.path = path
+        self.committer = committer or GroupCommitter()
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.balances = {}
+        self.seq = 0
+        self.since_snapshot = 0
+        self.by_user = None    # 用户名 -> (时间戳数组, 偏移数组)，首次查询时建立
+        self.by_reason = None  # 原因 -> (时间戳数组, 偏移数组)
+        self._last_ts = 0.0
+        self.recover()
+        self._file = open(self.path, 'ab')
+    
+    def recover(self):
+        """从快照加上快照之后的流水恢复余额"""
+        offset = 0
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'r') as f:
+                snapshot = json.load(f)
+            self.balances = snapshot["balances"]
+            self.seq = snapshot["seq"]
+            offset = snapshot["offset"]
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            batch = []  # 批量交易中已读到的条目，读完整批才生效
+            end = offset
+            for line in f:
+                entry = decode_line(line)
+                if entry is None:
+                    # 最后一行写了一半，截掉以免后续追加接在坏数据后面
+                    break
+                batch.append(entry)
+                end += len(line)
+                if entry.get("more"):
+                    continue
+                for entry in batch:
+                    self.balances[entry["user"]] = self.balances.get(entry["user"], 0) + entry["delta"]
+                    self.seq = entry["seq"]
+                    self.since_snapshot += 1
+                batch = []
+                offset = end
+        if offset < os.path.getsize(self.path):
+            # 连同没有写完的批量交易一起截掉
+            with open(self.path, 'r+b') as f:
+                f.truncate(offset)
+    
+    def close(self):
+        if self._file is not None:
+            self.committer.request(self._file)
+            self._file.close()
+            self._file = None
+    
+    def has_account(self, username):
+        return username in self.balances
+    
+    def balance(self, username):
+        return self.balances.get(username, 0)
+    
+    def append(self, username, delta, reason, session_id=None, wait=False):
+        """追加一笔交易并返回新的余额；落盘由组提交完成"""
+        self.seq += 1
+        ts = time.time()
+        entry = {"seq": self.seq, "user": username, "delta": delta, "reason": reason,
+                 "session": session_id, "ts": ts}
+        offset = self._file.tell()
+        line = encode_line(entry)
+        self._file.write(line)
+        self._file.flush()
+        METRICS.inc("ledger_write_bytes_total", value=len(line))
+        self.committer.request(self._file, wait)
+        self.balances[username] = self.balances.get(username, 0) + delta
+        if self.by_user is not None:
+            self._index(entry, offset)
+        self.since_snapshot += 1
+        if self.since_snapshot >= self.snapshot_interval:
+            self.write_snapshot()
+        return self.balances[username]
+    
+    def append_batch(self, changes, wait=False):
+        """一次写入多笔交易 [(用户名, 变化, 原因, 会话)]：恢复时整批生效或整批丢弃"""
+        ts = time.time()
+        offset = self._file.tell()
+        entries = []
+        lines = []
+        for index, (username, delta, reason, session_id) in enumerate(changes):
+            self.seq += 1
+            entry = {"seq": self.seq, "user": username, "delta": delta, "reason": reason,
+                     "session": session_id, "ts": ts}
+            # more：本批之后还有几条
+            more = len(changes) - index - 1
+            if more:
+                entry["more"] = more
+            entries.append(entry)
+            lines.append(encode_line(entry))
+        data = b"".join(lines)
+        self._file.write(data)
+        self._file.flush()
+        METRICS.inc("ledger_write_bytes_total", value=len(data))
+        self.committer.request(self._file, wait)
+        for entry, line in zip(entries, lines):
+            self.balances[entry["user"]] = self.balances.get(entry["user"], 0) + entry["delta"]
+            if self.by_user is not None:
+                self._index(entry, offset)
+            offset += len(line)
+        self.since_snapshot += len(entries)
+        if self.since_snapshot >= self.snapshot_interval:
+            self.write_snapshot()
+    
+    def write_snapshot(self):
+        """写入余额快照，记录对应的流水位置"""
+        # 快照指向的流水必须先落盘
+        self.committer.request(self._file)
+        snapshot = {"seq": self.seq, "offset": self._file.tell(), "balances": self.balances}
+        write_file_atomic(self.snapshot_path, json.dumps(snapshot).encode("ascii"))
+        self.since_snapshot = 0
+    
+    def query(self, username=None, reason=None, start=None, end=None):
+        """按用户和/或原因查询时间范围内的交易，走索引而不扫描全部流水"""
+        if username is None and reason is None:
+            raise ValueError("需要指定用户或原因")
+        self._build_index()
+        if username is not None:
+            timestamps, offsets = self.by_user.get(username, ((), ()))
+        else:
+            timestamps, offsets = self.by_reason.get(reason, ((), ()))
+        low = 0 if start is None else bisect.bisect_left(timestamps, start)
+        high = len(timestamps) if end is None else bisect.bisect_right(timestamps, end)
+        entries = []
+        with open(self.path, 'rb') as f:
+            for i in range(low, high):
+                f.seek(offsets[i])
+                entry = decode_line(f.readline())
+                if reason is None or entry["reason"] == reason:
+                    entries.append(entry)
+        return entries
+    
+    def _build_index(self):
+        if self.by_user is not None:
+            return
+        self.by_user = {}
+        self.by_reason = {}
+        self._file.flush()
+        offset = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                self._index(decode_line(line), offset)
+                offset += len(line)
+    
+    def _index(self, entry, offset):
+        # 时间戳取单调不减的值，保证索引可以二分查找
+        ts = max(entry["ts"], self._last_ts)
+        self._last_ts = ts
+        for index, key in ((self.by_user, entry["user"]), (self.by_reason, entry["reason"])):
+            if key not in index:
+                index[key] = (array('d'), array('q'))
+            index[key][0].append(ts)
+            index[key][1].append(offset)
+
+# 管理员审计日志：按大小轮转的分段文件，后台线程写入，按目标用户和时间桶建立索引
+class AuditLog:
+    def __init__(self, prefix=AUDIT_PREFIX, max_bytes=AUDIT_SEGMENT_BYTES, keep=AUDIT_KEEP_SEGMENTS,
+                 bucket_seconds=AUDIT_BUCKET_SECONDS, committer=None):
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.bucket_seconds = bucket_seconds
+        self.committer = committer or GroupCommitter()
+        self.by_target = None  # 目标用户 -> (段号数组, 偏移数组)，首次查询时建立
+        self.by_bucket = None  # 时间桶 -> (段号数组, 偏移数组)
+        self.segments = self._find_segments()
+        if not self.segments:
+            self.segments = [1]
+        self._repair(self.segments[-1])
+        self._file = open(self.segment_path(self.segments[-1]), 'ab')
+        self._queue = deque()
+        self._queued = 0
+        self._written = 0
+        self._lock = threading.Lock()  # 保护文件、段列表和索引
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="audit-log", daemon=True)
+        self._thread.start()
+    
+    def segment_path(self, segment):
+        return f"{self.prefix}.{segment:06d}.log"
+    
+    def _find_segments(self):
+        directory = os.path.dirname(os.path.abspath(self.prefix))
+        name = os.path.basename(self.prefix) + "."
+        segments = []
+        for filename in os.listdir(directory):
+            number = filename[len(name):-len(".log")]
+            if filename.startswith(name) and filename.endswith(".log") and number.isdigit():
+                segments.append(int(number))
+        return sorted(segments)
+    
+    def _repair(self, segment):
+        """截掉最后一段中写了一半的记录"""
+        path = self.segment_path(segment)
+        if not os.path.exists(path):
+            return
+        offset = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                if decode_line(line) is None:
+                    break
+                offset += len(line)
+        if offset < os.path.getsize(path):
+            with open(path, 'r+b') as f:
+                f.truncate(offset)
+    
+    def record(self, actor, action, target, before, after):
+        """记录一次管理员操作；只放入队列，写盘由后台线程完成，不阻塞界面"""
+        entry = {"ts": round(time.time(), 3), "who": actor, "act": action, "tgt": target,
+                 "old": before, "new": after}
+        with self._condition:
+            self._queue.append(entry)
+            self._queued += 1
+            self._condition.notify_all()
+    
+    def flush(self):
+        """等待队列中的记录全部写入"""
+        with self._condition:
+            target = self._queued
+            while self._written < target:
+                self._condition.wait()
+    
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                entries = list(self._queue)
+                self._queue.clear()
+            with self._lock:
+                for entry in entries:
+                    self._write(entry)
+                self._file.flush()
+                ticket = self.committer.request(self._file, wait=False)
+            self.committer.wait(ticket)
+            with self._condition:
+                self._written += len(entries)
+                self._condition.notify_all()
+    
+    def _write(self, entry):
+        if self._file.tell() >= self.max_bytes:
+            self._rotate()
+        offset = self._file.tell()
+        self._file.write(encode_line(entry))
+        if self.by_target is not None:
+            self._index(entry, self.segments[-1], offset)
+    
+    def _rotate(self):
+        """开始新的分段，超出保留数量的旧分段连同其索引一起删除"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self.segments.append(self.segments[-1] + 1)
+        self._file = open(self.segment_path(self.segments[-1]), 'ab')
+        while len(self.segments) > self.keep:
+            try:
+                os.remove(self.segment_path(self.segments.pop(0)))
+            except OSError:
+                pass
+            # 旧分段的索引项已失效，下次查询时重建
+            self.by_target = None
+            self.by_bucket = None
+    
+    def _build_index(self):
+        if self.by_target is not None:
+            return
+        self.by_target = {}
+        self.by_bucket = {}
+        self._file.flush()
+        for segment in self.segments:
+            offset = 0
+            path = self.segment_path(segment)
+            if not os.path.exists(path):
+                continue
+            with open(path, 'rb') as f:
+                for line in f:
+                    entry = decode_line(line)
+                    if entry is None:
+                        break
+                    self._index(entry, segment, offset)
+                    offset += len(line)
+    
+    def _index(self, entry, segment, offset):
+        bucket = int(entry["ts"] // self.bucket_seconds)
+        for index, key in ((self.by_target, entry["tgt"]), (self.by_bucket, bucket)):
+            if key not in index:
+                index[key] = (array('l'), array('q'))
+            index[key][0].append(segment)
+            index[key][1].append(offset)
+    
+    def _read(self, refs):
+        entries = []
+        files = {}
+        try:
+            for segment, offset in refs:
+                if segment not in files:
+                    files[segment] = open(self.segment_path(segment), 'rb')
+                f = files[segment]
+                f.seek(offset)
+                entry = decode_line(f.readline())
+                if entry is not None:
+                    entries.append(entry)
+        finally:
+            for f in files.values():
+                f.close()
+        return entries
+    
+    def query(self, target=None, action=None, start=None, end=None):
+        """按目标用户或时间范围查询，可再按操作类型过滤，只读取索引命中的记录"""
+        if target is None and start is None:
+            raise ValueError("需要指定目标用户或开始时间")
+        self.flush()
+        with self._lock:
+            self._build_index()
+            self._file.flush()
+            if target is not None:
+                segments, offsets = self.by_target.get(target, ((), ()))
+                refs = list(zip(segments, offsets))
+            else:
+                last = time.time() if end is None else end
+                refs = []
+                for bucket in range(int(start // self.bucket_seconds), int(last // self.bucket_seconds) + 1):
+                    segments, offsets = self.by_bucket.get(bucket, ((), ()))
+                    refs.extend(zip(segments, offsets))
+            entries = self._read(refs)
+        return [entry for entry in entries
+                if (action is None or entry["act"] == action)
+                and (start is None or entry["ts"] >= start)
+                and (end is None or entry["ts"] <= end)]
+
+# 密码哈希：优先使用scrypt（不可用时退回PBKDF2），在有界线程池中计算，避免阻塞界面线程
+class PasswordHasher:
+    def __init__(self, max_workers=PASSWORD_WORKERS, costs=PASSWORD_COSTS):
+        self.costs = costs
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="password")
+        self.latencies = deque(maxlen=1000)  # 最近的验证耗时（秒，含排队）
+        self.completed = 0
+        self._dummies = {}   # 账户类型 -> 用于不存在的用户名的哈希
+        self._lock = threading.Lock()
+        # 提前在后台算好普通用户的假哈希，第一次查询不存在的用户名时不会多花一次哈希的时间
+        self.pool.submit(self.reject, "")
+    
+    def hash(self, password, account_type="user"):
+        """按账户类型对应的代价参数计算密码哈希"""
+        cost = self.costs.get(account_type, self.costs["user"])
+        salt = os.urandom(16)
+        if hasattr(hashlib, "scrypt"):
+            n, r, p = cost["n"], cost["r"], cost["p"]
+            digest = hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p,
+                                    maxmem=256 * n * r * p + (1 << 20))
+            return "scrypt$%d$%d$%d$%s$%s" % (n, r, p, salt.hex(), digest.hex())
+        iterations = cost["iterations"]
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+        return "pbkdf2_sha256$%d$%s$%s" % (iterations, salt.hex(), digest.hex())
+    
+    def is_hashed(self, stored):
+        return stored.startswith("scrypt$") or stored.startswith("pbkdf2_sha256$")
+    
+    def needs_rehash(self, stored, account_type="user"):
+        """明文密码，或代价参数与当前设置不一致时需要重新哈希"""
+        if not self.is_hashed(stored):
+            return True
+        cost = self.costs.get(account_type, self.costs["user"])
+        parts = stored.split("$")
+        if parts[0] == "scrypt":
+            return not hasattr(hashlib, "scrypt") or [int(x) for x in parts[1:4]] != [cost["n"], cost["r"], cost["p"]]
+        return hasattr(hashlib, "scrypt") or int(parts[1]) != cost["iterations"]
+    
+    def verify(self, stored, password, account_type="user"):
+        """验证密码，返回(是否正确, 需要写回的新哈希或None)"""
+        parts = stored.split("$")
+        if parts[0] == "scrypt" and len(parts) == 6:
+            n, r, p = int(parts[1]), int(parts[2]), int(parts[3])
+            digest = hashlib.scrypt(password.encode("utf-8"), salt=bytes.fromhex(parts[4]), n=n, r=r, p=p,
+                                    maxmem=256 * n * r * p + (1 << 20))
+            ok = hmac.compare_digest(digest.hex(), parts[5])
+        elif parts[0] == "pbkdf2_sha256" and len(parts) == 4:
+            digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), bytes.fromhex(parts[2]), int(parts[1]))
+            ok = hmac.compare_digest(digest.hex(), parts[3])
+        else:
+            # 旧账户的明文密码
+            ok = hmac.compare_digest(stored.encode("utf-8"), password.encode("utf-8"))
+        if ok and self.needs_rehash(stored, account_type):
+            return True, self.hash(password, account_type)
+        return ok, None
+    
+    def reject(self, password, account_type="user"):
+        """用户名不存在：仍按同样的代价验证一次再返回None，响应时间不会暴露用户名是否存在"""
+        dummy = self._dummies.get(account_type)
+        if dummy is None:
+            dummy = self._dummies.setdefault(account_type, self.hash("", account_type))
+        self.verify(dummy, password, account_type)
+        return None
+    
+    def submit(self, func, *args):
+        """在线程池中执行，并记录从提交到完成的耗时"""
+        submitted = time.perf_counter()
+        def task():
+            try:
+                return func(*args)
+            finally:
+                self.latencies.append(time.perf_counter() - submitted)
+                with self._lock:
+                    self.completed += 1
+        return self.pool.submit(task)
+    
+    def stats(self):
+        """最近验证的延迟分位数（毫秒）"""
+        latencies = sorted(self.latencies)
+        if not latencies:
+            return {"completed": self.completed}
+        def percentile(q):
+            return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 2)
+        return {"completed": self.completed, "p50_ms": percentile(0.5),
+                "p95_ms": percentile(0.95), "p99_ms": percentile(0.99)}
+    
+    def benchmark(self, count=100, account_type="user"):
+        """并发提交count次密码验证，测量吞吐量和延迟"""
+        stored = self.hash("benchmark", account_type)
+        self.latencies.clear()
+        start = time.perf_counter()
+        futures = [self.submit(self.verify, stored, "benchmark", account_type) for _ in range(count)]
+        for future in futures:
+            future.result()
+        elapsed = time.perf_counter() - start
+        result = self.stats()
+        result.update({"workers": self.pool._max_workers, "seconds": round(elapsed, 3),
+                       "logins_per_second": round(count / elapsed, 1)})
+        return result
+
+def _done_future(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+def open_ndjson(path, mode):
+    """按扩展名打开（可能压缩的）NDJSON文件：.gz、.bz2、.xz，其他按普通文件处理"""
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    if path.endswith(".bz2"):
+        return bz2.open(path, mode)
+    if path.endswith(".xz"):
+        return lzma.open(path, mode)
+    return open(path, mode)
+
+def account_filter(banned=None, min_coins=None, max_coins=None, features=None):
+    """生成账户过滤条件：封禁状态、哈夫币范围、必须已解锁的功能；都不指定时返回None"""
+    if banned is None and min_coins is None and max_coins is None and not features:
+        return None
+    features = set(features or ())
+    def accept(account):
+        if banned is not None and bool(account.get("banned", False)) != banned:
+            return False
+        coins = account.get("haf_coin", 0)
+        if min_coins is not None and coins < min_coins:
+            return False
+        if max_coins is not None and coins > max_coins:
+            return False
+        return features.issubset(account.get("unlocked_features", ()))
+    return accept
+
+def validate_account(account):
+    """检查（已迁移到当前版本的）账户字典，返回错误说明，合法时返回None"""
+    if not isinstance(account.get("password"), str) or not account["password"]:
+        return "缺少密码"
+    if account.get("account_type") not in ("user", "admin"):
+        return "账户类型无效"
+    if type(account.get("haf_coin")) is not int or account["haf_coin"] < 0:
+        return "哈夫币数量无效"
+    for key in ("banned", "shop_disabled"):
+        if not isinstance(account.get(key), bool):
+            return f"{key} 不是布尔值"
+    unlocked = account.get("unlocked_features")
+    if not isinstance(unlocked, list) or not all(isinstance(f, str) for f in unlocked):
+        return "已解锁功能无效"
+    enabled = account.get("enabled_features")
+    if not isinstance(enabled, dict) or not all(isinstance(v, bool) for v in enabled.values()):
+        return "功能开启状态无效"
+    return None
+
+# 热字段表：哈夫币、封禁/禁用商店标志和功能位掩码按固定宽度存放在内存映射文件中，
+# 每个账户占一个固定槽位（用户名到槽位的对应关系只追加），修改就是一次原地写入；
+# 其他进程可以只读映射同一个文件，直接读取余额而不复制数据
+class BalanceTable:
+    HEADER = struct.Struct("<4sHHI")        # 魔数、版本、记录长度、保留
+    RECORD = struct.Struct("<qIIQQQ")       # 哈夫币、标志、保留、已解锁、开启状态已知、已开启
+    MAGIC = b"DCLB"
+    VERSION = 1
+    FLAG_VALID = 4                          # 槽位已写入（与 FLAG_BANNED/FLAG_SHOP_DISABLED 共用标志字段）
+    
+    def __init__(self, path=TABLE_FILE, slots_path=TABLE_SLOTS_FILE, readonly=False):
+        self.path = path
+        self.slots_path = slots_path
+        self.readonly = readonly
+        self.slots = {}      # 用户名 -> 槽位
+        self.capacity = 0
+        self._slots_read = 0  # 已读取的槽位文件长度
+        self._map = None
+        self._file = None
+        self._lock = threading.RLock()
+        if not readonly:
+            self._prepare()
+        self._read_slots()
+        self._remap()
+    
+    def _prepare(self):
+        """检查文件头；文件不存在或格式不符时重新建立（内容由AccountManager从账户和流水重建）"""
+        valid = False
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= self.HEADER.size:
+            with open(self.path, 'rb') as f:
+                magic, version, record_size, _ = self.HEADER.unpack(f.read(self.HEADER.size))
+            valid = (magic, version, record_size) == (self.MAGIC, self.VERSION, self.RECORD.size)
+        if not valid:
+            with open(self.path, 'wb') as f:
+                f.write(self.HEADER.pack(self.MAGIC, self.VERSION, self.RECORD.size, 0))
+            with open(self.slots_path, 'wb'):
+                pass
+    
+    def _read_slots(self):
+        """读取槽位文件中新增的用户名（每行一个，行号即槽位）"""
+        if not os.path.exists(self.slots_path):
+            return
+        with open(self.slots_path, 'rb') as f:
+            f.seek(self._slots_read)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # 写了一半的行
+                    break
+                self.slots[sys.intern(json.loads(line))] = len(self.slots)
+                self._slots_read += len(line)
+        if not self.readonly and self._slots_read < os.path.getsize(self.slots_path):
+            with open(self.slots_path, 'r+b') as f:
+                f.truncate(self._slots_read)
+    
+    def _remap(self, capacity=0):
+        """映射整个文件；capacity大于当前容量时先扩展文件"""
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._map = None
+        if self.readonly and (not os.path.exists(self.path) or os.path.getsize(self.path) <= self.HEADER.size):
+            # 写入方还没有建立表或还没有分配槽位，之后查询时再映射
+            self.capacity = 0
+            return
+        size = os.path.getsize(self.path)
+        needed = self.HEADER.size + capacity * self.RECORD.size
+        if needed > size and not self.readonly:
+            with open(self.path, 'r+b') as f:
+                f.truncate(needed)
+            size = needed
+        self.capacity = (size - self.HEADER.size) // self.RECORD.size
+        self._file = open(self.path, 'rb' if self.readonly else 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), size,
+                              access=mmap.ACCESS_READ if self.readonly else mmap.ACCESS_WRITE)
+    
+    def close(self):
+        if self._map is not None:
+            if not self.readonly:
+                self._map.flush()
+            self._map.close()
+            self._file.close()
+            self._map = None
+    
+    def flush(self):
+        """把映射中的修改写回文件（余额的持久性由哈夫币流水保证）"""
+        with self._lock:
+            if self._map is not None:
+                self._map.flush()
+    
+    def __contains__(self, username):
+        return username in self.slots
+    
+    def __len__(self):
+        return len(self.slots)
+    
+    def allocate(self, username):
+        """为新账户分配槽位并返回；已有槽位时直接返回"""
+        with self._lock:
+            slot = self.slots.get(username)
+            if slot is not None:
+                return slot
+            slot = len(self.slots)
+            if slot >= self.capacity:
+                self._remap(max(TABLE_INITIAL_SLOTS, self.capacity * 2))
+            with open(self.slots_path, 'ab') as f:
+                f.write(json.dumps(username).encode("ascii") + b"\n")
+            self.slots[sys.intern(username)] = slot
+            self._slots_read = os.path.getsize(self.slots_path)
+            return slot
+    
+    def _offset(self, username):
+        slot = self.slots.get(username)
+        if self.readonly and (slot is None or slot >= self.capacity):
+            # 其他进程可能新增了账户或扩展了文件
+            self._read_slots()
+            if len(self.slots) > self.capacity:
+                self._remap()
+            slot = self.slots.get(username)
+        if slot is None or slot >= self.capacity:
+            return None
+        return self.HEADER.size + slot * self.RECORD.size
+    
+    def read(self, username):
+        """读取账户的热字段，没有槽位时返回None"""
+        with self._lock:
+            offset = self._offset(username)
+            if offset is None:
+                return None
+            coins, flags, _, unlocked, known, enabled = self.RECORD.unpack_from(self._map, offset)
+        if not flags & self.FLAG_VALID:
+            return None
+        return {"haf_coin": coins, "banned": bool(flags & FLAG_BANNED),
+                "shop_disabled": bool(flags & FLAG_SHOP_DISABLED),
+                "unlocked_mask": unlocked, "enabled_known": known, "enabled_mask": enabled}
+    
+    def coins(self, username):
+        """读取哈夫币，没有槽位时返回None"""
+        with self._lock:
+            offset = self._offset(username)
+            if offset is None:
+                return None
+            coins, flags = struct.unpack_from("<qI", self._map, offset)
+        return coins if flags & self.FLAG_VALID else None
+    
+    def set_coins(self, username, coins):
+        """原地写入哈夫币（8字节）"""
+        with self._lock:
+            struct.pack_into("<q", self._map, self._offset(username), coins)
+    
+    def write_account(self, username, record):
+        """写入一条账户记录的全部热字段，没有槽位时先分配"""
+        flags = self.FLAG_VALID
+        if record.banned:
+            flags |= FLAG_BANNED
+        if record.shop_disabled:
+            flags |= FLAG_SHOP_DISABLED
+        enabled = record.enabled_features
+        if not isinstance(enabled, dict):
+            enabled = {}
+        values = (record.haf_coin, flags, 0, FEATURES.to_mask(record.unlocked_features),
+                  FEATURES.to_mask(enabled), FEATURES.to_mask(name for name, on in enabled.items() if on))
+        with self._lock:
+            self.allocate(username)
+            self.RECORD.pack_into(self._map, self._offset(username), *values)
+
+# 游戏历史：列式存储，每个字段一个定长数组文件，按固定行数分块，每块记录各字段的最小值和最大值；
+# 查询只读取需要的列，用块的取值范围跳过不可能匹配的块，数据通过内存映射读取
+class GameHistory:
+    META_FILE = "meta.json"
+    PLAYERS_FILE = "players.txt"
+    # 尚未写入列文件的局按行追加到这里（行号加各字段），程序崩溃或被结束后打开时补回
+    PENDING_FILE = "pending.bin"
+    PENDING = struct.Struct("<Q" + "".join(typecode for _, typecode in HISTORY_COLUMNS))
+    
+    def __init__(self, path=HISTORY_DIR, chunk_rows=HISTORY_CHUNK_ROWS, flush_rows=HISTORY_FLUSH_ROWS):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.flush_rows = flush_rows
+        self.types = dict(HISTORY_COLUMNS)
+        os.makedirs(path, exist_ok=True)
+        meta_path = os.path.join(path, self.META_FILE)
+        self.rows = 0
+        self.zones = {name: [] for name in self.types}  # 字段 -> [[最小值, 最大值], ...] 每块一项
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            self.rows = meta["rows"]
+            self.zones.update(meta["zones"])
+        # 列文件在元数据之前fsync；万一某一列比元数据记录的短（例如从别处复制的目录），
+        # 行数取最短的列，保证各列按行对齐
+        if self.rows:
+            for name, typecode in HISTORY_COLUMNS:
+                column_path = self._column_path(name)
+                size = os.path.getsize(column_path) if os.path.exists(column_path) else 0
+                self.rows = min(self.rows, size // array(typecode).itemsize)
+        # 元数据之后追加了一半的数据截掉
+        for name, typecode in HISTORY_COLUMNS:
+            column_path = self._column_path(name)
+            size = self.rows * array(typecode).itemsize
+            if os.path.exists(column_path) and os.path.getsize(column_path) > size:
+                with open(column_path, 'r+b') as f:
+                    f.truncate(size)
+        # 玩家名按出现顺序编号，列中只保存编号
+        self.players = []
+        players_path = os.path.join(path, self.PLAYERS_FILE)
+        if os.path.exists(players_path):
+            with open(players_path, 'r', encoding='utf-8') as f:
+                self.players = [line.rstrip("\n") for line in f]
+        self.player_ids = {name: index for index, name in enumerate(self.players)}
+        self._players_file = open(players_path, 'a', encoding='utf-8')
+        self.buffer = {name: array(typecode) for name, typecode in HISTORY_COLUMNS}
+        self._lock = threading.Lock()
+        self._replay_pending()
+    
+    def _replay_pending(self):
+        """把上次没有写入列文件的局读回缓冲区；已经写入的行（行号小于rows）和写了一半的记录跳过"""
+        pending_path = os.path.join(self.path, self.PENDING_FILE)
+        good = 0
+        if os.path.exists(pending_path):
+            with open(pending_path, 'rb') as f:
+                data = f.read()
+            good = len(data) - len(data) % self.PENDING.size
+            for values in self.PENDING.iter_unpack(data[:good]):
+                if values[0] == self.rows + len(self.buffer["player"]):
+                    for (name, _), value in zip(HISTORY_COLUMNS, values[1:]):
+                        self.buffer[name].append(value)
+        self._pending = open(pending_path, 'ab')
+        # 截掉写了一半的记录；已经写入列文件的行留到下次写入时一起清掉
+        self._pending.truncate(good)
+    
+    def _column_path(self, name):
+        return os.path.join(self.path, name + ".col")
+    
+    def player_id(self, name):
+        index = self.player_ids.get(name)
+        if index is None:
+            index = self.player_ids[name] = len(self.players)
+            self.players.append(name)
+            self._players_file.write(name + "\n")
+            self._players_file.flush()
+        return index
+    
+    def record(self, player, start, duration, level, interval, features, misses, lives_used, won, bet, coins):
+        """追加一局已结束的游戏；攒够flush_rows局后写入文件"""
+        values = {"player": self.player_id(player or ""), "start": start, "duration": duration,
+                  "level": level, "interval": interval, "features": features, "misses": misses,
+                  "lives_used": lives_used, "won": int(won), "bet": int(bet), "coins": coins}
+        with self._lock:
+            for name, column in self.buffer.items():
+                column.append(values[name])
+            self._log_pending(len(self.buffer["player"]) - 1)
+            if len(self.buffer["player"]) >= self.flush_rows:
+                self._flush()
+    
+    def record_board(self, player, board, start, level, lives, features=0, bet=False, coins=0, end=None):
+        """按结束时的棋盘追加一局（state为won记为通关）：lives为开局时的额外生命数，features为功能位掩码"""
+        if end is None:
+            end = time.time()
+        self.record(player, start, end - start, level, board.interval, features, board.misses,
+                    lives - board.lives, board.state == "won", bet, coins)
+    
+    def _log_pending(self, index):
+        """把缓冲区中第index局写入待写文件（只flush不fsync：防程序崩溃，不防断电）"""
+        self._pending.write(self.PENDING.pack(self.rows + index,
+                                              *(self.buffer[name][index] for name, _ in HISTORY_COLUMNS)))
+        self._pending.flush()
+    
+    def flush(self):
+        with self._lock:
+            self._flush()
+    
+    def _flush(self):
+        count = len(self.buffer["player"])
+        if not count:
+            return
+        for name, column in self.buffer.items():
+            with open(self._column_path(name), 'ab') as f:
+                column.tofile(f)
+                # 列数据先落盘，元数据中的行数才不会超过列的长度
+                f.flush()
+                os.fsync(f.fileno())
+            # 按块更新取值范围
+            row = self.rows
+            index = 0
+            while index < count:
+                chunk = row // self.chunk_rows
+                take = min(count - index, (chunk + 1) * self.chunk_rows - row)
+                values = column[index:index + take]
+                zones = self.zones[name]
+                if chunk == len(zones):
+                    zones.append([min(values), max(values)])
+                else:
+                    zones[chunk] = [min(zones[chunk][0], min(values)), max(zones[chunk][1], max(values))]
+                row += take
+                index += take
+        self.rows += count
+        self.buffer = {name: array(typecode) for name, typecode in HISTORY_COLUMNS}
+        # 列中引用的玩家编号也要先落盘
+        self._players_file.flush()
+        os.fsync(self._players_file.fileno())
+        # 元数据最后写入，其中的行数之外的数据在打开时截掉
+        write_file_atomic(os.path.join(self.path, self.META_FILE),
+                          json.dumps({"rows": self.rows, "zones": self.zones}).encode("ascii"))
+        self._pending.seek(0)
+        self._pending.truncate()
+    
+    def _ranges(self, where):
+        """把查询条件换算成 字段 -> (下限, 上限)；玩家可以用名字"""
+        ranges = {}
+        for name, condition in (where or {}).items():
+            if name not in self.types:
+                raise ValueError(f"未知字段：{name}")
+            if name == "player" and isinstance(condition, str):
+                index = self.player_ids.get(condition)
+                if index is None:
+                    return None
+                condition = (index, index)
+            elif not isinstance(condition, (tuple, list)):
+                condition = (condition, condition)
+            low, high = condition
+            ranges[name] = (-math.inf if low is None else low, math.inf if high is None else high)
+        return ranges
+    
+    def scan(self, columns, where=None):
+        """按块读取需要的列，逐块返回 {字段: 该块中满足条件的行的值列表}"""
+        self.flush()
+        ranges = self._ranges(where)
+        if ranges is None or not self.rows:
+            return
+        names = list(dict.fromkeys(list(columns) + list(ranges)))
+        maps = {}
+        views = {}
+        try:
+            for name in names:
+                with open(self._column_path(name), 'rb') as f:
+                    maps[name] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                views[name] = memoryview(maps[name]).cast(self.types[name])
+            for chunk in range((self.rows + self.chunk_rows - 1) // self.chunk_rows):
+                # 块的取值范围与条件不相交时整块跳过
+                if any(self.zones[name][chunk][1] < low or self.zones[name][chunk][0] > high
+                       for name, (low, high) in ranges.items()):
+                    continue
+                # 整块都在范围内的条件不必逐行检查
+                partial = [(name, low, high) for name, (low, high) in ranges.items()
+                           if self.zones[name][chunk][0] < low or self.zones[name][chunk][1] > high]
+                start = chunk * self.chunk_rows
+                end = min(start + self.chunk_rows, self.rows)
+                data = {name: views[name][start:end].tolist() for name in names}
+                if partial:
+                    keep = [row for row in range(end - start)
+                            if all(low <= data[name][row] <= high for name, low, high in partial)]
+                    data = {name: [values[row] for row in keep] for name, values in data.items()}
+                yield {name: data[name] for name in columns}
+        finally:
+            for view in views.values():
+                view.release()
+            for m in maps.values():
+                m.close()
+    
+    def aggregate(self, group_by=(), sums=(), where=None):
+        """分组统计：返回 {分组值元组: {"games": 局数, 字段: 合计}}，玩家分组时用名字"""
+        groups = {}
+        columns = list(dict.fromkeys(list(group_by) + list(sums))) or ["won"]
+        for data in self.scan(columns, where):
+            if not group_by:
+                # 不分组时整块一次累加
+                result = groups.setdefault((), dict.fromkeys(("games",) + tuple(sums), 0))
+                result["games"] += len(data[columns[0]])
+                for name in sums:
+                    result[name] += sum(data[name])
+                continue
+            for row, key in enumerate(zip(*(data[name] for name in group_by))):
+                result = groups.get(key)
+                if result is None:
+                    result = groups[key] = dict.fromkeys(("games",) + tuple(sums), 0)
+                result["games"] += 1
+                for name in sums:
+                    result[name] += data[name][row]
+        if "player" in group_by:
+            index = list(group_by).index("player")
+            groups = {key[:index] + (self.players[key[index]],) + key[index + 1:]: result
+                      for key, result in groups.items()}
+        return groups
+    
+    def close(self):
+        self.flush()
+        self._players_file.close()
+        self._pending.close()
+
+# 布隆过滤器：判断用户名"一定不存在"或"可能存在"，不读磁盘
+class BloomFilter:
+    HEADER = struct.Struct("<4sQII")  # 标记、位数、哈希次数、元素数
+    MAGIC = b"DLBF"
+    
+    def __init__(self, capacity, error_rate=USERNAME_BLOOM_ERROR_RATE):
+        capacity = max(capacity, 1024)
+        self.bits = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.capacity = capacity
+        self.count = 0
+        self.data = bytearray((self.bits + 7) // 8)
+    
+    def _positions(self, key):
+        # 双重哈希：由一个128位摘要得到全部k个位置
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1, h2 = struct.unpack("<QQ", digest)
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+    
+    def add(self, key):
+        for position in self._positions(key):
+            self.data[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+    
+    def __contains__(self, key):
+        data = self.data
+        return all(data[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+    
+    def save(self, path):
+        write_file_atomic(path, self.HEADER.pack(self.MAGIC, self.bits, self.hashes, self.count) + self.data)
+    
+    @classmethod
+    def load(cls, path):
+        """读取保存的过滤器；文件不存在或损坏时返回None"""
+        try:
+            with open(path, 'rb') as f:
+                raw = f.read()
+            magic, bits, hashes, count = cls.HEADER.unpack_from(raw)
+        except (OSError, struct.error):
+            return None
+        if magic != cls.MAGIC or len(raw) != cls.HEADER.size + (bits + 7) // 8:
+            return None
+        bloom = cls.__new__(cls)
+        bloom.bits = bits
+        bloom.hashes = hashes
+        bloom.count = count
+        bloom.capacity = count
+        bloom.data = bytearray(raw[cls.HEADER.size:])
+        return bloom
+
+# 用户名索引：布隆过滤器挡住绝大多数"不存在"的查询；存在的用户名在磁盘上的有序索引中二分查找。
+# 索引文件：按用户名排序的 (2字节长度, 用户名) 记录，末尾是每隔STRIDE条一个的稀疏索引
+# (偏移, 长度, 用户名)，打开时只把稀疏索引读入内存。新注册的用户名先追加到日志，攒够后归并进索引文件
+class UsernameIndex:
+    RECORD = struct.Struct("<H")
+    SPARSE = struct.Struct("<QH")
+    TRAILER = struct.Struct("<4sQQQ")  # 标记、用户名数、稀疏索引条数、稀疏索引偏移
+    MAGIC = b"DLUI"
+    
+    def __init__(self, path=USERNAME_INDEX_FILE, stride=USERNAME_INDEX_STRIDE, merge_limit=USERNAME_MERGE_LIMIT):
+        self.path = path
+        self.bloom_path = path + ".bloom"
+        self.log_path = path + ".log"
+        self.merging_path = path + ".log.merging"  # 正在归并进索引文件的旧日志
+        self.stride = stride
+        self.merge_limit = merge_limit
+        self.count = 0          # 索引文件中的用户名数
+        self.keys = []          # 稀疏索引：每块第一个用户名
+        self.offsets = []       # 每块的起始偏移（最后一项为数据结束位置）
+        self.recent = []        # 尚未归并的新用户名（有序）
+        self.bloom = None
+        self.disk_reads = 0
+        self.bloom_rejects = 0
+        self._file = None
+        self._map = None
+        self._log = None
+        self._lock = threading.RLock()
+        # 归并在后台线程中进行，同一时间只有一个归并或重建
+        self._merge_lock = threading.Lock()
+        self._merger = None
+    
+    def open(self, names, expected):
+        """打开索引；文件缺失或数量与账户数expected不符时，用names()重新流式建立"""
+        with self._lock:
+            if self._load() and self.count + len(self.recent) == expected:
+                self.bloom = BloomFilter.load(self.bloom_path)
+                if self.bloom is not None and self.bloom.count == self.count:
+                    for name in self.recent:
+                        self.bloom.add(name)
+                    self._log = open(self.log_path, 'a', encoding='utf-8')
+                    return
+            self.rebuild(names())
+    
+    def _load(self):
+        self._close_files()
+        self.recent = []
+        if not os.path.exists(self.path):
+            return False
+        self._file = open(self.path, 'rb')
+        size = os.path.getsize(self.path)
+        if size < self.TRAILER.size:
+            return False
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, sparse_count, sparse_offset = self.TRAILER.unpack_from(self._map, size - self.TRAILER.size)
+        if magic != self.MAGIC:
+            return False
+        self.count = count
+        self.keys = []
+        self.offsets = []
+        position = sparse_offset
+        for _ in range(sparse_count):
+            offset, length = self.SPARSE.unpack_from(self._map, position)
+            position += self.SPARSE.size
+            self.offsets.append(offset)
+            self.keys.append(self._map[position:position + length].decode("utf-8"))
+            position += length
+        self.offsets.append(sparse_offset)
+        recent = set()
+        # 上次归并没有完成时旧日志还在；已经归并进去的话数量对不上，打开时会重建
+        for path in (self.merging_path, self.log_path):
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    recent.update(line.rstrip("\n") for line in f if line.endswith("\n"))
+        self.recent = sorted(recent)
+        return True
+    
+    def _close_files(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+    
+    def rebuild(self, names):
+        """从任意顺序的用户名流重建索引：分段排序（每段写入临时文件），再多路归并写出"""
+        with self._merge_lock, self._lock:
+            runs = []
+            total = 0
+            try:
+                while True:
+                    run = sorted(itertools.islice(names, USERNAME_SORT_RUN))
+                    total += len(run)
+                    if len(run) < USERNAME_SORT_RUN and not runs:
+                        # 只有一段时不落盘
+                        runs.append(run)
+                        break
+                    if not run:
+                        break
+                    path = f"{self.path}.run{len(runs)}"
+                    with open(path, 'w', encoding='utf-8') as f:
+                        f.writelines(name + "\n" for name in run)
+                    runs.append(path)
+                sources = [run if isinstance(run, list) else self._read_run(run) for run in runs]
+                self._install(*self._write_temp(heapq.merge(*sources), total),
+                              logs=(self.merging_path, self.log_path))
+            finally:
+                for run in runs:
+                    if isinstance(run, str):
+                        os.remove(run)
+    
+    @staticmethod
+    def _read_run(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                yield line.rstrip("\n")
+    
+    def _write_temp(self, names, expected):
+        """把有序用户名流写成临时索引文件，同时建立布隆过滤器（按expected留出一倍余量），
+        返回(临时文件路径, 布隆过滤器)"""
+        temp_path = self.path + ".tmp"
+        bloom = BloomFilter(expected * 2)
+        sparse = []
+        count = 0
+        offset = 0
+        last = None
+        with open(temp_path, 'wb') as f:
+            for name in names:
+                if name == last:
+                    continue
+                last = name
+                if count % self.stride == 0:
+                    sparse.append((offset, name))
+                data = name.encode("utf-8")
+                f.write(self.RECORD.pack(len(data)))
+                f.write(data)
+                offset += self.RECORD.size + len(data)
+                bloom.add(name)
+                count += 1
+            for block_offset, name in sparse:
+                data = name.encode("utf-8")
+                f.write(self.SPARSE.pack(block_offset, len(data)) + data)
+            f.write(self.TRAILER.pack(self.MAGIC, count, len(sparse), offset))
+            f.flush()
+            os.fsync(f.fileno())
+        return temp_path, bloom
+    
+    def _install(self, temp_path, bloom, logs):
+        """原子替换索引文件，删除已经归并进去的日志（调用方持有锁）"""
+        self._close_files()
+        os.replace(temp_path, self.path)
+        fsync_dir(self.path)
+        bloom.save(self.bloom_path)
+        for path in logs:
+            if os.path.exists(path):
+                os.remove(path)
+        self._load()
+        self.bloom = bloom
+        self._log = open(self.log_path, 'a', encoding='utf-8')
+    
+    def _iter_file(self, start=0, end=None):
+        """按顺序读出索引文件中[start, end)范围内的用户名"""
+        if end is None:
+            end = self.offsets[-1]
+        position = start
+        while position < end:
+            length = self.RECORD.unpack_from(self._map, position)[0]
+            position += self.RECORD.size
+            yield self._map[position:position + length].decode("utf-8")
+            position += length
+    
+    def __len__(self):
+        return self.count + len(self.recent)
+    
+    def __contains__(self, name):
+        with self._lock:
+            if name not in self.bloom:
+                self.bloom_rejects += 1
+                return False
+            index = bisect.bisect_left(self.recent, name)
+            if index < len(self.recent) and self.recent[index] == name:
+                return True
+            # 稀疏索引定位到块，只读这一块
+            block = bisect.bisect_right(self.keys, name) - 1
+            if block < 0:
+                return False
+            self.disk_reads += 1
+            for other in self._iter_file(self.offsets[block], self.offsets[block + 1]):
+                if other >= name:
+                    return other == name
+            return False
+    
+    def add(self, name):
+        """记录新用户名；日志攒够merge_limit条后归并进索引文件"""
+        with self._lock:
+            if name in self:
+                return
+            bisect.insort(self.recent, name)
+            self.bloom.add(name)
+            # 日志不单独fsync：丢失时打开时数量对不上，会从账户文件重建
+            self._log.write(name + "\n")
+            self._log.flush()
+            if len(self.recent) >= self.merge_limit and self._merger is None:
+                # 在后台线程中归并，注册不必等待重写整个索引
+                self._merger = threading.Thread(target=self._merge_in_background, name="username-merge",
+                                                daemon=True)
+                self._merger.start()
+    
+    def merge(self):
+        """把日志中的用户名归并进索引文件：开始时把日志改名冻结，重写在锁外进行（期间查询照常，
+        新用户名写入新日志），最后在锁内替换文件，把归并期间新增的用户名补进新的布隆过滤器"""
+        with self._merge_lock:
+            with self._lock:
+                if not self.recent:
+                    return
+                self._log.close()
+                os.replace(self.log_path, self.merging_path)
+                self._log = open(self.log_path, 'a', encoding='utf-8')
+                frozen = list(self.recent)
+            try:
+                # 只有归并和重建会关闭或替换映射，读取旧文件不需要持锁
+                temp_path, bloom = self._write_temp(heapq.merge(self._iter_file(), frozen), len(self))
+            except BaseException:
+                # 重写失败：旧日志接回新日志前面，下次再归并
+                with self._lock:
+                    self._log.close()
+                    with open(self.merging_path, 'a', encoding='utf-8') as f, \
+                            open(self.log_path, 'r', encoding='utf-8') as current:
+                        shutil.copyfileobj(current, f)
+                    os.replace(self.merging_path, self.log_path)
+                    self._log = open(self.log_path, 'a', encoding='utf-8')
+                raise
+            with self._lock:
+                # 新日志中是归并期间注册的用户名，重新读入后补进新的布隆过滤器
+                self._install(temp_path, bloom, logs=(self.merging_path,))
+                for name in self.recent:
+                    bloom.add(name)
+    
+    def _merge_in_background(self):
+        try:
+            self.merge()
+        finally:
+            with self._lock:
+                self._merger = None
+    
+    def prefix(self, prefix, limit=None):
+        """按顺序返回以prefix开头的用户名（范围扫描，从prefix所在的块开始读）"""
+        with self._lock:
+            block = max(0, bisect.bisect_right(self.keys, prefix) - 1)
+            start = self.offsets[block] if self.keys else 0
+            recent = self.recent[bisect.bisect_left(self.recent, prefix):]
+            names = []
+            for name in heapq.merge(self._iter_file(start), recent):
+                if name < prefix:
+                    continue
+                if not name.startswith(prefix) or (limit is not None and len(names) >= limit):
+                    break
+                names.append(name)
+            return names
+    
+    def stats(self):
+        return {
+            "names": len(self),
+            "unmerged": len(self.recent),
+            "bloom_bytes": len(self.bloom.data),
+            "bloom_rejects": self.bloom_rejects,
+            "disk_reads": self.disk_reads,
+        }
+    
+    def close(self):
+        merger = self._merger
+        if merger is not None:
+            merger.join()
+        with self._lock:
+            self._close_files()
+
+# 账户管理类
+class AccountManager:
+    def __init__(self, max_cache_bytes=CACHE_MAX_BYTES, cache_ttl=CACHE_TTL, wait_writes=True):
+        # 账户修改日志和哈夫币流水共用一个组提交线程
+        self.committer = GroupCommitter()
+        # 写入是否等待落盘；界面线程不等待（一次只保存一条，等待也凑不成组提交），
+        # 需要确认时用saved()取得Future
+        self.wait_writes = wait_writes
+        self.store = AccountStore(committer=self.committer)
+        self.cache = AccountCache(self.store, max_cache_bytes, cache_ttl)
+        self.load_accounts()
+        # 用户名索引：不存在的用户名由布隆过滤器直接判定，存在的在磁盘上的有序索引中查找
+        self.usernames = UsernameIndex()
+        self.usernames.open(self.store.names, len(self.store))
+        self.ledger = CoinLedger(committer=self.committer)
+        # 哈夫币等热字段在内存映射表中原地修改，不再写入账户文件
+        self.table = BalanceTable()
+        self.sync_table()
+        self.audit = AuditLog(committer=self.committer)
+        # 管理员的大量读取（用户列表等）在后台线程中基于快照进行
+        self.readers = ThreadPoolExecutor(max_workers=1, thread_name_prefix="account-reader")
+        # 账户文件中的余额在后台与流水核对
+        self.readers.submit(self.reconcile_coins)
+        self.hasher = PasswordHasher()
+        self.migrations = 0
+        # 账户变更的订阅者：callback(用户名, 变化的字段)，可能在任意线程中被调用
+        self.subscribers = []
+        # 指标服务线程中读取的值：只读计数和长度，不加锁
+        METRICS.gauge("active_sessions", lambda: len(self.cache.pinned), "已登录（固定在缓存中）的账户数")
+        METRICS.gauge("store_accounts", lambda: len(self.store.offsets), "账户文件中的账户数")
+        METRICS.gauge("store_pending_patches", lambda: self.store.journal_entries, "尚未合并的修改日志条数")
+        METRICS.gauge("store_file_bytes", lambda: os.path.getsize(self.store.path), "账户文件大小")
+        METRICS.gauge("cache_entries", lambda: len(self.cache.entries), "缓存中的账户数")
+        METRICS.gauge("cache_bytes", lambda: self.cache.size, "缓存估算占用的字节数")
+        METRICS.gauge("cache_hit_ratio", self._cache_hit_ratio, "缓存命中率")
+        
+    def _cache_hit_ratio(self):
+        lookups = self.cache.hits + self.cache.misses
+        return self.cache.hits / lookups if lookups else 0.0
+        
+    def load_accounts(self):
+        """打开账户文件，账户按需从磁盘读取"""
+        # 账户文件不存在时创建默认管理员账户
+        self.store.open({
+            "admin": {
+                "password": "admin123",
+                "account_type": "admin",
+                "banned": False,
+                "haf_coin": 999,
+                "unlocked_features": ["scroll_speed", "auto_aim", "error_hint", "extra_life"],
+                "enabled_features": {"scroll_speed": True, "auto_aim": True, "error_hint": True,
+                                     "extra_life": True},
+                "shop_disabled": False,
+                "schema_version": ACCOUNT_SCHEMA_VERSION
+            }
+        })
+    
+    def close(self):
+        """等后台读取和密码验证结束，再关闭索引、热字段表、流水和账户文件"""
+        self.readers.shutdown()
+        self.hasher.pool.shutdown()
+        self.usernames.close()
+        self.table.close()
+        self.ledger.close()
+        self.store.close()
+    
+    def save_accounts(self):
+        """保存账户数据到文件（合并修改日志）"""
+        self.store.compact()
+        self.table.flush()
+    
+    def sync_table(self):
+        """启动时核对热字段表：为缺少槽位的账户补上记录，余额以已落盘的流水为准"""
+        if len(self.table) < len(self.store):
+            # 第一次使用热字段表（或槽位文件丢失了末尾）：只在这种情况下遍历账户文件
+            for username, account in self.store.items():
+                if username not in self.table:
+                    self.table.write_account(username, AccountRecord.from_json(username, account))
+        # 映射中的修改可能没来得及写回磁盘（断电），流水是fsync过的
+        for username, balance in self.ledger.balances.items():
+            if username in self.table and self.table.coins(username) != balance:
+                self.table.set_coins(username, balance)
+    
+    def reconcile_coins(self):
+        """把流水中的余额写回账户文件里过期的haf_coin，返回修正的账户数。
+        
+        余额以流水为准（热字段表在sync_table中已经按流水修正），账户文件中的值只在
+        第一次记账时作为期初；这里让两处在启动后重新一致，导出和备份恢复时不会读到旧值。
+        """
+        fixed = 0
+        for username, balance in list(self.ledger.balances.items()):
+            account = self.store.get(username)
+            if account is not None and account.get("haf_coin") != balance:
+                self.store.put(username, {"haf_coin": balance}, wait=False)
+                fixed += 1
+        return fixed
+    
+    def get_account(self, username):
+        """获取账户记录，不存在时返回None；旧版本的记录在这里迁移并写回一次"""
+        if username not in self.cache.entries and username not in self.usernames:
+            return None
+        account = self.cache.get(username)
+        if account.schema_version < ACCOUNT_SCHEMA_VERSION:
+            data = account.to_json()
+            patch = make_patch(data, migrate_account(data))
+            account.apply_patch(patch)
+            self.store.put(username, patch, self.wait_writes)
+            self.table.write_account(username, account)
+            self.migrations += 1
+        # 哈夫币以热字段表为准，账户文件中的值可能是旧的
+        coins = self.table.coins(username)
+        if coins is None:
+            self.table.write_account(username, account)
+        elif coins != account.haf_coin:
+            account.update({"haf_coin": coins})
+        return account
+    
+    def login(self, username, password):
+        """登录验证（同步等待后台验证完成）"""
+        return self.finish_login(username, self.begin_login(username, password).result())
+    
+    def begin_login(self, username, password):
+        """在后台线程池中验证密码，返回Future"""
+        account = self.get_account(username)
+        if not account:
+            return self.hasher.submit(self.hasher.reject, password)
+        return self.hasher.submit(self.hasher.verify, account.password, password, account.account_type)
+    
+    def finish_login(self, username, result):
+        """处理验证结果（在调用线程中执行），明文或旧参数的密码顺便重新哈希；
+        用户名不存在和密码错误返回同样的提示，和验证耗时一样不暴露用户名是否存在"""
+        if result is None or not result[0]:
+            return None, "用户名或密码错误！"
+        new_hash = result[1]
+        account = self.get_account(username)
+        if new_hash:
+            self.update_account(username, {"password": new_hash})
+        if account.banned:
+            return None, "账户已被封禁！"
+        # 已登录的账户常驻缓存
+        self.cache.pin(username)
+        return account, "登录成功！"
+    
+    def logout(self, username):
+        """退出登录，账户可以被缓存淘汰"""
+        self.cache.unpin(username)
+    
+    def register(self, username, password):
+        """注册新账户（同步等待后台哈希完成）"""
+        return self.finish_register(username, self.begin_register(username, password).result())
+    
+    def begin_register(self, username, password):
+        """在后台线程池中计算新密码的哈希，返回Future"""
+        if username == SNAPSHOT_META_KEY or username in self.usernames:
+            return _done_future(None)
+        return self.hasher.submit(self.hasher.hash, password, "user")
+    
+    def finish_register(self, username, password_hash):
+        """用计算好的哈希创建账户"""
+        if username == SNAPSHOT_META_KEY:
+            return False, "用户名不可用！"
+        if password_hash is None or username in self.usernames:
+            return False, "用户名已存在！"
+        
+        # 创建新账户
+        account = {
+            "password": password_hash,
+            "account_type": "user",
+            "banned": False,
+            "haf_coin": 0,
+            "unlocked_features": [],
+            "enabled_features": {},  # 初始化功能开启状态
+            "shop_disabled": False,
+            "schema_version": ACCOUNT_SCHEMA_VERSION
+        }
+        record = AccountRecord.from_json(username, account)
+        self.write(username, account, record)
+        self.usernames.add(username)
+        self.cache.put(record)
+        return True, "注册成功！"
+    
+    def subscribe(self, callback):
+        """订阅账户变更：callback(用户名, 变化的字段集合)；"*"表示整条记录被替换"""
+        self.subscribers.append(callback)
+    
+    def unsubscribe(self, callback):
+        if callback in self.subscribers:
+            self.subscribers.remove(callback)
+    
+    def publish(self, username, fields):
+        for callback in list(self.subscribers):
+            callback(username, frozenset(fields))
+    
+    def write(self, username, patch, account=None):
+        """写入账户补丁并通知订阅者；account为已更新的记录时同步热字段表"""
+        self.store.put(username, patch, self.wait_writes)
+        if account is not None and not TABLE_FIELDS.isdisjoint(patch):
+            self.table.write_account(username, account)
+        self.publish(username, patch.keys())
+    
+    def ban_account(self, username, actor=None):
+        """封禁账户；actor为操作的管理员，记入审计日志"""
+        account = self.get_account(username)
+        if account and account.account_type == "user":
+            before = account.banned
+            account.banned = True
+            self.write(username, {"banned": True}, account)
+            if actor is not None:
+                self.audit.record(actor, "ban", username, before, True)
+            return True
+        return False
+    
+    def unban_account(self, username, actor=None):
+        """解除账户封禁；actor为操作的管理员，记入审计日志"""
+        account = self.get_account(username)
+        if account and account.account_type == "user":
+            before = account.banned
+            account.banned = False
+            self.write(username, {"banned": False}, account)
+            if actor is not None:
+                self.audit.record(actor, "unban", username, before, False)
+            return True
+        return False
+    
+    def set_shop_disabled(self, username, disabled, actor=None):
+        """设置账户是否禁用商店；actor为操作的管理员，记入审计日志"""
+        account = self.get_account(username)
+        if not account:
+            return False
+        before = account.shop_disabled
+        self.update_account(username, {"shop_disabled": disabled})
+        if actor is not None:
+            self.audit.record(actor, "shop_access", username, before, disabled)
+        return True
+    
+    def update_account(self, username, data):
+        """更新账户信息（按合并补丁处理，未提及的字段保持不变）"""
+        account = self.get_account(username)
+        if not account:
+            return False
+        if "haf_coin" in data:
+            # 哈夫币只能通过流水修改
+            data = dict(data)
+            coins = data.pop("haf_coin")
+            if coins != account.haf_coin:
+                self.set_coins(username, coins, "account_update")
+        if data:
+            account.apply_patch(data)
+            self.write(username, data, account)
+        return True
+    
+    def change_coins(self, username, delta, reason, session_id=None, wait=None):
+        """通过流水账修改哈夫币，返回新的余额；wait为True时等待流水落盘后才返回，None时按wait_writes"""
+        account = self.get_account(username)
+        if not account:
+            return None
+        if not self.ledger.has_account(username):
+            # 第一次记账时把已有余额记为期初
+            self.ledger.append(username, account.haf_coin, "opening", session_id)
+        if wait is None:
+            wait = self.wait_writes
+        balance = self.ledger.append(username, delta, reason, session_id, wait)
+        # 原地写入热字段表，不序列化账户
+        account.update({"haf_coin": balance})
+        self.table.set_coins(username, balance)
+        self.publish(username, ("haf_coin",))
+        return balance
+    
+    def apply_coin_changes(self, changes, wait=False):
+        """批量记账：changes为 [(用户名, 变化, 原因, 会话)]，整批作为一次写入记入流水，
+        恢复时要么全部生效要么全部丢弃；不存在的账户跳过。返回各账户的新余额"""
+        accounts = {}
+        entries = []
+        for username, delta, reason, session_id in changes:
+            if username not in accounts:
+                account = self.get_account(username)
+                if not account:
+                    continue
+                accounts[username] = account
+                if not self.ledger.has_account(username):
+                    # 第一次记账时把已有余额记为期初
+                    entries.append((username, account.haf_coin, "opening", session_id))
+            entries.append((username, delta, reason, session_id))
+        if not entries:
+            return {}
+        self.ledger.append_batch(entries, wait)
+        balances = {}
+        for username, account in accounts.items():
+            balance = balances[username] = self.ledger.balance(username)
+            account.update({"haf_coin": balance})
+            self.table.set_coins(username, balance)
+            self.publish(username, ("haf_coin",))
+        return balances
+    
+    def set_coins(self, username, coins, reason, session_id=None, actor=None):
+        """把哈夫币设为指定数量（记为一笔差额交易）；actor为操作的管理员，记入审计日志"""
+        account = self.get_account(username)
+        if not account:
+            return None
+        # 差额按流水中的余额计算，缓存中的记录可能是旧的
+        before = self.ledger.balance(username) if self.ledger.has_account(username) else account.haf_coin
+        balance = self.change_coins(username, coins - before, reason, session_id)
+        if actor is not None:
+            self.audit.record(actor, "set_coins", username, before, balance)
+        return balance
+    
+    def export_lines(self, accept=None):
+        """流式生成导出行：每个账户一行JSON（用户名加账户字段），读取开始时刻的快照"""
+        with self.store.snapshot() as snapshot:
+            for username, account in snapshot.items():
+                coins = self.table.coins(username)
+                if coins is not None:
+                    account["haf_coin"] = coins
+                if accept is None or accept(account):
+                    line = {"username": username}
+                    line.update(account)
+                    yield json.dumps(line, ensure_ascii=False).encode("utf-8") + b"\n"
+    
+    def export_accounts(self, path, accept=None):
+        """把账户导出为NDJSON文件（按扩展名压缩），返回导出的数量"""
+        count = 0
+        with open_ndjson(path, 'wb') as f:
+            for line in self.export_lines(accept):
+                f.write(line)
+                count += 1
+        return count
+    
+    def import_records(self, lines, accept=None, stats=None):
+        """流式解析并校验导入行，生成(用户名, 账户字典)；无效或被过滤的行计入stats"""
+        if stats is None:
+            stats = {}
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                account = json.loads(line)
+                username = account.pop("username")
+            except (ValueError, KeyError, AttributeError):
+                stats["invalid"] = stats.get("invalid", 0) + 1
+                continue
+            if not isinstance(username, str) or not username or username == SNAPSHOT_META_KEY:
+                stats["invalid"] = stats.get("invalid", 0) + 1
+                continue
+            account = migrate_account(account, copy=False)
+            if validate_account(account) is not None:
+                stats["invalid"] = stats.get("invalid", 0) + 1
+                continue
+            if accept is not None and not accept(account):
+                stats["skipped"] = stats.get("skipped", 0) + 1
+                continue
+            stats["imported"] = stats.get("imported", 0) + 1
+            yield username, account
+    
+    def import_accounts(self, path, accept=None, batch_size=IMPORT_BATCH_SIZE):
+        """从NDJSON文件（可压缩）批量导入账户，已有账户整条替换，返回统计信息"""
+        stats = {"imported": 0, "skipped": 0, "invalid": 0}
+        with open_ndjson(path, 'rb') as f:
+            def records():
+                for username, account in self.import_records(f, accept, stats):
+                    self.table.write_account(username, AccountRecord.from_json(username, account))
+                    yield username, account
+            written = self.store.bulk_upsert(records(), batch_size)
+        # 大批新用户名：直接从账户文件流式重建索引
+        if len(self.store) != len(self.usernames):
+            self.usernames.rebuild(self.store.names())
+        # 缓存中被替换的账户重新从磁盘读取
+        for username in list(self.cache.entries):
+            if username in written:
+                self.cache.invalidate(username)
+        if self.subscribers:
+            for username in written:
+                self.publish(username, ("*",))
+        # 已有流水的账户，把余额差额记为一笔导入交易，保持流水与账户一致
+        for username in list(self.ledger.balances):
+            if username in written:
+                delta = self.store.get(username)["haf_coin"] - self.ledger.balance(username)
+                if delta:
+                    self.ledger.append(username, delta, "import")
+        stats["accounts"] = len(self.store)
+        return stats
+    
+    def saved(self):
+        """目前为止的账户修改和哈夫币流水全部落盘时完成的Future"""
+        return self.committer.future()
+    
+    def find_users(self, prefix, limit=None):
+        """按用户名前缀查找（有序），走用户名索引，不遍历账户文件"""
+        return self.usernames.prefix(prefix, limit)
+    
+    def get_user_list(self, snapshot=None):
+        """获取所有普通用户列表（按用户名排序，流式读取，不占用缓存）"""
+        if snapshot is None:
+            with self.store.snapshot() as snapshot:
+                return self.get_user_list(snapshot)
+        users = []
+        for username, account in snapshot.items():
+            if account.get("account_type") == "user":
+                users.append({
+                    "username": username,
+                    "banned": account.get("banned", False)
+                })
+        users.sort(key=lambda user: user["username"])
+        return users
+    
+    def begin_user_list(self):
+        """在当前线程取快照，在后台线程读取和排序，返回Future"""
+        snapshot = self.store.snapshot()
+        def task():
+            with snapshot:
+                return self.get_user_list(snapshot)
+        return self.readers.submit(task)
+    
+    def save_player_data(self, player):
+        """保存玩家数据到账户文件：只写入加载后改动过的字段"""
+        if player.username and player.username in self.store:
+            patch = player.changes()
+            if patch:
+                self.update_account(player.username, patch)
+            player.mark_clean()
+
+def _copy_field(value):
+    """复制字段值，避免基线与当前值共享同一个列表或字典"""
+    if isinstance(value, list):
+        return list(value)
+    if isinstance(value, dict):
+        return dict(value)
+    return value
+
+# 玩家数据
+class PlayerData:
+    __slots__ = ("username", "account_type", "haf_coin", "unlocked_features",
+                 "enabled_features", "banned", "_baseline")
+    
+    # 需要跟踪改动并写回账户的字段
+    TRACKED_FIELDS = ("account_type", "haf_coin", "unlocked_features", "enabled_features", "banned")
+    
+    def __init__(self, username=None, account_type="user"):
+        self.username = username
+        self.account_type = account_type
+        self.haf_coin = 0
+        self.unlocked_features = []
+        self.enabled_features = {}
+        self.banned = False
+        self.mark_clean()
+    
+    def mark_clean(self, fields=None):
+        """记录当前字段值作为基线，之后的改动才算脏字段"""
+        if fields is None:
+            self._baseline = {field: _copy_field(getattr(self, field)) for field in self.TRACKED_FIELDS}
+        else:
+            for field in fields:
+                self._baseline[field] = _copy_field(getattr(self, field))
+    
+    def dirty_fields(self):
+        """返回加载（或上次保存）后改动过的字段名"""
+        return [field for field in self.TRACKED_FIELDS
+                if getattr(self, field) != self._baseline[field]]
+    
+    def changes(self):
+        """生成改动字段的合并补丁；字典字段只包含变化的键"""
+        patch = {}
+        for field in self.dirty_fields():
+            value = getattr(self, field)
+            old = self._baseline[field]
+            if isinstance(value, dict) and isinstance(old, dict):
+                diff = {key: item for key, item in value.items()
+                        if key not in old or old[key] != item}
+                for key in old:
+                    if key not in value:
+                        diff[key] = None
+                patch[field] = diff
+            else:
+                patch[field] = _copy_field(value)
+        return patch
+    
+    def load_from_account(self, account_data):
+        """从账户记录加载玩家信息（记录已由AccountManager迁移到当前版本）"""
+        self.username = account_data.username
+        self.account_type = account_data.account_type
+        self.haf_coin = account_data.haf_coin
+        self.unlocked_features = account_data.unlocked_features
+        self.enabled_features = account_data.enabled_features
+        self.banned = account_data.banned
+        self.mark_clean()
+    
+    def to_dict(self):
+        """转换为字典格式"""
+        return {
+            "username": self.username,
+            "account_type": self.account_type,
+            "haf_coin": self.haf_coin,
+            "unlocked_features": self.unlocked_features,
+            "enabled_features": self.enabled_features,
+            "banned": self.banned
+        }
+
+# 商店与功能目录：从目录文件加载一次，按效果、价格段、分类建立索引，文件修改后自动重新加载
+class ShopCatalog:
+    def __init__(self, path=CATALOG_FILE, check_interval=CATALOG_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self.items = []
+        self.by_effect = {}
+        self.by_category = {}
+        self.by_price_band = {}
+        self.mtime = None
+        self.version = 0
+        self._last_check = 0.0
+        self.reload()
+    
+    @staticmethod
+    def price_band(price):
+        """价格段编号：每CATALOG_PRICE_BAND个哈夫币为一段"""
+        return price // CATALOG_PRICE_BAND
+    
+    @staticmethod
+    def _validate(item):
+        """检查一个商品并补上默认字段，不合格时抛出ValueError"""
+        if not isinstance(item, dict):
+            raise ValueError("商品必须是对象")
+        for key in ("name", "effect"):
+            if not isinstance(item.get(key), str) or not item[key]:
+                raise ValueError(f"商品缺少{key}")
+        price = item.get("price")
+        if not isinstance(price, int) or isinstance(price, bool) or price < 0:
+            raise ValueError(f"商品 {item['effect']} 的价格无效")
+        item.setdefault("params", {})
+        item.setdefault("setting_text", item["name"])
+        if (not isinstance(item["params"], dict) or not isinstance(item["setting_text"], str)
+                or not isinstance(item.get("category", ""), str)):
+            raise ValueError(f"商品 {item['effect']} 的字段类型错误")
+        return item
+    
+    def reload(self):
+        """重新读取目录文件；文件不存在或任何一个商品不合格时保留当前目录"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            with open(self.path, 'r', encoding="utf-8") as f:
+                items = json.load(f)["items"]
+            if not isinstance(items, list):
+                raise ValueError("items必须是列表")
+            # 全部商品检查通过后才替换，检查中途出错不会留下一半的新目录
+            items = [self._validate(item) for item in items]
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        by_effect = {}
+        by_category = {}
+        by_price_band = {}
+        for item in items:
+            by_effect[item["effect"]] = item
+            by_category.setdefault(item.get("category", ""), []).append(item)
+            by_price_band.setdefault(self.price_band(item["price"]), []).append(item)
+        for item in items:
+            FEATURES.register(item["effect"])
+        self.items = items
+        self.by_effect = by_effect
+        self.by_category = by_category
+        self.by_price_band = by_price_band
+        self.mtime = mtime
+        self.version += 1
+        return True
+    
+    def check(self):
+        """按间隔检查目录文件的修改时间，变化时重新加载"""
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return
+        if mtime != self.mtime:
+            self.reload()
+    
+    def all_items(self):
+        self.check()
+        return self.items
+    
+    def get(self, effect):
+        """按效果查找商品，不存在时返回None"""
+        self.check()
+        return self.by_effect.get(effect)
+    
+    def in_category(self, category):
+        self.check()
+        return self.by_category.get(category, [])
+    
+    def in_price_band(self, band):
+        self.check()
+        return self.by_price_band.get(band, [])
+    
+    def params(self, effect):
+        """功能的效果参数"""
+        item = self.get(effect)
+        return item["params"] if item else {}
+
+# 密码锁棋盘：只包含游戏逻辑，不依赖Tk，便于同时运行多个棋盘
+class LockBoard:
+    def __init__(self, columns=COLUMNS, rows=ROWS, symbol_set=SYMBOL_SET, interval=1000, lives=0, seed=None,
+                 layout=None):
+        if layout is None:
+            layout = LockBoard.generate_layout(columns, rows, symbol_set, seed)
+        self.columns = len(layout["targets"])
+        self.rows = len(layout["symbols"][0])
+        self.seed = layout["seed"]
+        self.interval = interval  # 滚动间隔（毫秒）
+        self.lives = lives        # 剩余额外生命
+        self.state = "playing"    # playing / won / lost
+        self.current_column = 0
+        self.lock_count = 0
+        self.misses = 0
+        self.ticks = 0
+        
+        self.targets = layout["targets"]
+        self.symbols = layout["symbols"]
+        # 每列的滚动偏移：第row行显示 symbols[col][(row - offset) % rows]
+        self.offsets = [0] * self.columns
+        self.locked = [False] * self.columns
+        # 已显示的帧：(显示时间, 帧号)，用于按玩家按键时看到的画面判定
+        self.shown = deque(maxlen=BOARD_FRAME_HISTORY)
+    
+    @staticmethod
+    def generate_layout(columns, rows, symbol_set, seed=None):
+        """按种子生成棋盘布局（目标密码和每列的符号），同一种子总是得到同一布局"""
+        if seed is None:
+            seed = random.getrandbits(64)
+        rng = random.Random(seed)
+        # 生成目标密码
+        targets = [rng.choice(symbol_set) for _ in range(columns)]
+        # 为每列随机分配不同的行位置放置正确符号
+        if columns <= rows:
+            target_rows = rng.sample(range(rows), columns)
+        else:
+            target_rows = [rng.randrange(rows) for _ in range(columns)]
+        symbols = []
+        for col in range(columns):
+            symbols.append([targets[col] if row == target_rows[col] else rng.choice(symbol_set)
+                            for row in range(rows)])
+        return {"seed": seed, "targets": targets, "symbols": symbols}
+    
+    def symbol_at(self, col, row):
+        return self.symbols[col][(row - self.offsets[col]) % self.rows]
+    
+    def middle_symbol(self, col):
+        return self.symbol_at(col, self.rows // 2)
+    
+    def target_near_middle(self, col, window):
+        """正确符号是否在中间行上下window行以内"""
+        middle_row = self.rows // 2
+        for row in range(max(0, middle_row - window), min(self.rows, middle_row + window + 1)):
+            if self.symbol_at(col, row) == self.targets[col]:
+                return True
+        return False
+    
+    def tick(self):
+        """滚动一格：每个未锁定的列把最后一个符号移到最前面"""
+        if self.state != "playing":
+            return
+        for col in range(self.columns):
+            if not self.locked[col]:
+                self.offsets[col] += 1
+        self.ticks += 1
+    
+    def mark_shown(self, at):
+        """记录当前帧在at时刻显示到了屏幕上"""
+        if not self.shown or self.shown[-1][1] != self.ticks:
+            self.shown.append((at, self.ticks))
+    
+    def tick_at(self, at):
+        """at时刻屏幕上显示的帧号；没有记录时使用当前帧"""
+        for shown_at, tick in reversed(self.shown):
+            if shown_at <= at:
+                return tick
+        return self.shown[0][1] if self.shown else self.ticks
+    
+    def lock(self, at=None):
+        """锁定当前列，返回 "hit"、"won"、"life" 或 "lost"；无法锁定时返回None
+        
+        at为按键时间时，按那一刻显示的帧判定，而不是按处理事件时的帧。
+        """
+        if self.state != "playing":
+            return None
+        col = self.current_column
+        if self.locked[col]:
+            return None
+        # 未锁定的列每帧偏移加一，由此推出按键时该列的偏移
+        tick = self.ticks if at is None else self.tick_at(at)
+        offset = self.offsets[col] - (self.ticks - tick)
+        middle_row = self.rows // 2
+        if self.symbols[col][(middle_row - offset) % self.rows] == self.targets[col]:
+            # 锁定正确，停在玩家看到的位置
+            self.offsets[col] = offset
+            self.locked[col] = True
+            self.lock_count += 1
+            if self.lock_count == self.columns:
+                self.state = "won"
+                return "won"
+            self.select_next_unlocked()
+            return "hit"
+        # 锁定错误
+        self.misses += 1
+        if self.lives > 0:
+            # 使用额外生命
+            self.lives -= 1
+            self.select_next_unlocked()
+            return "life"
+        self.state = "lost"
+        return "lost"
+    
+    def select(self, step):
+        """向左（-1）或向右（1）移动选中的列"""
+        self.current_column = (self.current_column + step) % self.columns
+    
+    def select_next_unlocked(self):
+        """选择下一个未锁定的列"""
+        start_col = self.current_column
+        while True:
+            self.current_column = (self.current_column + 1) % self.columns
+            if not self.locked[self.current_column] or self.current_column == start_col:
+                break
+
+def level_spec(level):
+    """关卡参数：棋盘大小、滚动速度和生命数随关卡增长；第1关与原来的单局相同"""
+    level = max(1, min(level, LEVEL_MAX))
+    return {
+        "level": level,
+        "columns": min(COLUMNS + (level - 1) // 2, 20),
+        "rows": ROWS + 2 * ((level - 1) // 4),
+        "symbol_set": SYMBOL_SET,
+        "interval": max(250, 1000 - 40 * (level - 1)),  # 毫秒
+        "lives": level // 5,
+    }
+
+def board_settings(spec, features, catalog):
+    """根据关卡参数和已购买且已开启的功能（商店目录中的效果参数）生成本局设置"""
+    settings = {
+        "interval": spec["interval"],  # 滚动间隔（毫秒），第1关为1秒
+        "lives": spec["lives"],        # 允许的错误次数
+        "hint_color": None,  # 错误提示颜色
+        "aim_window": None,  # 自动瞄准提示范围（中间行上下各几行）
+        "aim_color": None,
+    }
+    for feature in features:
+        params = catalog.params(feature)
+        if "scroll_interval" in params:
+            # 目录中的间隔以正常速度1秒为基准，按比例作用于当前关卡
+            settings["interval"] = settings["interval"] * params["scroll_interval"] // 1000
+        settings["lives"] += params.get("extra_lives", 0)
+        if "hint_color" in params:
+            settings["hint_color"] = params["hint_color"]
+        if "aim_window" in params:
+            settings["aim_window"] = params["aim_window"]
+            settings["aim_color"] = params.get("aim_color", "#FFFF00")
+    return settings
+
+# 关卡包：后台线程为当前关卡及之后几关预先生成并校验好布局，开局时直接取用
+class LevelPack:
+    def __init__(self, pack_size=LEVEL_PACK_SIZE, prefetch=LEVEL_PREFETCH):
+        self.pack_size = pack_size  # 每关缓存的布局数量
+        self.prefetch = prefetch    # 提前准备的关卡数
+        self.packs = {}             # 关卡 -> deque(布局)
+        self.waiting = {}           # 关卡 -> [Future]，缓存为空时等待的请求
+        self.level = 1
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        self.generate_seconds = 0.0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="level-pack", daemon=True)
+        self._thread.start()
+    
+    def want(self, level):
+        """设置当前关卡，后台开始补充该关及之后的布局"""
+        with self._condition:
+            self.level = level
+            # 丢弃已经用不到的关卡
+            for old in [old for old in self.packs if old < level]:
+                del self.packs[old]
+            self._condition.notify_all()
+    
+    def take(self, level):
+        """取出一个布局，返回Future；有缓存时立即完成，否则由后台线程优先生成"""
+        with self._condition:
+            pack = self.packs.get(level)
+            if pack:
+                self.hits += 1
+                layout = pack.popleft()
+                self._condition.notify_all()
+                return _done_future(layout)
+            self.misses += 1
+            future = Future()
+            self.waiting.setdefault(level, []).append(future)
+            self._condition.notify_all()
+            return future
+    
+    def stats(self):
+        with self._condition:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "generated": self.generated,
+                "generate_seconds": round(self.generate_seconds, 4),
+                "cached": {level: len(pack) for level, pack in self.packs.items()},
+            }
+    
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+    
+    def _next_job(self):
+        """选出下一个要生成的关卡：先满足等待中的请求，再补充缓存"""
+        if self.waiting:
+            return min(self.waiting)
+        for level in range(self.level, min(self.level + self.prefetch, LEVEL_MAX) + 1):
+            if len(self.packs.get(level, ())) < self.pack_size:
+                return level
+        return None
+    
+    def _generate(self, level):
+        spec = level_spec(level)
+        start = time.perf_counter()
+        layout = LockBoard.generate_layout(spec["columns"], spec["rows"], spec["symbol_set"])
+        elapsed = time.perf_counter() - start
+        with self._condition:
+            self.generate_seconds += elapsed
+            self.generated += 1
+        layout["level"] = level
+        return layout
+    
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed and self._next_job() is None:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                level = self._next_job()
+            layout = self._generate(level)
+            with self._condition:
+                futures = self.waiting.get(level)
+                if futures:
+                    future = futures.pop(0)
+                    if not futures:
+                        del self.waiting[level]
+                else:
+                    future = None
+                    if level >= self.level:
+                        self.packs.setdefault(level, deque()).append(layout)
+            if future is not None:
+                future.set_result(layout)
+        
+
+# 计时轮：所有会话的滚动定时共用一个轮子，由一个任务推进，不为每个棋盘建立任务或定时器
+class TimerWheel:
+    def __init__(self, now, resolution=SERVER_RESOLUTION, slots=SERVER_WHEEL_SLOTS):
+        self.resolution = resolution
+        self.slots = [[] for _ in range(slots)]  # 每个槽：[(到期刻度, 条目)]
+        self.current = int(now / resolution)     # 下一个要处理的刻度
+        self.count = 0
+    
+    def schedule(self, deadline, item):
+        """在deadline（与now同一时钟）之后取出item；已经过期的放到下一个刻度"""
+        tick = max(int(deadline / self.resolution), self.current)
+        self.slots[tick % len(self.slots)].append((tick, item))
+        self.count += 1
+    
+    def expire(self, now):
+        """取出所有到期的条目，按到期顺序"""
+        due = []
+        last = int(now / self.resolution)
+        while self.current <= last:
+            slot = self.slots[self.current % len(self.slots)]
+            if slot:
+                # 超过一圈的条目留到下一圈
+                keep = []
+                for entry in slot:
+                    if entry[0] <= self.current:
+                        due.append(entry[1])
+                    else:
+                        keep.append(entry)
+                slot[:] = keep
+            self.current += 1
+        self.count -= len(due)
+        return due
+
+# 会话消息：服务器发送的每条消息前有2字节长度，第一个字节是类型
+MESSAGE_LENGTH = struct.Struct("<H")
+# 欢迎：是否登录成功、提示文字
+MESSAGE_WELCOME = struct.Struct("<cB")
+# 开局：种子、关卡、列数、行数、滚动间隔（毫秒）、额外生命，后接目标密码和按列排列的符号（每个符号一个字节）
+MESSAGE_START = struct.Struct("<cQBBBHB")
+# 帧差异：帧号、选中的列、剩余生命、已锁定列的位掩码、变化的列数，后接每列 (列号, 偏移 % 行数)
+MESSAGE_DELTA = struct.Struct("<cIBBIB")
+# 锁定结果：0命中 1通关 2使用生命 3失败
+MESSAGE_RESULT = struct.Struct("<cB")
+# 最新余额（哈夫币批量写入后）
+MESSAGE_COINS = struct.Struct("<ci")
+LOCK_RESULTS = {"hit": 0, "won": 1, "life": 2, "lost": 3}
+
+# 一个客户端连接对应一局游戏：自己的种子棋盘、滚动节奏、生命和下注状态
+class GameSession(asyncio.Protocol):
+    __slots__ = ("server", "transport", "username", "session_id", "features", "level", "board",
+                 "is_double_bet", "double_bet_amount", "deadline", "sent_offsets", "closed", "_hello",
+                 "game_start", "game_end", "game_level", "game_lives", "game_bet", "game_coins")
+    
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.username = None     # None为游客，不记哈夫币
+        self.session_id = uuid.uuid4().hex[:12]
+        self.features = []
+        self.level = 1
+        self.board = None
+        self.is_double_bet = False
+        self.double_bet_amount = 0
+        self.deadline = None
+        self.sent_offsets = None  # 客户端已知的每列偏移
+        self.closed = False
+        self._hello = b""        # 第一行："用户名\t密码\n"，空行为游客
+        # 游戏历史：本局的开始和结束时间、关卡（通关时level已加一）、初始生命、是否在加倍下注中、哈夫币变化
+        self.game_start = None
+        self.game_end = None
+        self.game_level = 1
+        self.game_lives = 0
+        self.game_bet = False
+        self.game_coins = 0
+    
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.sessions.add(self)
+    
+    def connection_lost(self, exc):
+        self.closed = True
+        self.server.sessions.discard(self)
+        if self.board is not None and self.board.state == "won":
+            # 通关后还没选择下注就断开
+            self.record_game()
+        if self.username:
+            self.server.logout(self.username)
+    
+    def data_received(self, data):
+        if self._hello is not None:
+            self._hello += data
+            if b"\n" not in self._hello:
+                if len(self._hello) > 256:
+                    self.transport.close()
+                return
+            line, data = self._hello.split(b"\n", 1)
+            self._hello = None
+            # 登录完成前的按键丢弃
+            self.server.login(self, line.decode("utf-8", "replace"))
+            return
+        if self.board is None:
+            return
+        for key in data:
+            self.handle_key(key)
+    
+    def send(self, message):
+        if not self.closed:
+            self.transport.write(MESSAGE_LENGTH.pack(len(message)) + message)
+    
+    def welcome(self, account, text):
+        """登录结果；失败时关闭连接"""
+        self.send(MESSAGE_WELCOME.pack(b"W", account is not None or not self.username) + text.encode("utf-8"))
+        if self.username and account is None:
+            self.username = None
+            self.transport.close()
+            return
+        if account is not None:
+            self.features = [feature for feature in account.unlocked_features
+                             if account.enabled_features.get(feature, True)]
+        self.start_level()
+    
+    def start_level(self):
+        """按当前关卡生成新棋盘（同一种子总是同一布局）并发送给客户端"""
+        spec = level_spec(self.level)
+        settings = board_settings(spec, self.features, self.server.catalog)
+        layout = LockBoard.generate_layout(spec["columns"], spec["rows"], spec["symbol_set"])
+        board = self.board = LockBoard(interval=settings["interval"], lives=settings["lives"], layout=layout)
+        self.sent_offsets = [0] * board.columns
+        self.send(MESSAGE_START.pack(b"S", board.seed, self.level, board.columns, board.rows,
+                                     board.interval, board.lives)
+                  + "".join(board.targets).encode("ascii")
+                  + "".join("".join(column) for column in board.symbols).encode("ascii"))
+        self.deadline = self.server.now() + board.interval / 1000
+        self.server.wheel.schedule(self.deadline, self)
+        self.game_start = time.time()
+        self.game_level = self.level
+        self.game_lives = board.lives
+        self.game_bet = self.is_double_bet
+        self.game_coins = 0
+    
+    def on_tick(self, now):
+        board = self.board
+        if board is None or board.state != "playing":
+            return
+        board.tick()
+        self.send_delta()
+        # 与BoardScheduler相同：保持固定节奏，落后太多时从现在重新计时
+        self.deadline += board.interval / 1000
+        if self.deadline <= now:
+            self.deadline = now + board.interval / 1000
+        self.server.wheel.schedule(self.deadline, self)
+    
+    def send_delta(self, force=False):
+        """只发送客户端还不知道的列偏移；发送缓冲积压时跳过，下一帧一并补上"""
+        if not force and self.transport.get_write_buffer_size() > SERVER_WRITE_LIMIT:
+            self.server.skipped_frames += 1
+            return
+        board = self.board
+        changed = []
+        for col in range(board.columns):
+            offset = board.offsets[col] % board.rows
+            if offset != self.sent_offsets[col]:
+                self.sent_offsets[col] = offset
+                changed.append(col)
+                changed.append(offset)
+        locked = 0
+        for col in range(board.columns):
+            if board.locked[col]:
+                locked |= 1 << col
+        self.send(MESSAGE_DELTA.pack(b"D", board.ticks, board.current_column, board.lives, locked,
+                                     len(changed) // 2) + bytes(changed))
+    
+    def handle_key(self, key):
+        board = self.board
+        if board.state == "playing":
+            if key == KEY_LEFT:
+                board.select(-1)
+                self.send_delta(force=True)
+            elif key == KEY_RIGHT:
+                board.select(1)
+                self.send_delta(force=True)
+            elif key == KEY_LOCK:
+                self.lock()
+        elif board.state == "won":
+            if key == KEY_DOUBLE:
+                self.bet(True)
+            elif key == KEY_STOP:
+                self.bet(False)
+        elif key == KEY_NEXT:
+            # 失败后重新开始本关
+            self.start_level()
+    
+    def lock(self):
+        result = self.board.lock()
+        if result is None:
+            return
+        METRICS.inc("locks_total", (("result", "hit" if result in ("hit", "won") else "miss"),))
+        self.send_delta(force=True)
+        self.send(MESSAGE_RESULT.pack(b"R", LOCK_RESULTS[result]))
+        if result in ("won", "lost"):
+            self.game_end = time.time()
+        if result == "won":
+            # 与win_game相同：进入下一关，加倍下注成功得双倍奖励
+            self.level = min(self.level + 1, LEVEL_MAX)
+            if self.is_double_bet:
+                self.change_coins(2, "double_bet_win")
+                self.is_double_bet = False
+                self.double_bet_amount = 0
+        elif result == "lost":
+            if self.is_double_bet:
+                self.change_coins(-self.double_bet_amount, "double_bet_loss")
+                self.is_double_bet = False
+                self.double_bet_amount = 0
+            self.record_game()
+    
+    def bet(self, double_bet):
+        """通关后的选择，与handle_bet相同；通关的一局连同下注选择一起记入历史"""
+        METRICS.inc("bets_total", (("choice", "double" if double_bet else "stop"),))
+        self.change_coins(1, "win_reward")
+        if double_bet:
+            self.change_coins(-1, "double_bet_stake")
+            self.is_double_bet = True
+            self.double_bet_amount = 1
+        else:
+            self.is_double_bet = False
+        self.record_game()
+        self.start_level()
+    
+    def change_coins(self, delta, reason):
+        self.game_coins += delta
+        if self.username:
+            self.server.coins.append((self.username, delta, reason, self.session_id))
+    
+    def record_game(self):
+        self.server.record_game(self.username, self.board, self.game_start, self.game_level,
+                                self.game_lives, FEATURES.to_mask(self.features), self.game_bet,
+                                self.game_coins, self.game_end)
+
+# 会话服务器：一个asyncio进程中承载大量无界面的游戏会话；
+# 账户操作都在一个专用线程中进行，哈夫币变化攒成一批写入
+class SessionServer:
+    def __init__(self, manager=None, catalog=None, resolution=SERVER_RESOLUTION,
+                 coin_flush_interval=SERVER_COIN_FLUSH_INTERVAL, history=None):
+        self.manager = manager or AccountManager()
+        self.catalog = catalog or ShopCatalog()
+        self.history = history or GameHistory()
+        self.resolution = resolution
+        self.coin_flush_interval = coin_flush_interval
+        self.sessions = set()
+        self.coins = []   # 待写入的 (用户名, 变化, 原因, 会话)
+        self.wheel = None
+        self.loop = None
+        self.skipped_frames = 0
+        self.accounts = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-accounts")
+        METRICS.gauge("server_sessions", lambda: len(self.sessions), "会话服务器中的连接数")
+        METRICS.gauge("server_timers", lambda: self.wheel.count if self.wheel else 0, "计时轮中的定时数")
+    
+    def now(self):
+        return self.loop.time()
+    
+    async def serve(self, address, ready=None):
+        """在address上提供服务：纯数字为本机TCP端口，否则为Unix套接字路径"""
+        self.loop = asyncio.get_running_loop()
+        self.wheel = TimerWheel(self.now(), self.resolution)
+        if str(address).isdigit():
+            server = await self.loop.create_server(lambda: GameSession(self), SERVER_HOST, int(address),
+                                                  backlog=SERVER_BACKLOG)
+        else:
+            server = await self.loop.create_unix_server(lambda: GameSession(self), address,
+                                                       backlog=SERVER_BACKLOG)
+        tasks = [asyncio.ensure_future(self._drive()), asyncio.ensure_future(self._flush_loop())]
+        if ready is not None:
+            ready.set_result(server)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+            # 断开所有会话（退出登录），写入剩下的哈夫币后再关闭账户线程
+            for session in list(self.sessions):
+                session.transport.close()
+            await asyncio.sleep(0)
+            await self.flush_coins()
+            self.accounts.shutdown()
+    
+    async def _drive(self):
+        """推进计时轮：每个刻度取出到期的会话，滚动并发送帧差异"""
+        while True:
+            await asyncio.sleep(self.resolution)
+            now = self.now()
+            start = time.perf_counter()
+            due = self.wheel.expire(now)
+            for session in due:
+                if not session.closed:
+                    session.on_tick(now)
+            if due:
+                METRICS.inc("board_ticks_total", value=len(due))
+                METRICS.observe("tick_seconds", time.perf_counter() - start)
+    
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.coin_flush_interval)
+            await self.flush_coins()
+    
+    async def flush_coins(self):
+        """把攒下的哈夫币变化一次性交给账户线程（一批流水共用组提交），并把新余额发给客户端"""
+        if not self.coins:
+            return
+        batch, self.coins = self.coins, []
+        balances = await self.loop.run_in_executor(self.accounts, self.manager.apply_coin_changes, batch)
+        for session in list(self.sessions):
+            if session.username in balances:
+                session.send(MESSAGE_COINS.pack(b"C", balances[session.username]))
+    
+    def login(self, session, hello):
+        """登录，完成后回到事件循环开始游戏"""
+        username, _, password = hello.rstrip("\r").partition("\t")
+        if not username:
+            session.welcome(None, "游客")
+            return
+        session.username = username
+        asyncio.ensure_future(self._login(session, username, password))
+    
+    async def _login(self, session, username, password):
+        """查找账户和登录收尾在账户线程中进行；密码验证在哈希线程池中进行，
+        事件循环等待验证结果，期间账户线程可以处理其他登录和哈夫币写入"""
+        manager = self.manager
+        try:
+            verifying = await self.loop.run_in_executor(self.accounts, manager.begin_login, username, password)
+            result = await asyncio.wrap_future(verifying)
+            account, text = await self.loop.run_in_executor(self.accounts, manager.finish_login, username, result)
+        except Exception as exc:
+            print(f"[会话] {username} 登录出错：{exc!r}", file=sys.stderr)
+            account, text = None, "登录失败，请稍后再试！"
+        if session.closed:
+            if account is not None:
+                self.logout(username)
+            return
+        session.welcome(account, text)
+    
+    def logout(self, username):
+        self.accounts.submit(self.manager.logout, username)
+    
+    def record_game(self, username, board, *args):
+        """在账户线程中写入游戏历史（攒够一批时要fsync，不阻塞事件循环）"""
+        self.accounts.submit(self.history.record_board, username, board, *args)
+    
+    def stats(self):
+        return {
+            "sessions": len(self.sessions),
+            "timers": self.wheel.count if self.wheel else 0,
+            "pending_coins": len(self.coins),
+            "skipped_frames": self.skipped_frames,
+        }
+
+# 竞速消息（与会话服务器相同，每条消息前有2字节长度）
+# 加入：协议版本，后接"用户名\t密码"
+RACE_JOIN = struct.Struct("<cB")
+# 开局：种子、关卡、玩家数、你的编号、赌注，后接以换行分隔的玩家名
+RACE_START = struct.Struct("<cQBBBi")
+# 帧时钟：帧号
+RACE_TICK = struct.Struct("<cI")
+# 客户端锁定：按键时显示的帧号、列
+RACE_LOCK = struct.Struct("<cIB")
+# 主机转发的锁定：玩家、帧号、列
+RACE_INPUT = struct.Struct("<cBIB")
+# 结束：最后的帧号，后接棋盘状态摘要
+RACE_END = struct.Struct("<cI")
+
+def split_messages(buffer):
+    """从接收缓冲区中取出完整的消息，返回 (消息列表, 剩余的字节)"""
+    messages = []
+    start = 0
+    while len(buffer) - start >= MESSAGE_LENGTH.size:
+        length = MESSAGE_LENGTH.unpack_from(buffer, start)[0]
+        end = start + MESSAGE_LENGTH.size + length
+        if end > len(buffer):
+            break
+        messages.append(bytes(buffer[start + MESSAGE_LENGTH.size:end]))
+        start = end
+    return messages, buffer[start:]
+
+def frame_message(message):
+    return MESSAGE_LENGTH.pack(len(message)) + message
+
+# 竞速模拟：所有玩家使用同一种子的棋盘，只由帧时钟和按顺序转发的锁定输入推进，
+# 主机和每个客户端用同样的输入得到完全相同的结果
+class RaceSim:
+    def __init__(self, seed, level, players):
+        spec = level_spec(level)
+        layout = LockBoard.generate_layout(spec["columns"], spec["rows"], spec["symbol_set"], seed)
+        # 为公平起见不使用各玩家的功能加成
+        self.players = players
+        self.level = level
+        self.boards = [LockBoard(interval=spec["interval"], lives=spec["lives"], layout=layout)
+                       for _ in players]
+        self.finished = [None] * len(players)  # 通关的帧号
+        self.frame = 0
+        for board in self.boards:
+            board.mark_shown(0)
+    
+    def tick(self):
+        self.frame += 1
+        for board in self.boards:
+            board.tick()
+            # 以帧号作为显示时间，lock(帧号)即按该帧判定
+            board.mark_shown(self.frame)
+    
+    def apply(self, player, frame, column):
+        """按frame时刻的画面锁定player的第column列，返回lock的结果"""
+        board = self.boards[player]
+        if board.state != "playing" or column >= board.columns:
+            return None
+        board.current_column = column
+        result = board.lock(frame)
+        if result == "won":
+            self.finished[player] = frame
+        return result
+    
+    def over(self):
+        """有人通关、全部失败或超过最长帧数时结束"""
+        return (any(board.state == "won" for board in self.boards)
+                or all(board.state != "playing" for board in self.boards)
+                or self.frame >= RACE_MAX_TICKS)
+    
+    def _rank_key(self, player):
+        board = self.boards[player]
+        if self.finished[player] is not None:
+            return (0, self.finished[player], 0, 0)
+        return (1, 0, -board.lock_count, board.misses)
+    
+    def standings(self):
+        """名次（玩家编号列表）和并列第一的玩家"""
+        order = sorted(range(len(self.players)), key=lambda player: (self._rank_key(player), player))
+        best = self._rank_key(order[0])
+        return order, [player for player in order if self._rank_key(player) == best]
+    
+    def digest(self):
+        """所有棋盘状态的摘要，用于确认各客户端的模拟结果一致（不含玩家自己移动的选中列）"""
+        state = [self.frame, self.finished]
+        for board in self.boards:
+            state.append([board.state, board.ticks, board.offsets, board.locked, board.lives,
+                          board.misses, board.lock_count])
+        return hashlib.sha256(json.dumps(state, separators=(",", ":")).encode("ascii")).digest()
+
+# 竞速主机的一个连接
+class RacePeer(asyncio.Protocol):
+    def __init__(self, host):
+        self.host = host
+        self.transport = None
+        self.username = None
+        self.player = None   # 开局后的玩家编号
+        self.buffer = b""
+    
+    def connection_made(self, transport):
+        self.transport = transport
+    
+    def connection_lost(self, exc):
+        self.host.leave(self)
+    
+    def data_received(self, data):
+        messages, self.buffer = split_messages(self.buffer + data)
+        for message in messages:
+            if message[:1] == b"J" and self.username is None:
+                if len(message) < RACE_JOIN.size:
+                    self.reject("消息格式错误")
+                    return
+                version = RACE_JOIN.unpack_from(message)[1]
+                if version != RACE_PROTOCOL:
+                    self.reject("协议版本不一致")
+                    return
+                hello = message[RACE_JOIN.size:].decode("utf-8", "replace")
+                self.username, _, password = hello.partition("\t")
+                if not self.username:
+                    self.reject("用户名不能为空！")
+                    return
+                self.host.join(self, password)
+            elif message[:1] == b"L" and self.player is not None:
+                if len(message) != RACE_LOCK.size:
+                    self.reject("消息格式错误")
+                    return
+                _, frame, column = RACE_LOCK.unpack(message)
+                self.host.lock(self.player, frame, column)
+    
+    def send(self, message):
+        if not self.transport.is_closing():
+            self.transport.write(frame_message(message))
+    
+    def reject(self, text):
+        self.send(b"X" + text.encode("utf-8"))
+        self.transport.close()
+
+# 竞速主机：验证密码后预扣赌注，接受玩家加入，广播种子和帧时钟，按收到的顺序转发锁定输入；
+# 结束时把奖金作为一批流水写入。开局前离开或比赛没有结束时退还赌注
+class RaceHost:
+    def __init__(self, players=2, stake=RACE_STAKE, level=1, manager=None, history=None):
+        if not 2 <= players <= RACE_MAX_PLAYERS:
+            raise ValueError(f"玩家数必须在2到{RACE_MAX_PLAYERS}之间")
+        self.players = players
+        self.stake = stake
+        self.level = level
+        self.manager = manager or AccountManager()
+        self.history = history or GameHistory()
+        self.peers = []
+        self.sim = None
+        self.race_id = uuid.uuid4().hex[:12]
+        self.joining = set()   # 正在预扣赌注的用户名
+        self.loop = None
+        self.result = None
+        self.started = None
+        self.finished = False  # 已开始结算，之后的输入和帧时钟都不再处理
+        self._clock = None
+        self.accounts = ThreadPoolExecutor(max_workers=1, thread_name_prefix="race-accounts")
+    
+    async def serve(self, port, bind=RACE_BIND, ready=None):
+        """等待玩家加入并进行一场比赛，返回结果"""
+        self.loop = asyncio.get_running_loop()
+        self.result = self.loop.create_future()
+        server = await self.loop.create_server(lambda: RacePeer(self), bind, port)
+        if ready is not None:
+            ready.set_result(server)
+        try:
+            async with server:
+                return await self.result
+        finally:
+            if self._clock is not None:
+                self._clock.cancel()
+            # 没有结算的比赛（开局前被中断或比赛中途退出）退还所有已预扣的赌注
+            if not self.finished:
+                for peer in self.peers:
+                    self.release(peer.username, refund=True)
+            self.accounts.shutdown()
+    
+    def join(self, peer, password):
+        asyncio.ensure_future(self._join(peer, password))
+    
+    async def _join(self, peer, password):
+        """与会话服务器一样验证密码（账户线程查找，哈希线程池验证），
+        再在账户线程中检查余额并预扣赌注，通过后加入"""
+        manager = self.manager
+        username = peer.username
+        try:
+            verifying = await self.loop.run_in_executor(self.accounts, manager.begin_login, username, password)
+            result = await asyncio.wrap_future(verifying)
+            account, error = await self.loop.run_in_executor(self.accounts, manager.finish_login, username, result)
+        except Exception as exc:
+            print(f"[竞速] {username} 登录出错：{exc!r}", file=sys.stderr)
+            account, error = None, "登录失败，请稍后再试！"
+        if account is None:
+            if not peer.transport.is_closing():
+                peer.reject(error)
+            return
+        reserved = False
+        if self.sim is not None:
+            error = "比赛已经开始！"
+        elif username in self.joining or any(other.username == username for other in self.peers):
+            error = "该账户已加入比赛！"
+        elif not peer.transport.is_closing():
+            self.joining.add(username)
+            try:
+                error = await self.loop.run_in_executor(self.accounts, self.reserve, username)
+            except Exception as exc:
+                print(f"[竞速] {username} 预扣赌注出错：{exc!r}", file=sys.stderr)
+                error = "加入失败，请稍后再试！"
+            finally:
+                self.joining.discard(username)
+            reserved = error is None
+            if reserved and self.sim is None and not peer.transport.is_closing():
+                self.peers.append(peer)
+                if len(self.peers) == self.players:
+                    self.start()
+                return
+        # 没能加入：退出登录，已预扣的赌注退还
+        self.release(username, refund=reserved)
+        if not peer.transport.is_closing():
+            peer.reject(error or "比赛已经开始！")
+    
+    def reserve(self, username):
+        """预扣赌注（在账户线程中执行）：余额检查和扣款之间没有其他写入，比赛中花掉的哈夫币不会让余额变成负数"""
+        account = self.manager.get_account(username)
+        if account is None or account.haf_coin < self.stake:
+            return "哈夫币不足以支付赌注！"
+        self.manager.change_coins(username, -self.stake, "race_stake", self.race_id, wait=True)
+        return None
+    
+    def release(self, username, refund=False):
+        """在账户线程中退出登录，refund为True时退还预扣的赌注"""
+        def run():
+            if refund:
+                self.manager.change_coins(username, self.stake, "race_refund", self.race_id, wait=True)
+            self.manager.logout(username)
+        self.accounts.submit(run)
+    
+    def leave(self, peer):
+        # 开局前离开的玩家让出位置并取回赌注；开局后其棋盘停在原地，赌注照常结算
+        if self.sim is None and peer in self.peers:
+            self.peers.remove(peer)
+            self.release(peer.username, refund=True)
+    
+    def start(self):
+        seed = random.getrandbits(64)
+        self.started = time.time()
+        names = [peer.username for peer in self.peers]
+        self.sim = RaceSim(seed, self.level, names)
+        payload = "\n".join(names).encode("utf-8")
+        for player, peer in enumerate(self.peers):
+            peer.player = player
+            peer.send(RACE_START.pack(b"S", seed, self.level, len(names), player, self.stake) + payload)
+        self._clock = asyncio.ensure_future(self._run_clock())
+    
+    async def _run_clock(self):
+        """统一的帧时钟：按关卡的滚动间隔广播帧号"""
+        interval = self.sim.boards[0].interval / 1000
+        deadline = self.loop.time() + interval
+        while True:
+            await asyncio.sleep(max(0, deadline - self.loop.time()))
+            if self.finished:
+                return
+            deadline += interval
+            self.sim.tick()
+            self.broadcast(RACE_TICK.pack(b"T", self.sim.frame))
+            if self.sim.over():
+                self.finish()
+                return
+    
+    def lock(self, player, frame, column):
+        """转发锁定输入；帧号只能是主机收到输入时最近发出的帧或稍早几帧，
+        超出范围的限制到范围内，所有客户端按同样的值判定"""
+        if self.sim is None or self.finished:
+            return
+        # 客户端拿得到种子和完整模拟，不能让它回溯去挑正确符号恰好在中间的那一帧
+        frame = min(max(frame, self.sim.frame - RACE_INPUT_WINDOW, 0), self.sim.frame)
+        self.sim.apply(player, frame, column)
+        self.broadcast(RACE_INPUT.pack(b"I", player, frame, column))
+        if self.sim.over():
+            self._clock.cancel()
+            self.finish()
+    
+    def broadcast(self, message):
+        for peer in self.peers:
+            peer.send(message)
+    
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        self.broadcast(RACE_END.pack(b"E", self.sim.frame) + self.sim.digest())
+        order, winners = self.sim.standings()
+        # 赌注已在加入时扣除，奖池由并列第一的玩家平分，余数归名次最前的玩家
+        names = self.sim.players
+        pot = self.stake * len(names)
+        changes = []
+        coins = [-self.stake] * len(names)
+        for index, player in enumerate(winners):
+            share = pot // len(winners) + (pot % len(winners) if index == 0 else 0)
+            changes.append((names[player], share, "race_win", self.race_id))
+            coins[player] += share
+        end = time.time()
+        lives = level_spec(self.level)["lives"]
+        
+        def settle():
+            self.manager.apply_coin_changes(changes, True)
+            balances = {}
+            for player, name in enumerate(names):
+                balances[name] = self.manager.ledger.balance(name)
+                self.manager.logout(name)
+                # 每个玩家的棋盘记为一局（没有结束的按当时的状态记为未通关），不使用功能加成，不涉及加倍下注
+                self.history.record_board(name, self.sim.boards[player], self.started, self.level, lives,
+                                          coins=coins[player], end=end)
+            return balances
+        
+        def settled(future):
+            for peer in self.peers:
+                peer.transport.close()
+            self.result.set_result({
+                "race": self.race_id,
+                "frames": self.sim.frame,
+                "standings": [names[player] for player in order],
+                "winners": [names[player] for player in winners],
+                "balances": future.result(),
+            })
+        
+        self.loop.run_in_executor(self.accounts, settle).add_done_callback(
+            lambda future: self.loop.call_soon_threadsafe(settled, future))
+
+# 竞速客户端：后台线程只负责接收消息，模拟在调用poll的线程（Tk主线程）中进行
+class RaceClient:
+    def __init__(self, address, username, password):
+        host, _, port = address.rpartition(":")
+        self.sock = socket.create_connection((host or "127.0.0.1", int(port)), timeout=RACE_CONNECT_TIMEOUT)
+        self.sock.settimeout(None)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.username = username
+        self.sim = None
+        self.player = None
+        self.stake = 0
+        self.closed = False
+        self.rejected = None   # 主机拒绝加入的原因
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.started = time.monotonic()
+        self.inbox = deque()   # 收到的消息，None表示连接已断开
+        self._send(RACE_JOIN.pack(b"J", RACE_PROTOCOL) + f"{username}\t{password}".encode("utf-8"))
+        self._thread = threading.Thread(target=self._receive, name="race-client", daemon=True)
+        self._thread.start()
+    
+    def _send(self, message):
+        data = frame_message(message)
+        self.bytes_sent += len(data)
+        self.sock.sendall(data)
+    
+    def _receive(self):
+        buffer = b""
+        try:
+            while True:
+                data = self.sock.recv(4096)
+                if not data:
+                    break
+                self.bytes_received += len(data)
+                messages, buffer = split_messages(buffer + data)
+                self.inbox.extend(messages)
+        except OSError:
+            pass
+        self.inbox.append(None)
+    
+    def poll(self):
+        """按顺序处理收到的消息，更新本地模拟，返回事件列表"""
+        events = []
+        while self.inbox:
+            message = self.inbox.popleft()
+            if message is None:
+                self.closed = True
+                events.append(("closed",))
+                break
+            kind = message[:1]
+            if kind == b"S":
+                _, seed, level, count, self.player, self.stake = RACE_START.unpack_from(message)
+                names = message[RACE_START.size:].decode("utf-8").split("\n")
+                self.sim = RaceSim(seed, level, names)
+                events.append(("start",))
+            elif kind == b"T":
+                frame = RACE_TICK.unpack(message)[1]
+                self.sim.tick()
+                if frame != self.sim.frame:
+                    events.append(("desync", frame, self.sim.frame))
+                events.append(("tick", frame))
+            elif kind == b"I":
+                _, player, frame, column = RACE_INPUT.unpack(message)
+                events.append(("input", player, self.sim.apply(player, frame, column)))
+            elif kind == b"E":
+                frame = RACE_END.unpack_from(message)[1]
+                order, winners = self.sim.standings()
+                events.append(("end", order, winners, message[RACE_END.size:] == self.sim.digest()))
+            elif kind == b"X":
+                self.rejected = message[1:].decode("utf-8", "replace")
+                events.append(("rejected", self.rejected))
+        return events
+    
+    def own_board(self):
+        return self.sim.boards[self.player] if self.sim is not None else None
+    
+    def lock(self):
+        """发送锁定：当前显示的帧号和选中的列，判定等主机转发回来后进行"""
+        board = self.own_board()
+        if board is None or board.state != "playing" or self.closed:
+            return
+        try:
+            self._send(RACE_LOCK.pack(b"L", self.sim.frame, board.current_column))
+        except OSError:
+            self.closed = True
+    
+    def stats(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return {
+            "bytes_sent_per_second": round(self.bytes_sent / elapsed, 1),
+            "bytes_received_per_second": round(self.bytes_received / elapsed, 1),
+        }
+    
+    def close(self):
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+# 批量环境：N个同一关卡的棋盘放在NumPy数组中一起推进，用于评估自动玩家和发现刷币策略。
+# 每步先执行动作再滚动一帧；奖励为本步的哈夫币变化（与win_game和handle_bet相同），
+# 结束的棋盘立即换新布局，加倍下注状态保留到下一局
+class LockEnv:
+    # 动作：不动、左、右、锁定
+    NOOP, LEFT, RIGHT, LOCK = 0, 1, 2, 3
+    PLAYING, WON, LOST = 0, 1, 2
+    
+    def __init__(self, level=1, features=(), catalog=None):
+        try:
+            import numpy
+        except ImportError:
+            raise RuntimeError("批量环境需要NumPy：pip install numpy") from None
+        self.np = numpy
+        self.spec = level_spec(level)
+        self.settings = board_settings(self.spec, list(features), catalog or ShopCatalog())
+        self.columns = self.spec["columns"]
+        self.rows = self.spec["rows"]
+        self.symbol_set = self.spec["symbol_set"]
+        self.n = 0
+        self.rng = None
+    
+    def reset(self, n, seed=None):
+        """生成n个棋盘，返回观测"""
+        np = self.np
+        self.n = n
+        self.rng = np.random.default_rng(seed)
+        shape = (n, self.columns)
+        self.targets = np.zeros(shape, np.uint8)
+        self.symbols = np.zeros(shape + (self.rows,), np.uint8)
+        self.offsets = np.zeros(shape, np.int64)
+        self.locked = np.zeros(shape, bool)
+        self.current = np.zeros(n, np.int64)
+        self.lives = np.zeros(n, np.int64)
+        self.state = np.zeros(n, np.int8)
+        self.double_bet = np.zeros(n, bool)
+        self._restart(np.arange(n))
+        return self.observe()
+    
+    def _new_boards(self, index):
+        """为index中的棋盘生成新布局（与generate_layout规则相同：每列一个正确符号，各列在不同行）"""
+        np = self.np
+        count = len(index)
+        targets = self.rng.integers(0, len(self.symbol_set), (count, self.columns), dtype=np.uint8)
+        symbols = self.rng.integers(0, len(self.symbol_set), (count, self.columns, self.rows), dtype=np.uint8)
+        if self.columns <= self.rows:
+            target_rows = self.rng.random((count, self.rows)).argsort(axis=1)[:, :self.columns]
+        else:
+            target_rows = self.rng.integers(0, self.rows, (count, self.columns))
+        np.put_along_axis(symbols, target_rows[..., None], targets[..., None], axis=2)
+        self.targets[index] = targets
+        self.symbols[index] = symbols
+    
+    def _restart(self, index):
+        self._new_boards(index)
+        self.offsets[index] = 0
+        self.locked[index] = False
+        self.current[index] = 0
+        self.lives[index] = self.settings["lives"]
+        self.state[index] = self.PLAYING
+    
+    def observe(self):
+        """观测：每格显示的符号（符号表下标）、目标密码、已锁定的列、选中的列和剩余生命"""
+        np = self.np
+        rows = (np.arange(self.rows) - self.offsets[..., None]) % self.rows
+        return {
+            "visible": np.take_along_axis(self.symbols, rows, axis=2),
+            "targets": self.targets.copy(),
+            "locked": self.locked.copy(),
+            "column": self.current.copy(),
+            "lives": self.lives.copy(),
+        }
+    
+    def _next_unlocked(self, index):
+        """select_next_unlocked：从当前列往后找第一个未锁定的列，都锁定时不动"""
+        np = self.np
+        steps = np.arange(1, self.columns + 1)
+        candidates = (self.current[index, None] + steps) % self.columns
+        free = ~self.locked[index[:, None], candidates]
+        first = free.argmax(axis=1)
+        has_free = free.any(axis=1)
+        self.current[index] = np.where(has_free, candidates[np.arange(len(index)), first], self.current[index])
+    
+    def step(self, actions, bets=None):
+        """actions为每个棋盘的动作；bets为通关时是否加倍下注（默认不加倍）。
+        
+        返回 (观测, 奖励, 本步结束的棋盘, 信息)。
+        """
+        np = self.np
+        actions = np.asarray(actions)
+        bets = np.zeros(self.n, bool) if bets is None else np.asarray(bets, bool)
+        reward = np.zeros(self.n, np.int64)
+        playing = self.state == self.PLAYING
+        
+        # 移动选中的列
+        move = np.where(actions == self.LEFT, -1, np.where(actions == self.RIGHT, 1, 0))
+        self.current = np.where(playing, (self.current + move) % self.columns, self.current)
+        
+        # 锁定：判定当前列中间行的符号
+        boards = np.flatnonzero(playing & (actions == self.LOCK))
+        col = self.current[boards]
+        boards = boards[~self.locked[boards, col]]
+        col = self.current[boards]
+        middle = (self.rows // 2 - self.offsets[boards, col]) % self.rows
+        hit = self.symbols[boards, col, middle] == self.targets[boards, col]
+        
+        hits = boards[hit]
+        self.locked[hits, self.current[hits]] = True
+        won = hits[self.locked[hits].all(axis=1)]
+        self.state[won] = self.WON
+        self._next_unlocked(hits[self.state[hits] == self.PLAYING])
+        
+        # 错误：有额外生命时用掉一条，否则失败
+        misses = boards[~hit]
+        has_life = self.lives[misses] > 0
+        spare = misses[has_life]
+        self.lives[spare] -= 1
+        self._next_unlocked(spare)
+        lost = misses[~has_life]
+        self.state[lost] = self.LOST
+        
+        # 哈夫币：加倍下注的一局赢了得2个、输了失去赌注；通关后停止下注得1个，
+        # 加倍下注先得1个再押上1个
+        reward[won] += np.where(self.double_bet[won], 2, 0)
+        reward[won] += np.where(bets[won], 0, 1)
+        self.double_bet[won] = bets[won]
+        reward[lost] -= self.double_bet[lost].astype(np.int64)
+        self.double_bet[lost] = False
+        
+        # 滚动一帧：仍在进行的棋盘中未锁定的列偏移加一
+        self.offsets += (self.state == self.PLAYING)[:, None] & ~self.locked
+        
+        done = self.state != self.PLAYING
+        info = {"won": self.state == self.WON, "lost": self.state == self.LOST}
+        finished = np.flatnonzero(done)
+        if len(finished):
+            self._restart(finished)
+        return self.observe(), reward, done, info
+    
+    def evaluate(self, policy, n, steps, seed=None, double_bet=False):
+        """用policy(观测) -> 动作 玩steps帧，统计胜负和哈夫币"""
+        np = self.np
+        obs = self.reset(n, seed)
+        bets = np.full(n, double_bet)
+        coins = np.zeros(n, np.int64)
+        won = lost = 0
+        for _ in range(steps):
+            obs, reward, done, info = self.step(policy(obs), bets)
+            coins += reward
+            won += int(info["won"].sum())
+            lost += int(info["lost"].sum())
+        games = won + lost
+        return {
+            "boards": n,
+            "frames": steps,
+            "won": won,
+            "lost": lost,
+            "win_rate": round(won / games, 4) if games else 0.0,
+            "coins_per_game": round(float(coins.sum()) / games, 4) if games else 0.0,
+            "coins_per_1000_frames": round(float(coins.sum()) / n / steps * 1000, 4),
+        }
+    
+    def aimed_policy(self, obs):
+        """示例策略：选中列的中间行是正确符号时锁定"""
+        np = self.np
+        index = np.arange(self.n)
+        middle = obs["visible"][index, obs["column"], self.rows // 2]
+        return np.where(middle == obs["targets"][index, obs["column"]], self.LOCK, self.NOOP)
+    
+    def random_policy(self, obs):
+        """示例策略：随机按键"""
+        return self.rng.integers(0, 4, self.n)
@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+# 游戏脚本的文件名带空格，测试直接导入与界面无关的引擎模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lock_engine
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """引擎的文件都在当前目录下，每个测试在自己的临时目录中运行"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def open_manager():
+    """打开AccountManager，测试结束时关闭还开着的"""
+    opened = []
+    
+    def open_manager(**kwargs):
+        manager = lock_engine.AccountManager(**kwargs)
+        opened.append(manager)
+        return manager
+    
+    yield open_manager
+    for manager in opened:
+        manager.close()
@@ -0,0 +1,100 @@
+import os
+import threading
+
+from lock_engine import AccountStore, encode_line
+
+
+def open_store(accounts=None):
+    store = AccountStore()
+    store.open(accounts if accounts is not None else {"admin": {"haf_coin": 1}})
+    return store
+
+
+def test_replay_truncates_torn_last_line():
+    store = open_store()
+    store.put("admin", {"haf_coin": 2})
+    store.put("alice", {"haf_coin": 5, "banned": False})
+    store.close()
+    good = os.path.getsize(store.journal_path)
+    # 写到一半时退出：最后一行没有写完
+    with open(store.journal_path, 'ab') as f:
+        f.write(encode_line({"user": "admin", "patch": {"haf_coin": 99}})[:20])
+    
+    store = open_store()
+    assert store.get("admin") == {"haf_coin": 2}
+    assert store.get("alice") == {"haf_coin": 5, "banned": False}
+    assert os.path.getsize(store.journal_path) == good
+    # 截掉之后追加的修改可以正常重放
+    store.put("admin", {"haf_coin": 3})
+    store.close()
+    store = open_store()
+    assert store.get("admin") == {"haf_coin": 3}
+    store.close()
+
+
+def test_replay_stops_at_corrupt_line():
+    store = open_store()
+    store.put("admin", {"haf_coin": 2})
+    store.put("admin", {"haf_coin": 3})
+    store.close()
+    with open(store.journal_path, 'rb') as f:
+        lines = f.readlines()
+    # 校验码对不上的一行和之后的内容都不重放
+    lines[1] = lines[1].replace(b"3", b"4")
+    with open(store.journal_path, 'wb') as f:
+        f.writelines(lines)
+    
+    store = open_store()
+    assert store.get("admin") == {"haf_coin": 2}
+    assert os.path.getsize(store.journal_path) == len(lines[0])
+    store.close()
+
+
+def test_compaction_waits_for_open_snapshots():
+    store = open_store({f"user{i}": {"haf_coin": i} for i in range(50)})
+    store.put("user1", {"haf_coin": 100})
+    snapshot = store.snapshot()
+    compactor = threading.Thread(target=store.compact)
+    compactor.start()
+    compactor.join(0.2)
+    # 快照还开着，账户文件不能被替换；期间读写照常
+    assert compactor.is_alive()
+    store.put("user2", {"haf_coin": 200})
+    store.put("new", {"haf_coin": 7})
+    assert store.get("user2") == {"haf_coin": 200}
+    assert snapshot.get("user1") == {"haf_coin": 100}
+    assert snapshot.get("user2") == {"haf_coin": 2}
+    assert "new" not in snapshot
+    assert len(list(snapshot.items())) == 50
+    snapshot.close()
+    compactor.join(5)
+    assert not compactor.is_alive()
+    
+    # 合并进去的补丁不再待合并，合并期间的补丁还在
+    assert "user1" not in store.pending
+    assert set(store.pending) == {"user2", "new"}
+    assert store.get("user1") == {"haf_coin": 100}
+    store.close()
+    store = open_store()
+    expected = {f"user{i}": {"haf_coin": i} for i in range(50)}
+    expected.update(user1={"haf_coin": 100}, user2={"haf_coin": 200}, new={"haf_coin": 7})
+    assert dict(store.items()) == expected
+    store.close()
+
+
+def test_open_rejoins_unfinished_compaction():
+    store = open_store()
+    store.put("admin", {"haf_coin": 2})
+    store.close()
+    # 合并中途退出：旧日志已改名，之后的修改写在新日志中
+    os.replace(store.journal_path, store.compacting_path)
+    with open(store.journal_path, 'wb') as f:
+        f.write(encode_line({"user": "admin", "patch": {"banned": True}}))
+    
+    store = open_store()
+    assert store.get("admin") == {"haf_coin": 2, "banned": True}
+    assert not os.path.exists(store.compacting_path)
+    store.close()
+    store = open_store()
+    assert store.get("admin") == {"haf_coin": 2, "banned": True}
+    store.close()
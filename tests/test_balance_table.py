@@ -0,0 +1,53 @@
+import os
+
+import lock_engine
+from lock_engine import AccountRecord, BalanceTable
+
+
+def test_rebuilt_from_accounts_and_ledger(open_manager):
+    manager = open_manager()
+    manager.register("alice", "secret")
+    manager.change_coins("alice", 30, "test")
+    manager.change_coins("admin", -9, "buy")
+    manager.ban_account("alice")
+    manager.close()
+    # 热字段表丢失：从账户文件补上槽位，余额按流水
+    os.remove(manager.table.path)
+    os.remove(manager.table.slots_path)
+    
+    manager = open_manager()
+    assert manager.table.coins("alice") == 30
+    assert manager.table.coins("admin") == 990
+    assert manager.table.read("alice")["banned"]
+    assert manager.get_account("alice").haf_coin == 30
+
+
+def test_unflushed_coins_restored_from_ledger(open_manager):
+    manager = open_manager()
+    manager.change_coins("admin", 1, "test")
+    manager.close()
+    # 映射中的余额没来得及写回（断电），流水已经落盘
+    table = BalanceTable()
+    table.set_coins("admin", 0)
+    table.close()
+    
+    manager = open_manager()
+    assert manager.table.coins("admin") == 1000
+    assert manager.get_account("admin").haf_coin == 1000
+
+
+def test_readonly_table_follows_writer(monkeypatch):
+    monkeypatch.setattr(lock_engine, "TABLE_INITIAL_SLOTS", 4)
+    # 写入方还没有建立表时只读打开
+    reader = BalanceTable(readonly=True)
+    assert reader.coins("user0") is None
+    writer = BalanceTable()
+    for index in range(10):
+        writer.write_account(f"user{index}", AccountRecord.from_json(f"user{index}", {"haf_coin": index}))
+    assert writer.capacity >= 10
+    # 文件扩展之后新增的账户也能读到
+    assert reader.coins("user9") == 9
+    assert reader.coins("user3") == 3
+    assert reader.coins("missing") is None
+    reader.close()
+    writer.close()
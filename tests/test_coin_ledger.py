@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+from lock_engine import CoinLedger, decode_line
+
+
+def read_lines(path):
+    with open(path, 'rb') as f:
+        return f.readlines()
+
+
+@pytest.mark.parametrize("keep", [0, 1, 2])
+def test_recover_drops_partial_batch(keep):
+    ledger = CoinLedger()
+    ledger.append("alice", 10, "opening")
+    ledger.append_batch([("alice", -5, "race_stake", "r1"), ("bob", 5, "race_stake", "r1"),
+                         ("alice", 3, "race_win", "r1")])
+    ledger.close()
+    lines = read_lines(ledger.path)
+    assert [decode_line(line).get("more") for line in lines] == [None, 2, 1, None]
+    # 批量交易只写下了前keep条（最后一条写了一半）
+    with open(ledger.path, 'wb') as f:
+        f.writelines(lines[:1 + keep])
+        f.write(lines[1 + keep][:10])
+    
+    ledger = CoinLedger()
+    assert ledger.balances == {"alice": 10}
+    assert ledger.seq == 1
+    assert not ledger.has_account("bob")
+    assert os.path.getsize(ledger.path) == len(lines[0])
+    # 截掉之后追加的交易接在完整的流水后面
+    ledger.append("bob", 1, "test")
+    ledger.close()
+    ledger = CoinLedger()
+    assert ledger.balances == {"alice": 10, "bob": 1}
+    assert ledger.seq == 2
+    ledger.close()
+
+
+def test_recover_from_snapshot_and_tail():
+    ledger = CoinLedger(snapshot_interval=3)
+    ledger.append("alice", 10, "opening")
+    ledger.append("alice", -1, "buy")
+    ledger.append("alice", 4, "win")
+    assert os.path.exists(ledger.snapshot_path)
+    ledger.append_batch([("alice", -2, "race_stake", "r1"), ("bob", 2, "race_win", "r1")])
+    ledger.close()
+    lines = read_lines(ledger.path)
+    with open(ledger.path, 'wb') as f:
+        f.writelines(lines[:-1])
+    
+    # 快照之后的完整交易生效，没写完的批量交易丢弃
+    ledger = CoinLedger(snapshot_interval=3)
+    assert ledger.balances == {"alice": 13}
+    assert ledger.seq == 3
+    assert os.path.getsize(ledger.path) == sum(len(line) for line in lines[:3])
+    ledger.close()
+
+
+def test_query_by_user_and_reason():
+    ledger = CoinLedger()
+    ledger.append("alice", 10, "opening")
+    ledger.append_batch([("alice", -5, "race_stake", "r1"), ("bob", 5, "race_win", "r1")])
+    assert [entry["delta"] for entry in ledger.query(username="alice")] == [10, -5]
+    assert [entry["user"] for entry in ledger.query(reason="race_win")] == ["bob"]
+    ledger.append("bob", 1, "race_win")
+    assert [entry["delta"] for entry in ledger.query(username="bob", reason="race_win")] == [5, 1]
+    ledger.close()
+
+
+def test_account_file_reconciled_with_ledger(open_manager):
+    manager = open_manager()
+    manager.change_coins("admin", -9, "buy")
+    # 哈夫币只写入流水和热字段表，账户文件中还是旧值
+    assert manager.store.get("admin")["haf_coin"] == 999
+    manager.close()
+    
+    manager = open_manager()
+    manager.readers.submit(lambda: None).result()
+    assert manager.store.get("admin")["haf_coin"] == 990
+    assert manager.get_account("admin").haf_coin == 990
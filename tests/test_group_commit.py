@@ -0,0 +1,42 @@
+import threading
+
+from lock_engine import GroupCommitter
+
+
+def test_concurrent_requests_share_fsyncs():
+    committer = GroupCommitter(window=0.02)
+    with open("data.bin", 'ab') as f:
+        def save():
+            for _ in range(5):
+                committer.request(f)
+        
+        threads = [threading.Thread(target=save) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert committer.requests == 40
+    assert committer.syncs < committer.requests
+
+
+def test_future_completes_after_sync():
+    committer = GroupCommitter()
+    assert committer.future().done()
+    with open("data.bin", 'ab') as f:
+        ticket = committer.request(f, wait=False)
+        future = committer.future(ticket)
+        assert future.result(timeout=5) >= ticket
+        # 已经落盘的票号直接返回完成的Future
+        assert committer.future(ticket).done()
+
+
+def test_unwaited_writes_are_saved(open_manager):
+    manager = open_manager(wait_writes=False)
+    manager.update_account("admin", {"shop_disabled": True})
+    ticket = manager.store.put("admin", {"banned": True}, wait=False)
+    assert manager.saved().result(timeout=5) >= ticket
+    manager.close()
+    
+    manager = open_manager()
+    account = manager.get_account("admin")
+    assert account.shop_disabled and account.banned
@@ -0,0 +1,194 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import lock_engine
+from lock_engine import GameHistory, RaceClient, RaceHost, RacePeer, frame_message
+
+STAKE = 5
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.01)
+
+
+class HostThread:
+    """在后台线程的事件循环中运行一场比赛"""
+    
+    def __init__(self, host):
+        self.host = host
+        self.address = None
+        self.result = None
+        started = threading.Event()
+        
+        async def serve():
+            ready = asyncio.get_running_loop().create_future()
+            task = asyncio.ensure_future(host.serve(0, "127.0.0.1", ready))
+            server = await ready
+            self.address = "127.0.0.1:%d" % server.sockets[0].getsockname()[1]
+            started.set()
+            try:
+                self.result = await task
+            except asyncio.CancelledError:
+                pass
+        
+        self.thread = threading.Thread(target=asyncio.run, args=(serve(),))
+        self.thread.start()
+        started.wait(5)
+    
+    def stop(self):
+        """没有结束的比赛：取消等待，主机退还赌注后退出"""
+        if self.thread.is_alive():
+            self.host.loop.call_soon_threadsafe(self.host.result.cancel)
+        self.thread.join(5)
+
+
+@pytest.fixture
+def race(open_manager, monkeypatch):
+    # 加快帧时钟，比赛在一秒内结束
+    level_spec = lock_engine.level_spec
+    monkeypatch.setattr(lock_engine, "level_spec", lambda level: dict(level_spec(level), interval=20))
+    manager = open_manager()
+    for name in ("p1", "p2", "poor"):
+        manager.register(name, "pw")
+    manager.set_coins("p1", 20, "test")
+    manager.set_coins("p2", 20, "test")
+    history = GameHistory()
+    hosts = []
+    
+    def start(players=2):
+        host = HostThread(RaceHost(players, STAKE, 1, manager=manager, history=history))
+        hosts.append(host)
+        return host
+    
+    yield manager, history, start
+    for host in hosts:
+        host.stop()
+    history.close()
+
+
+def rejection(address, username, password):
+    client = RaceClient(address, username, password)
+    
+    def closed():
+        client.poll()
+        return client.closed
+    
+    wait_for(closed)
+    client.close()
+    return client.rejected
+
+
+def test_join_checks_password_and_stake(race):
+    manager, history, start = race
+    host = start()
+    assert rejection(host.address, "p1", "wrong") == "用户名或密码错误！"
+    assert rejection(host.address, "nobody", "pw") == "用户名或密码错误！"
+    assert rejection(host.address, "poor", "pw") == "哈夫币不足以支付赌注！"
+    assert manager.ledger.balance("p1") == 20
+    assert manager.ledger.balance("poor") == 0
+    assert host.host.peers == []
+    assert manager.cache.pinned == {}
+
+
+class FakeTransport:
+    def __init__(self):
+        self.data = b""
+        self.closed = False
+    
+    def write(self, data):
+        self.data += data
+    
+    def is_closing(self):
+        return self.closed
+    
+    def close(self):
+        self.closed = True
+
+
+@pytest.mark.parametrize("message, player", [(b"J", None), (b"L\x01\x00", 0), (b"L" + bytes(7), 0)])
+def test_malformed_messages_rejected(message, player):
+    peer = RacePeer(None)
+    transport = FakeTransport()
+    peer.connection_made(transport)
+    peer.player = player
+    peer.data_received(frame_message(message))
+    assert transport.closed
+    assert transport.data[2:3] == b"X"
+
+
+def test_stake_reserved_on_join_and_refunded_on_leave(race):
+    manager, history, start = race
+    host = start()
+    client = RaceClient(host.address, "p1", "pw")
+    wait_for(lambda: manager.ledger.balance("p1") == 20 - STAKE)
+    assert [entry["reason"] for entry in manager.ledger.query(username="p1")][-1] == "race_stake"
+    client.close()
+    wait_for(lambda: manager.ledger.balance("p1") == 20)
+    wait_for(lambda: not host.host.peers)
+    # 主机在开局前退出时，已加入的玩家同样取回赌注
+    client = RaceClient(host.address, "p2", "pw")
+    wait_for(lambda: manager.ledger.balance("p2") == 20 - STAKE)
+    host.stop()
+    client.close()
+    assert manager.ledger.balance("p2") == 20
+    assert manager.cache.pinned == {}
+
+
+def play(client, skill, events):
+    """锁定中间行是正确符号的列，每次等主机转发回来后再锁下一列"""
+    waiting = False
+    while not client.closed:
+        for event in client.poll():
+            events.append(event)
+            if event[0] == "input" and event[1] == client.player:
+                waiting = False
+        board = client.own_board()
+        if skill and board is not None and board.state == "playing" and not waiting:
+            while board.locked[board.current_column]:
+                board.select(1)
+            column = board.current_column
+            if board.middle_symbol(column) == board.targets[column]:
+                client.lock()
+                waiting = True
+        time.sleep(0.002)
+
+
+def test_race_settles_once(race):
+    manager, history, start = race
+    host = start()
+    clients = {name: RaceClient(host.address, name, "pw") for name in ("p1", "p2")}
+    events = {name: [] for name in clients}
+    players = [threading.Thread(target=play, args=(clients[name], name == "p1", events[name]))
+               for name in clients]
+    for thread in players:
+        thread.start()
+    host.thread.join(10)
+    for thread in players:
+        thread.join(5)
+    
+    result = host.result
+    assert result["winners"] == ["p1"]
+    assert result["standings"] == ["p1", "p2"]
+    # 赌注在加入时扣除，奖池归获胜者
+    assert result["balances"] == {"p1": 20 + STAKE, "p2": 20 - STAKE}
+    assert manager.ledger.balance("p1") == 20 + STAKE
+    assert [entry["delta"] for entry in manager.ledger.query(reason="race_win")] == [2 * STAKE]
+    assert len(manager.ledger.query(reason="race_stake")) == 2
+    assert manager.cache.pinned == {}
+    for name in clients:
+        end = [event for event in events[name] if event[0] == "end"]
+        assert len(end) == 1
+        _, order, winners, consistent = end[0]
+        assert [clients[name].sim.players[player] for player in winners] == ["p1"]
+        assert consistent
+    # 两个玩家的棋盘各记为一局
+    history.flush()
+    results = history.aggregate(("player",), ("won", "coins"), {})
+    assert results == {("p1",): {"games": 1, "won": 1, "coins": STAKE},
+                       ("p2",): {"games": 1, "won": 0, "coins": -STAKE}}
@@ -0,0 +1,90 @@
+import os
+import random
+
+import pytest
+
+import lock_engine
+from lock_engine import UsernameIndex
+
+NAMES = [f"user{index:03d}" for index in range(200)] + ["alice", "alicia", "bob"]
+
+
+def open_index(names, merge_limit=1000):
+    index = UsernameIndex(stride=8, merge_limit=merge_limit)
+    index.open(lambda: iter(names), len(names))
+    return index
+
+
+def no_rebuild():
+    raise AssertionError("不应该重建索引")
+
+
+def test_membership_and_prefix():
+    index = open_index(NAMES)
+    index.add("alina")
+    index.add("user0999")
+    for name in NAMES + ["alina", "user0999"]:
+        assert name in index
+    for name in ("", "al", "alic", "user200", "zed"):
+        assert name not in index
+    assert index.prefix("ali") == ["alice", "alicia", "alina"]
+    assert index.prefix("user09") == ["user090", "user091", "user092", "user093", "user094", "user095",
+                                      "user096", "user097", "user098", "user099", "user0999"]
+    assert index.prefix("user1", limit=3) == ["user100", "user101", "user102"]
+    assert index.prefix("x") == []
+    assert len(index) == len(NAMES) + 2
+    index.close()
+
+
+def test_merge_and_reopen_without_rebuild():
+    index = open_index(NAMES)
+    index.add("carol")
+    index.add("alina")
+    index.merge()
+    assert index.recent == [] and index.count == len(NAMES) + 2
+    index.add("dave")
+    index.close()
+    # 数量与账户数一致时直接打开，日志中的新用户名补进布隆过滤器
+    index = UsernameIndex(stride=8)
+    index.open(no_rebuild, len(NAMES) + 3)
+    assert "carol" in index and "dave" in index and "alina" in index
+    assert index.prefix("ali") == ["alice", "alicia", "alina"]
+    index.close()
+
+
+def test_background_merge_keeps_new_names():
+    index = open_index(NAMES, merge_limit=5)
+    added = [f"new{number}" for number in range(23)]
+    for name in added:
+        index.add(name)
+    index.close()
+    assert not os.path.exists(index.merging_path)
+    index = UsernameIndex(stride=8)
+    index.open(no_rebuild, len(NAMES) + len(added))
+    assert all(name in index for name in added)
+    assert index.prefix("new2") == ["new2", "new20", "new21", "new22"]
+    index.close()
+
+
+@pytest.mark.parametrize("run", [7, 1000])
+def test_rebuild_sorts_and_deduplicates(monkeypatch, run):
+    monkeypatch.setattr(lock_engine, "USERNAME_SORT_RUN", run)
+    names = NAMES + NAMES[:10]
+    random.Random(1).shuffle(names)
+    index = UsernameIndex(stride=8)
+    index.rebuild(iter(names))
+    assert list(index._iter_file()) == sorted(NAMES)
+    assert index.count == len(NAMES)
+    assert not [path for path in os.listdir() if ".run" in path]
+    index.close()
+
+
+def test_count_mismatch_rebuilds():
+    index = open_index(NAMES)
+    index.close()
+    # 账户比索引多（例如日志丢失），从账户文件重建
+    index = UsernameIndex(stride=8)
+    index.open(lambda: iter(NAMES + ["late"]), len(NAMES) + 1)
+    assert "late" in index
+    assert index.count == len(NAMES) + 1
+    index.close()